@@ -17,6 +17,8 @@ POOL_ASYNC = tornadoredis.ConnectionPool(max_connections=500,
 
 REDIS_CLIENT = redis.Redis()
 
+AUTO_PIPELINE_CLIENT = tornadoredis.Client(auto_pipeline=True)
+
 
 class AsyncIncr(tornado.web.RequestHandler):
     client_kwargs = {}
@@ -37,6 +39,19 @@ class AsyncPooledIncr(AsyncIncr):
     client_kwargs = {'connection_pool': POOL_ASYNC}
 
 
+class AsyncAutoPipelinedIncr(tornado.web.RequestHandler):
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def get(self):
+        c = AUTO_PIPELINE_CLIENT
+        kk = ('f', 'b', 'z')
+        vals = yield [tornado.gen.Task(c.incr, k) for k in kk]
+        foo, bar, zar = ['%08d' % v for v in vals]
+        self.set_header('Content-Type', 'text/html')
+        self.render("template.html", title="Incr benchmark",
+                    foo=foo, bar=bar, zar=zar)
+
+
 class AsyncMset(tornado.web.RequestHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
@@ -83,6 +98,7 @@ application = tornado.web.Application([
     (r'/', AsyncIncr),
     (r'/redis-py/', SyncIncr),
     (r'/pool', AsyncPooledIncr),
+    (r'/auto-pipeline', AsyncAutoPipelinedIncr),
     (r'/mset', AsyncMset),
     (r'/redis-py/mset', SyncMset),
 ])
@@ -97,6 +113,7 @@ if __name__ == '__main__':
           'Use the following paths for benchmarking:\n' \
           '  / - increment benchmark\n' \
           '  /pool - connection pool benchmark\n' \
+          '  /auto-pipeline - automatic pipelining benchmark\n' \
           '  /mset - MSET benchmark\n' \
           '  /redis-py/ - increment benchmark\n' \
           '  /redis-py/mset - MSET benchmark'
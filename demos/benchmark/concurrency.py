@@ -0,0 +1,57 @@
+"""
+Measures the throughput of concurrent commands sent using a single
+tornado-redis client instance, with and without multiplexing
+and automatic pipelining.
+
+Usage:
+    python concurrency.py [number of concurrent requests] [number of rounds]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+import tornadoredis
+
+
+NUM_REQUESTS = 1000
+NUM_ROUNDS = 10
+
+
+@tornado.gen.engine
+def measure(name, client, num, rounds, callback=None):
+    yield tornado.gen.Task(client.set, 'foo', 'bar')
+    started = time.time()
+    for __ in range(rounds):
+        yield [tornado.gen.Task(client.get, 'foo') for __ in range(num)]
+    elapsed = time.time() - started
+    print('%-14s %10.0f requests per second'
+          % (name, num * rounds / elapsed))
+    callback(elapsed)
+
+
+@tornado.gen.engine
+def main(num, rounds):
+    print('%d concurrent requests, %d rounds' % (num, rounds))
+    yield tornado.gen.Task(measure, 'serialized',
+                           tornadoredis.Client(selected_db=9),
+                           num, rounds)
+    yield tornado.gen.Task(measure, 'multiplexed',
+                           tornadoredis.Client(selected_db=9,
+                                               multiplexed=True),
+                           num, rounds)
+    yield tornado.gen.Task(measure, 'auto-pipeline',
+                           tornadoredis.Client(selected_db=9,
+                                               auto_pipeline=True),
+                           num, rounds)
+    tornado.ioloop.IOLoop.current().stop()
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_REQUESTS
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_ROUNDS
+    main(num, rounds)
+    tornado.ioloop.IOLoop.current().start()
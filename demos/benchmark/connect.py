@@ -0,0 +1,103 @@
+"""
+Measures the IOLoop latency while tornado-redis clients connect
+to the Redis server and to a host that never accepts the connection.
+
+A PeriodicCallback records how late each of its calls is, a blocking
+connect shows up as a latency spike of the connection time.
+
+Usage:
+    python connect.py [number of clients] [unreachable host]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import tornado.gen
+import tornado.ioloop
+import tornado.stack_context
+
+import tornadoredis
+
+
+NUM_CLIENTS = 100
+UNREACHABLE_HOST = '10.255.255.1'
+CONNECT_TIMEOUT = 1
+TICK = 0.005
+
+
+class LatencyMonitor(object):
+
+    def __init__(self):
+        self.latencies = []
+        self._last = None
+        self._periodic = tornado.ioloop.PeriodicCallback(self.tick,
+                                                         TICK * 1000)
+
+    def start(self):
+        self.latencies = []
+        self._last = time.time()
+        self._periodic.start()
+
+    def stop(self):
+        self._periodic.stop()
+        return max(self.latencies) if self.latencies else 0
+
+    def tick(self):
+        now = time.time()
+        self.latencies.append(max(now - self._last - TICK, 0))
+        self._last = now
+
+
+@tornado.gen.engine
+def connect_all(clients, callback=None):
+    tasks = []
+    for client in clients:
+        tasks.append(tornado.gen.Task(client.ping))
+    results = yield tasks
+    callback(results)
+
+
+@tornado.gen.engine
+def measure(name, monitor, clients, callback=None):
+    monitor.start()
+    started = time.time()
+    results = yield tornado.gen.Task(connect_all, clients)
+    elapsed = time.time() - started
+    max_latency = monitor.stop()
+    failed = len([r for r in results
+                  if isinstance(r, tornadoredis.ConnectionError)])
+    print('%-12s %8.2f ms total, %8.2f ms max IOLoop latency, %d failed'
+          % (name, elapsed * 1000.0, max_latency * 1000.0, failed))
+    callback(elapsed)
+
+
+def ping_errors(client):
+    # Return connection errors instead of raising them
+    def ping(callback=None):
+        def on_error(*exc_info):
+            callback(exc_info[1])
+            return True
+        with tornado.stack_context.ExceptionStackContext(on_error):
+            client.execute_command('PING', callback=callback)
+    client.ping = ping
+    return client
+
+
+@tornado.gen.engine
+def main(num, unreachable_host):
+    monitor = LatencyMonitor()
+    clients = [tornadoredis.Client() for __ in range(num)]
+    yield tornado.gen.Task(measure, 'reachable', monitor, clients)
+    clients = [ping_errors(tornadoredis.Client(host=unreachable_host,
+                                               connect_timeout=CONNECT_TIMEOUT))
+               for __ in range(num)]
+    yield tornado.gen.Task(measure, 'unreachable', monitor, clients)
+    tornado.ioloop.IOLoop.current().stop()
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_CLIENTS
+    host = sys.argv[2] if len(sys.argv) > 2 else UNREACHABLE_HOST
+    tornado.ioloop.IOLoop.current().add_callback(main, num, host)
+    tornado.ioloop.IOLoop.current().start()
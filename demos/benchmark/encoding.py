@@ -0,0 +1,42 @@
+"""
+Measures how long it takes tornado-redis to encode a SET command
+with a small value and with a 1 MB value.
+
+Usage:
+    python encoding.py [number of iterations]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+import tornadoredis
+
+
+NUM_ITERATIONS = 100000
+
+
+def encode(client, *tokens):
+    data = client.format_command(*tokens)
+    # Older releases format commands as text strings
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return data
+
+
+def measure(name, client, number, *tokens):
+    elapsed = timeit.timeit(lambda: encode(client, *tokens), number=number)
+    print('%-20s %10.2f us per command' % (name, elapsed * 1e6 / number))
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ITERATIONS
+    client = tornadoredis.Client()
+    measure('SET small key', client, number, 'SET', 'key:1', 'value:1')
+    measure('SET int value', client, number, 'SET', 'key:1', 12345)
+    large_text = 'x' * (1024 * 1024)
+    large_bytes = large_text.encode('utf-8')
+    measure('SET 1 MB text', client, max(number // 1000, 10),
+            'SET', 'key:1', large_text)
+    measure('SET 1 MB bytes', client, max(number // 1000, 10),
+            'SET', 'key:1', large_bytes)
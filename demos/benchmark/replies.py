@@ -0,0 +1,75 @@
+"""
+Measures how long it takes tornado-redis to receive and decode
+large multi-bulk replies (MGET, LRANGE and HGETALL) and
+a large bulk reply (GET of a 10 MB binary value).
+
+Usage:
+    python replies.py [number of elements] [number of rounds]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+import tornadoredis
+
+
+NUM_ELEMENTS = 10000
+NUM_ROUNDS = 10
+LARGE_VALUE_SIZE = 10 * 1024 * 1024
+
+
+@tornado.gen.engine
+def prepare(client, num, callback=None):
+    yield tornado.gen.Task(client.flushdb)
+    pipe = client.pipeline()
+    pipe.mset(dict(('key:%d' % n, 'value:%d' % n) for n in range(num)))
+    pipe.rpush('list', *['value:%d' % n for n in range(num)])
+    pipe.hmset('hash', dict(('field:%d' % n, 'value:%d' % n)
+                            for n in range(num)))
+    pipe.set('large', b'x' * LARGE_VALUE_SIZE)
+    yield tornado.gen.Task(pipe.execute)
+    callback(True)
+
+
+@tornado.gen.engine
+def measure(name, rounds, task_factory, callback=None):
+    started = time.time()
+    for __ in range(rounds):
+        yield task_factory()
+    elapsed = time.time() - started
+    print('%-8s %8.2f ms per reply' % (name, elapsed * 1000.0 / rounds))
+    callback(elapsed)
+
+
+@tornado.gen.engine
+def main(num, rounds):
+    client = tornadoredis.Client(selected_db=9)
+    yield tornado.gen.Task(prepare, client, num)
+    keys = ['key:%d' % n for n in range(num)]
+    print('%d elements, %d rounds' % (num, rounds))
+    yield tornado.gen.Task(
+        measure, 'MGET', rounds,
+        lambda: tornado.gen.Task(client.mget, keys))
+    yield tornado.gen.Task(
+        measure, 'LRANGE', rounds,
+        lambda: tornado.gen.Task(client.lrange, 'list', 0, -1))
+    yield tornado.gen.Task(
+        measure, 'HGETALL', rounds,
+        lambda: tornado.gen.Task(client.hgetall, 'hash'))
+    raw_client = tornadoredis.Client(selected_db=9, decode_responses=False)
+    yield tornado.gen.Task(
+        measure, 'GET', rounds,
+        lambda: tornado.gen.Task(raw_client.get, 'large'))
+    yield tornado.gen.Task(client.flushdb)
+    tornado.ioloop.IOLoop.current().stop()
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ELEMENTS
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_ROUNDS
+    main(num, rounds)
+    tornado.ioloop.IOLoop.current().start()
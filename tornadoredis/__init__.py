@@ -1,4 +1,10 @@
-from .client import Connection, Client
+from .client import Connection, Client, RetryPolicy
 from .exceptions import (RedisError, ConnectionError, ResponseError,
-                         InvalidResponse)
-from .connection import ConnectionPool
+                         InvalidResponse, TimeoutError, MasterNotFoundError,
+                         ClusterError)
+from .connection import ConnectionPool, ReconnectPolicy
+from .sentinel import Sentinel, SentinelConnectionPool
+from .cluster import ClusterClient
+from .sharding import ShardedClient, HashRing
+from .replicas import ReplicaClient, HedgePolicy
+from .caching import NearCache
@@ -0,0 +1,285 @@
+import copy
+import logging
+from collections import OrderedDict
+
+from tornado import gen
+from tornado.escape import utf8
+from tornado.ioloop import IOLoop
+
+from .client import Client, CmdLine
+from .exceptions import ConnectionError, TimeoutError, ResponseError
+
+
+log = logging.getLogger('tornadoredis.caching')
+
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+# Approximate number of bytes taken by an entry besides its value
+ENTRY_OVERHEAD = 64
+
+
+def value_size(value):
+    """
+    Returns the approximate size of the reply in bytes.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return 8
+    if isinstance(value, dict):
+        return sum(value_size(k) + value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(value_size(item) for item in value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(utf8(value))
+
+
+class NearCache(object):
+    """
+    A client-side cache of GET, HGET, HGETALL and SMEMBERS replies
+    for clients created with the cache argument.
+
+    Arguments:
+        max_size - a maximum size of the cached replies in bytes
+                   (approximate), the least recently used replies
+                   are evicted to stay within the limit,
+        bcast - use the BCAST tracking mode: the server sends
+                invalidation messages for all the keys starting
+                with the prefixes, not only for the keys read
+                by the clients,
+        prefixes - key prefixes of the BCAST mode, all keys by default,
+        retry_interval - seconds to wait before subscribing again
+                         after the subscriber connection is lost,
+        **client_kwargs - arguments of the subscriber client, e.g. host,
+                          port and password of the Redis server.
+
+    The cache subscribes to the invalidation messages (Redis 6+)
+    on a dedicated connection and the clients enable CLIENT TRACKING
+    redirected to it on their connections. Replies are cached only
+    once the subscription is ready. The cache is flushed if the
+    subscriber connection or any of the tracking connections is lost,
+    as invalidation messages may have been missed.
+    """
+    def __init__(self, max_size=64 * 1024 * 1024, bcast=False, prefixes=(),
+                 retry_interval=1, io_loop=None, **client_kwargs):
+        self.max_size = max_size
+        self.bcast = bcast
+        self.prefixes = list(prefixes)
+        self.retry_interval = retry_interval
+        self._io_loop = io_loop or IOLoop.current()
+        client_kwargs['io_loop'] = self._io_loop
+        self.client_kwargs = client_kwargs
+        # The ID of the subscriber connection
+        self.client_id = None
+        self.size = 0
+        # Replies by (database, command, arguments),
+        # the least recently used first
+        self._entries = OrderedDict()
+        # Entry keys by Redis keys
+        self._keys = {}
+        # Redis keys being read: [number of reads, invalidated]
+        self._reads = {}
+        self._subscriber = None
+        self._subscribing = None
+        self._retry = None
+        self._closed = False
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._flushes = 0
+
+    def start(self, callback=None):
+        """
+        Connects the subscriber and subscribes to the invalidation
+        messages. Returns a Future resolved once subscribed.
+        """
+        self._closed = False
+        if self._subscribing is None:
+            if self._retry is not None:
+                self._io_loop.remove_timeout(self._retry)
+                self._retry = None
+            self._subscribing = self._subscribe()
+            self._subscribing.add_done_callback(self._on_subscribed)
+        future = self._subscribing
+        if callback:
+            self._io_loop.add_future(future,
+                                     lambda future: callback(future.result()))
+            return None
+        return future
+
+    def close(self):
+        """
+        Closes the subscriber connection and flushes the cache.
+        """
+        self._closed = True
+        if self._retry is not None:
+            self._io_loop.remove_timeout(self._retry)
+            self._retry = None
+        subscriber = self._subscriber
+        self._subscriber = None
+        self.client_id = None
+        if subscriber is not None:
+            subscriber.connection.disconnect()
+        self.flush()
+
+    def ready(self):
+        return self.client_id is not None
+
+    def tracking_commands(self):
+        """
+        Returns the commands enabling the tracking on a connection.
+        """
+        args = ['TRACKING', 'ON', 'REDIRECT', self.client_id]
+        if not self.bcast:
+            return [CmdLine('CLIENT', *args)]
+        args.append('BCAST')
+        for prefix in self.prefixes:
+            args.extend(['PREFIX', prefix])
+        # The prefixes may have been registered for another cache,
+        # and can't be registered twice
+        return [CmdLine('CLIENT', 'TRACKING', 'OFF'), CmdLine('CLIENT', *args)]
+
+    def get(self, key, entry_key):
+        """
+        Returns a (found, reply) tuple for the entry of the Redis key.
+        """
+        try:
+            entry = self._entries.pop(entry_key)
+        except KeyError:
+            self._misses += 1
+            return False, None
+        # Move to the most recently used end
+        self._entries[entry_key] = entry
+        self._hits += 1
+        value = entry[1]
+        if isinstance(value, (dict, set, list, bytearray)):
+            value = copy.copy(value)
+        return True, value
+
+    def set(self, key, entry_key, value):
+        size = value_size(value) + len(key) + ENTRY_OVERHEAD
+        if size > self.max_size:
+            return
+        self._discard(entry_key)
+        if isinstance(value, (dict, set, list, bytearray)):
+            value = copy.copy(value)
+        self._entries[entry_key] = (key, value, size)
+        self._keys.setdefault(key, set()).add(entry_key)
+        self.size += size
+        while self.size > self.max_size:
+            self._discard(next(iter(self._entries)))
+            self._evictions += 1
+
+    def begin_read(self, key):
+        """
+        Marks the Redis key as being read, so the reply is not cached
+        if the key is invalidated before the reply is received.
+        """
+        read = self._reads.get(key)
+        if read is None:
+            read = self._reads[key] = [0, False]
+        read[0] += 1
+
+    def end_read(self, key):
+        """
+        Returns False if the key has been invalidated since
+        the read began.
+        """
+        read = self._reads[key]
+        read[0] -= 1
+        if not read[0]:
+            del self._reads[key]
+        return not read[1]
+
+    def invalidate(self, key):
+        for entry_key in self._keys.pop(key, ()):
+            entry = self._entries.pop(entry_key)
+            self.size -= entry[2]
+        read = self._reads.get(key)
+        if read is not None:
+            read[1] = True
+        self._invalidations += 1
+
+    def flush(self):
+        self._entries.clear()
+        self._keys.clear()
+        self.size = 0
+        for read in self._reads.values():
+            read[1] = True
+        self._flushes += 1
+
+    def stats(self):
+        """
+        Returns a dict with numbers of cache hits, misses, entries
+        evicted to stay within max_size, keys invalidated, cache flushes,
+        and the current number and size of the entries.
+        """
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'invalidations': self._invalidations,
+            'flushes': self._flushes,
+            'entries': len(self._entries),
+            'size': self.size,
+        }
+
+    def _discard(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        key = entry[0]
+        self.size -= entry[2]
+        entry_keys = self._keys[key]
+        entry_keys.discard(entry_key)
+        if not entry_keys:
+            del self._keys[key]
+
+    @gen.coroutine
+    def _subscribe(self):
+        client = Client(**self.client_kwargs)
+        try:
+            yield gen.Task(client.connect)
+            client_id = yield client.execute_command('CLIENT', 'ID')
+            if isinstance(client_id, ResponseError):
+                raise client_id
+            yield gen.Task(client.subscribe, INVALIDATE_CHANNEL)
+        except (ConnectionError, TimeoutError, ResponseError):
+            client.connection.disconnect()
+            raise
+        if self._closed:
+            client.connection.disconnect()
+            raise gen.Return(False)
+        self._subscriber = client
+        self.client_id = int(client_id)
+        client.listen(self._on_message)
+        raise gen.Return(True)
+
+    def _on_subscribed(self, future):
+        self._subscribing = None
+        error = future.exception()
+        if error is not None:
+            log.warning('Failed to subscribe to invalidation messages: %s',
+                        error)
+            self._schedule_subscribe()
+
+    def _schedule_subscribe(self):
+        if not self._closed and self._retry is None:
+            self._retry = self._io_loop.add_timeout(
+                self._io_loop.time() + self.retry_interval, self.start)
+
+    def _on_message(self, msg):
+        if msg.kind == 'disconnect':
+            log.warning('Lost the invalidation messages connection')
+            self._subscriber = None
+            self.client_id = None
+            self.flush()
+            self._schedule_subscribe()
+        elif msg.kind == 'message' and msg.channel == INVALIDATE_CHANNEL:
+            if msg.body is None:
+                # FLUSHDB or FLUSHALL
+                self.flush()
+                return
+            for key in msg.body:
+                self.invalidate(utf8(key))
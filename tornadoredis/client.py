@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import sys
 from functools import partial
-import collections
 
 from collections import namedtuple, deque
 import logging
@@ -12,10 +11,11 @@ import time as mod_time
 from tornado.ioloop import IOLoop
 from tornado import gen
 from tornado import stack_context
-from tornado.escape import to_unicode, to_basestring
+from tornado.concurrent import Future
 
-from .exceptions import RequestError, ConnectionError, ResponseError
-from .connection import Connection
+from .exceptions import (RequestError, ConnectionError, ResponseError,
+                         TimeoutError)
+from .connection import Connection, BUFFER_CUTOFF
 
 
 log = logging.getLogger('tornadoredis.client')
@@ -25,12 +25,25 @@ Message = namedtuple('Message', ('kind', 'channel', 'body', 'pattern'))
 
 
 PY3 = sys.version > '3'
+if PY3:
+    TEXT_TYPE = str
+    BINARY_TYPES = (bytes, bytearray, memoryview)
+else:
+    TEXT_TYPE = unicode
+    BINARY_TYPES = (str, bytearray, memoryview)
 
 
 class CmdLine(object):
     def __init__(self, cmd, *args, **kwargs):
         self.cmd = cmd
         self.args = args
+        # Overrides the client's decode_responses setting if not None
+        self.decode_responses = kwargs.pop('decode_responses', None)
+        # Overrides the client's command_timeout setting if not None
+        self.timeout = kwargs.pop('timeout', None)
+        # Overrides the client's retry policy if not None: True sends
+        # the command again after a connection failure, False never does
+        self.retry = kwargs.pop('retry', None)
         self.kwargs = kwargs
 
     def __repr__(self):
@@ -48,13 +61,23 @@ def dict_merge(*dicts):
     return merged
 
 
+def to_native_str(value):
+    """
+    Decodes a reply received with decode_responses=False
+    to compare it with a string.
+    """
+    if PY3 and isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
 def reply_to_bool(r, *args, **kwargs):
     return bool(r)
 
 
 def make_reply_assert_msg(msg):
     def reply_assert_msg(r, *args, **kwargs):
-        return r == msg
+        return to_native_str(r) == msg
     return reply_assert_msg
 
 
@@ -63,6 +86,9 @@ def reply_set(r, *args, **kwargs):
 
 
 def reply_dict_from_pairs(r, *args, **kwargs):
+    if r is None:
+        # A blocking command has timed out
+        return {}
     return dict(zip(r[::2], r[1::2]))
 
 
@@ -102,7 +128,7 @@ def reply_pubsub_message(r, *args, **kwargs):
         body = pattern = None
     else:
         raise ValueError('Invalid number of arguments')
-    return Message(kind, channel, body, pattern)
+    return Message(to_native_str(kind), channel, body, pattern)
 
 
 def reply_zset(r, *args, **kwargs):
@@ -135,7 +161,7 @@ def reply_info(response, *args):
             except ValueError:
                 sub_dict[k] = v
         return sub_dict
-    for line in response.splitlines():
+    for line in to_native_str(response).splitlines():
         line = line.strip()
         if line and not line.startswith('#'):
             key, value = line.split(':')
@@ -165,6 +191,15 @@ def to_list(source):
         return list(source)
 
 
+def release_client(client):
+    """
+    Returns the connection held by the client to its pool.
+    """
+    connection = client.connection
+    client.connection = None
+    client._connection_pool.release(connection)
+
+
 PUB_SUB_COMMANDS = (
     'SUBSCRIBE',
     'PSUBSCRIBE',
@@ -174,6 +209,108 @@ PUB_SUB_COMMANDS = (
     'LISTEN',
 )
 
+# Commands with replies kept by the client cache
+CACHED_COMMANDS = frozenset(['GET', 'HGET', 'HGETALL', 'SMEMBERS'])
+
+# Commands the server replies to after the timeout passed
+# as the last argument, zero means waiting forever
+BLOCKING_COMMANDS = (
+    'BLPOP',
+    'BRPOP',
+    'BRPOPLPUSH',
+)
+
+READ_ONLY = 'read-only'
+IDEMPOTENT = 'idempotent'
+UNSAFE = 'unsafe'
+
+# Commands not listed are considered unsafe to send again: the server
+# may have executed them before the connection was lost.
+# Idempotent commands leave the same data when executed again,
+# their replies may differ. LTRIM, ZADD (with INCR) and the relative
+# EXPIRE and PEXPIRE are not.
+COMMAND_SAFETY = dict_merge(
+    string_keys_to_dict('GET MGET GETRANGE SUBSTR STRLEN GETBIT BITCOUNT '
+                        'BITPOS EXISTS TYPE TTL PTTL KEYS SCAN RANDOMKEY '
+                        'DUMP OBJECT HGET HMGET HGETALL HKEYS HVALS HLEN '
+                        'HEXISTS HSTRLEN HSCAN LINDEX LLEN LRANGE SCARD '
+                        'SISMEMBER SMEMBERS SRANDMEMBER SINTER SUNION SDIFF '
+                        'SSCAN ZCARD ZCOUNT ZLEXCOUNT ZRANGE ZRANGEBYSCORE '
+                        'ZRANGEBYLEX ZREVRANGE ZREVRANGEBYSCORE '
+                        'ZREVRANGEBYLEX ZRANK ZREVRANK ZSCORE ZSCAN PFCOUNT '
+                        'GEOPOS GEODIST GEOHASH DBSIZE INFO LASTSAVE PING '
+                        'ECHO TIME',
+                        READ_ONLY),
+    string_keys_to_dict('SET SETEX PSETEX MSET SETRANGE SETBIT DEL UNLINK '
+                        'EXPIREAT PEXPIREAT PERSIST HSET HMSET HDEL SADD '
+                        'SREM ZREM LSET PFADD AUTH SELECT FLUSHDB FLUSHALL',
+                        IDEMPOTENT),
+)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether to send a command again after its connection
+    has been lost before the reply was received.
+
+    Read-only and idempotent commands (see COMMAND_SAFETY) are sent
+    up to ``max_retries`` more times, idempotent ones unless
+    ``retry_idempotent`` is False. Other commands are never sent again:
+    the server may have executed them already.
+    Commands known not to have reached the server are sent again
+    regardless of their kind.
+
+    ``commands`` maps command names to READ_ONLY, IDEMPOTENT or UNSAFE
+    to extend or override the command table.
+    A single policy may be shared by several clients.
+    """
+    def __init__(self, max_retries=1, retry_idempotent=True, commands=None):
+        self.max_retries = max_retries
+        self.retry_idempotent = retry_idempotent
+        self.commands = (dict_merge(COMMAND_SAFETY, commands) if commands
+                         else COMMAND_SAFETY)
+        self._retries = 0
+        self._unsafe = 0
+        self._exhausted = 0
+
+    def classify(self, cmd):
+        """
+        Returns READ_ONLY, IDEMPOTENT or UNSAFE for the command name.
+        """
+        return self.commands.get(cmd, UNSAFE)
+
+    def should_retry(self, cmd_line, attempt, sent=True):
+        """
+        Returns True if the command failed on ``attempt`` retries
+        is to be sent again. ``sent`` is False if the command
+        has not reached the server.
+        """
+        if cmd_line.retry is False:
+            return False
+        if attempt >= self.max_retries:
+            self._exhausted += 1
+            return False
+        if sent and not cmd_line.retry:
+            kind = self.classify(cmd_line.cmd)
+            if (kind == UNSAFE or
+                    (kind == IDEMPOTENT and not self.retry_idempotent)):
+                self._unsafe += 1
+                return False
+        self._retries += 1
+        return True
+
+    def stats(self):
+        """
+        Returns a dict with numbers of commands sent again, commands
+        not sent again being unsafe to, and commands failed after
+        max_retries retries.
+        """
+        return {
+            'retries': self._retries,
+            'unsafe': self._unsafe,
+            'exhausted': self._exhausted,
+        }
+
 
 REPLY_MAP = dict_merge(
     string_keys_to_dict('AUTH BGREWRITEAOF BGSAVE DEL EXISTS '
@@ -225,24 +362,52 @@ class Client(object):
 
     def __init__(self, host='localhost', port=6379, unix_socket_path=None,
                  password=None, selected_db=None, io_loop=None,
-                 connection_pool=None):
+                 connection_pool=None, reader_class=None, multiplexed=False,
+                 auto_pipeline=False, encoding=None, decode_responses=None,
+                 connect_timeout=None, resolver=None, command_timeout=None,
+                 client_name=None, reconnect_policy=None, retry_policy=None,
+                 cache=None):
         self._io_loop = io_loop or IOLoop.current()
         self._connection_pool = connection_pool
         self._weak = weakref.proxy(self)
         if connection_pool:
             connection = (connection_pool
-                          .get_connection(event_handler_ref=self._weak))
+                          .get_connection(event_handler_ref=self._weak,
+                                          db=selected_db or 0))
         else:
             connection = Connection(host=host, port=port,
                                     unix_socket_path=unix_socket_path,
                                     event_handler_proxy=self._weak,
-                                    io_loop=self._io_loop)
+                                    io_loop=self._io_loop,
+                                    reader_class=reader_class,
+                                    encoding=encoding or 'utf-8',
+                                    decode_responses=decode_responses
+                                    is not False,
+                                    connect_timeout=connect_timeout,
+                                    resolver=resolver,
+                                    reconnect_policy=reconnect_policy)
         self.connection = connection
+        # Reply decoding settings, the connection (or connection pool)
+        # settings are used if not specified
+        self.encoding = encoding
+        self.decode_responses = decode_responses
+        # Seconds to wait for a reply before failing with TimeoutError
+        self.command_timeout = command_timeout
+        # Decides which commands to send again on connection failures
+        self.retry_policy = retry_policy or RetryPolicy()
         self.subscribed = set()
         self.subscribe_callbacks = deque()
         self.unsubscribe_callbacks = []
         self.password = password
         self.selected_db = selected_db or 0
+        # Set with CLIENT SETNAME on each connection used by the client
+        self.client_name = client_name
+        # Commands issued during the same IOLoop iteration are sent
+        # in a single write, that requires the multiplexed mode.
+        self.auto_pipeline = auto_pipeline
+        self.multiplexed = multiplexed or auto_pipeline
+        # A NearCache of GET, HGET, HGETALL and SMEMBERS replies
+        self.cache = cache
         self._pipeline = None
 
     def __del__(self):
@@ -268,24 +433,6 @@ class Client(object):
     def __exit__(self, *args, **kwargs):
         pass
 
-    def __getattribute__(self, item):
-        """
-        Bind methods to the weak proxy to avoid memory leaks
-        when bound method is passed as argument to the gen.Task
-        constructor.
-        """
-        a = super(Client, self).__getattribute__(item)
-        try:
-            if isinstance(a, collections.Callable) and a.__self__:
-                try:
-                    a = self.__class__.__dict__[item]
-                except KeyError:
-                    a = Client.__dict__[item]
-                a = partial(a, self._weak)
-        except AttributeError:
-            pass
-        return a
-
     def pipeline(self, transactional=False):
         """
         Creates the 'Pipeline' to send multiple redis commands
@@ -312,32 +459,55 @@ class Client(object):
                 selected_db=self.selected_db,
                 password=self.password,
                 io_loop=self._io_loop,
+                encoding=self.encoding,
+                decode_responses=self.decode_responses,
+                command_timeout=self.command_timeout,
+                client_name=self.client_name,
             )
             self._pipeline.connection = self.connection
         return self._pipeline
 
     def on_disconnect(self):
+        # Commands waiting for replies get ConnectionError once
+        # the stream is closed, don't raise it in the IOLoop
         if self.subscribed:
             self.subscribed = set()
-        raise ConnectionError("Socket closed on remote end")
 
     #### connection
     @gen.engine
-    def connect(self):
+    def connect(self, callback=None):
+        """
+        Connects to the Redis server.
+        Raises ConnectionError if the connection attempt fails.
+        """
         if not self.connection.connected():
             pool = self._connection_pool
             if pool:
                 old_conn = self.connection
-                self.connection = pool.get_connection(event_handler_ref=self)
+                self.connection = pool.get_connection(
+                    event_handler_ref=self._weak, db=self.selected_db)
                 self.connection.ready_callbacks = old_conn.ready_callbacks
             else:
-                yield gen.Task(self.connection.connect)
+                error = yield gen.Task(self.connection.connect)
+                if isinstance(error, ConnectionError):
+                    raise error
+        if callback:
+            callback(True)
 
-    @gen.engine
     def disconnect(self, callback=None):
         """
         Disconnects from the Redis server.
+        Returns a Future if called without the callback.
         """
+        if callback:
+            self._disconnect(callback=callback)
+            return None
+        future = Future()
+        self._run_with_future(future, self._disconnect)
+        return future
+
+    @gen.engine
+    def _disconnect(self, callback=None):
         connection = self.connection
         if connection:
             pool = self._connection_pool
@@ -345,7 +515,8 @@ class Client(object):
                 pool.release(connection)
                 yield gen.Task(connection.wait_until_ready)
                 proxy = pool.make_proxy(client_proxy=self._weak,
-                                        connected=False)
+                                        connected=False,
+                                        db=self.selected_db)
                 self.connection = proxy
             else:
                 self.connection.disconnect()
@@ -354,25 +525,62 @@ class Client(object):
 
     #### formatting
     def encode(self, value):
-        if not isinstance(value, str):
-            if not PY3 and isinstance(value, unicode):
-                value = value.encode('utf-8')
-            else:
-                value = str(value)
+        """
+        Returns the value encoded to bytes using the encoding replies
+        are decoded with.
+        Binary buffers (bytes, bytearray and memoryview) are returned as is.
+        """
+        if isinstance(value, BINARY_TYPES):
+            return value
+        if isinstance(value, TEXT_TYPE):
+            return value.encode(self.encoding or self.connection.encoding)
+        if isinstance(value, float):
+            value = repr(value)
+        else:
+            value = str(value)
         if PY3:
-            value = value.encode('utf-8')
+            value = value.encode(self.encoding or self.connection.encoding)
         return value
 
+    def pack_command(self, *tokens):
+        """
+        Returns a list of buffers holding the command encoded
+        according to the Redis protocol.
+
+        Small arguments are joined together, large binary arguments
+        are returned as separate buffers to avoid copying them.
+        """
+        encode = self.encode
+        output = []
+        buff = b'*' + str(len(tokens)).encode('ascii') + b'\r\n'
+        for token in tokens:
+            value = encode(token)
+            if isinstance(value, memoryview):
+                length = len(value) * value.itemsize
+            else:
+                length = len(value)
+            header = b'$' + str(length).encode('ascii') + b'\r\n'
+            if length > BUFFER_CUTOFF:
+                output.append(buff + header)
+                output.append(value)
+                buff = b'\r\n'
+            else:
+                if not PY3 and not isinstance(value, str):
+                    # Python 2 can't join strings with other buffers
+                    value = memoryview(value).tobytes()
+                buff = b''.join((buff, header, value, b'\r\n'))
+                if len(buff) > BUFFER_CUTOFF:
+                    output.append(buff)
+                    buff = b''
+        if buff:
+            output.append(buff)
+        return output
+
     def format_command(self, *tokens, **kwargs):
-        cmds = []
-        for t in tokens:
-            e_t = self.encode(t)
-            e_t_s = to_basestring(e_t)
-            cmds.append('$%s\r\n%s\r\n' % (len(e_t), e_t_s))
-        return '*%s\r\n%s' % (len(tokens), ''.join(cmds))
+        return b''.join(self.pack_command(*tokens))
 
     def format_reply(self, cmd_line, data):
-        if cmd_line.cmd not in REPLY_MAP:
+        if cmd_line.cmd not in REPLY_MAP or isinstance(data, ResponseError):
             return data
         try:
             res = REPLY_MAP[cmd_line.cmd](data,
@@ -386,45 +594,280 @@ class Client(object):
         return res
     ####
 
-    @gen.engine
     def execute_command(self, cmd, *args, **kwargs):
-        result = None
-        execute_pending = cmd not in ('AUTH', 'SELECT')
+        """
+        Sends the command to the Redis server and passes the reply
+        to the callback.
 
-        callback = kwargs.get('callback', None)
-        if 'callback' in kwargs:
-            del kwargs['callback']
+        Returns a Future resolved with the reply if called without
+        the callback. Error replies are passed as ResponseError
+        instances in both cases, connection errors and timeouts
+        are raised.
+        """
+        callback = kwargs.pop('callback', None)
+        use_cache = kwargs.pop('cache', True)
+        if (self.cache is not None and cmd in CACHED_COMMANDS and use_cache
+                and not kwargs and not self.subscribed):
+            return self._execute_cached(cmd, args, callback)
         cmd_line = CmdLine(cmd, *args, **kwargs)
-        if callback and self.subscribed and cmd not in PUB_SUB_COMMANDS:
-            callback(RequestError(
+        if self.subscribed and cmd not in PUB_SUB_COMMANDS:
+            # The reply would be taken for a Pub/Sub message
+            error = RequestError(
                 'Executing non-Pub/Sub command while in subscribed state',
-                cmd_line))
+                cmd_line)
+            if callback:
+                callback(error)
+                return None
+            future = Future()
+            future.set_exception(error)
+            return future
+        future = None
+        if not callback:
+            future = Future()
+            callback = future.set_result
+
+        connection = self.connection
+        if self._can_send(cmd):
+            # The fast path: send the command right away
+            # and process the reply without running the generator
+            command = self.pack_command(cmd, *args)
+            try:
+                if self.multiplexed and self.auto_pipeline:
+                    connection.write_deferred(command)
+                else:
+                    connection.write(command)
+            except Exception:
+                connection.disconnect()
+            else:
+                connection.read_reply(
+                    partial(self._on_reply, cmd_line, callback, future),
+                    **self._reply_options(cmd_line))
+                return future
+
+        if future is None:
+            self._execute_command(cmd_line, callback)
+        else:
+            self._run_with_future(future, self._execute_command, cmd_line)
+        return future
+
+    def _execute_cached(self, cmd, args, callback=None):
+        """
+        Returns the cached reply to the command,
+        or reads it from the server into the cache.
+        """
+        cache = self.cache
+        key = self.encode(args[0])
+        # Clients of different databases may share the cache,
+        # invalidation messages carry bare keys and evict them all
+        entry_key = ((self.selected_db, cmd) +
+                     tuple(self.encode(arg) for arg in args))
+        found, value = cache.get(key, entry_key)
+        if found:
+            return self._resolved(value, callback)
+        if not cache.ready():
+            # Not cached until the invalidation messages are received
+            cache.start()
+            return self.execute_command(cmd, *args, callback=callback,
+                                        cache=False)
+        cache.begin_read(key)
+        future = Future()
+        reply = self.execute_command(cmd, *args, cache=False)
+        reply.add_done_callback(partial(self._on_cached_reply, key,
+                                        entry_key, future))
+        if callback:
+            self._io_loop.add_future(future,
+                                     lambda future: callback(future.result()))
+            return None
+        return future
+
+    def _on_cached_reply(self, key, entry_key, future, reply):
+        cache = self.cache
+        valid = cache.end_read(key)
+        if reply.exception() is not None:
+            future.set_exc_info(reply.exc_info())
             return
+        value = reply.result()
+        # The key must not have changed since it was read
+        # over a connection tracking the keys for the cache
+        try:
+            if (valid and not isinstance(value, ResponseError) and
+                    self.connection.info.get('tracking') is cache and
+                    self.connection.info.get('tracking_id') ==
+                    cache.client_id):
+                cache.set(key, entry_key, value)
+        except Exception:
+            # The reply is passed on uncached
+            log.exception('Failed to cache the %s reply', entry_key[1])
+        future.set_result(value)
+
+    def _resolved(self, value, callback=None):
+        """
+        Passes the value to the callback or returns a Future
+        resolved with it for commands not sent to the server.
+        """
+        if callback:
+            callback(value)
+            return None
+        future = Future()
+        future.set_result(value)
+        return future
 
-        n_tries = 2
-        while n_tries > 0:
-            n_tries -= 1
-            if not self.connection.connected():
-                yield gen.Task(self.connection.connect)
+    def _can_send(self, cmd):
+        """
+        Returns True if the command may be sent without waiting for
+        the connection, authentication or database selection.
+        """
+        connection = self.connection
+        if (self.subscribed or cmd in ('AUTH', 'SELECT') or
+                cmd in PUB_SUB_COMMANDS or not connection.connected()):
+            return False
+        if (self.password and
+                connection.info.get('pass', None) != self.password):
+            return False
+        # Pooled connections may have another database selected,
+        # even the default one
+        if connection.info.get('db') != self.selected_db:
+            return False
+        if (self.client_name and
+                connection.info.get('name', None) != self.client_name):
+            return False
+        if (self.cache is not None and self.cache.ready() and
+                connection.info.get('tracking_id') != self.cache.client_id):
+            return False
+        if connection.info.get('setup') is not None:
+            # Setup commands sent for another command are yet to succeed
+            return False
+        if self.multiplexed:
+            return connection.multiplexable()
+        return connection.ready()
+
+    def _on_reply(self, cmd_line, callback, future, data):
+        if isinstance(data, TimeoutError):
+            self.connection.execute_pending_command()
+            if future is None:
+                raise data
+            future.set_exception(data)
+            return
+        if isinstance(data, ConnectionError):
+            if self._should_retry(cmd_line, 0, data):
+                # Send the command again using a new connection
+                if future is None:
+                    self._execute_command(cmd_line, callback, attempt=1)
+                else:
+                    self._run_with_future(future, self._execute_command,
+                                          cmd_line, attempt=1)
+                return
+            if future is None:
+                raise data
+            future.set_exception(data)
+            return
+        self.connection.execute_pending_command()
+        if future is None:
+            callback(self.format_reply(cmd_line,
+                                       self.process_data(data, cmd_line)))
+            return
+        try:
+            result = self.format_reply(cmd_line,
+                                       self.process_data(data, cmd_line))
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
 
-            if not self.subscribed and not self.connection.ready():
-                yield gen.Task(self.connection.wait_until_ready)
+    def _run_with_future(self, future, func, *args, **kwargs):
+        """
+        Calls the gen.engine function resolving the future with its
+        result or an exception raised while it runs.
+        """
+        def handle_exception(typ, value, tb):
+            if future.done():
+                return False
+            future.set_exception(value)
+            return True
+        with stack_context.ExceptionStackContext(handle_exception):
+            func(*args, callback=future.set_result, **kwargs)
+
+    def _should_retry(self, cmd_line, attempt, error=None):
+        """
+        Asks the retry policy whether to send the command again
+        after the connection error passed with its reply, if any.
+        """
+        # Commands buffered until connected are failed
+        # with the connection error and never sent
+        sent = error is not None and error is not self.connection.connect_error
+        return self.retry_policy.should_retry(cmd_line, attempt, sent=sent)
 
-            if not self.subscribed and cmd not in ('AUTH', 'SELECT'):
-                if self.password and self.connection.info.get('pass', None) != self.password:
-                    yield gen.Task(self.auth, self.password)
-                if self.selected_db and self.connection.info.get('db', 0) != self.selected_db:
-                    yield gen.Task(self.select, self.selected_db)
+    @gen.engine
+    def _execute_command(self, cmd_line, callback=None, attempt=0):
+        cmd, args = cmd_line.cmd, cmd_line.args
+        result = None
+        execute_pending = cmd not in ('AUTH', 'SELECT')
 
-            command = self.format_command(cmd, *args, **kwargs)
+        while True:
+            if not self.connection.connected():
+                # The connection buffers commands until connected
+                self.connection.connect()
+                if not self.connection.connected():
+                    # The reconnect policy has failed the attempt
+                    raise self.connection.connect_error
+
+            # Send the command without waiting for replies to commands
+            # sent before it, replies are read in the same order.
+            multiplexed = (self.multiplexed and
+                           not self.subscribed and
+                           cmd not in PUB_SUB_COMMANDS and
+                           self.connection.multiplexable())
+            if (not self.subscribed and not multiplexed and
+                    not self.connection.ready()):
+                # Pooled clients may fail to get a connection in time
+                error = yield gen.Task(self.connection.wait_until_ready)
+                if error is not None:
+                    raise error
+
+            if not self.subscribed and cmd not in ('AUTH', 'SELECT'):
+                setup = self._setup_commands()
+                setup_future = None
+                if setup:
+                    setup_future = Future()
+                    self.connection.info['setup'] = setup_future
+                    self._setup_connection(
+                        setup, callback=partial(self._on_setup,
+                                                self.connection,
+                                                setup_future))
+                elif multiplexed:
+                    # Multiplexed commands are sent once the setup commands
+                    # sent for other commands succeed, and fail with their
+                    # error otherwise
+                    setup_future = self.connection.info.get('setup')
+                if setup_future is not None:
+                    error = yield setup_future
+                    if (isinstance(error, ConnectionError) and
+                            self._should_retry(cmd_line, attempt)):
+                        attempt += 1
+                        continue
+                    elif error is not None:
+                        if execute_pending:
+                            self.connection.execute_pending_command()
+                        raise error
+
+            command = self.pack_command(cmd, *args)
             try:
-                yield gen.Task(self.connection.write, command)
+                if multiplexed and self.auto_pipeline:
+                    self.connection.write_deferred(command)
+                elif multiplexed:
+                    self.connection.write(command)
+                else:
+                    yield gen.Task(self.connection.write, command)
             except Exception as e:
                 self.connection.disconnect()
-                if not n_tries:
+                if not self._should_retry(cmd_line, attempt):
+                    if execute_pending:
+                        self.connection.execute_pending_command()
                     raise e
-                else:
-                    continue
+                attempt += 1
+                if execute_pending:
+                    self.connection.execute_pending_command()
+                continue
 
             listening = ((cmd in PUB_SUB_COMMANDS) or
                          (self.subscribed and cmd == 'PUBLISH'))
@@ -434,14 +877,28 @@ class Client(object):
                 break
             else:
                 result = None
-                data = yield gen.Task(self.connection.readline)
-                if not data:
-                    if not n_tries:
-                        raise ConnectionError('no data received')
+                try:
+                    data = yield gen.Task(self.connection.read_reply,
+                                          **self._reply_options(cmd_line))
+                except ConnectionError as e:
+                    # The connection attempt has failed
+                    data = self.connection.connect_error or e
+                if isinstance(data, TimeoutError):
+                    if execute_pending:
+                        self.connection.execute_pending_command()
+                    raise data
+                if isinstance(data, ConnectionError):
+                    if not self._should_retry(cmd_line, attempt, data):
+                        # Let the commands waiting for the connection
+                        # try to reconnect
+                        if execute_pending:
+                            self.connection.execute_pending_command()
+                        raise data
+                    attempt += 1
+                    if execute_pending:
+                        self.connection.execute_pending_command()
                 else:
                     resp = self.process_data(data, cmd_line)
-                    if isinstance(resp, partial):
-                        resp = yield gen.Task(resp)
                     result = self.format_reply(cmd_line, resp)
                     break
 
@@ -451,142 +908,207 @@ class Client(object):
         if callback:
             callback(result)
 
-    @gen.engine
-    def _consume_bulk(self, tail, callback=None):
-        response = yield gen.Task(self.connection.read, int(tail) + 2)
-        if isinstance(response, Exception):
-            raise response
-        if not response:
-            raise ResponseError('EmptyResponse')
-        else:
-            response = to_unicode(response)
-            response = response[:-2]
-        callback(response)
-
-    def process_data(self, data, cmd_line):
-        data = to_basestring(data)
-        data = data[:-2]  # strip \r\n
+    def _setup_commands(self):
+        """
+        Returns the AUTH, SELECT, CLIENT SETNAME and CLIENT TRACKING
+        commands required to use the connection.
+        """
+        info = self.connection.info
+        commands = []
+        if self.password and info.get('pass', None) != self.password:
+            commands.append(CmdLine('AUTH', self.password))
+        if info.get('db') != self.selected_db:
+            commands.append(CmdLine('SELECT', '%s' % self.selected_db))
+        if self.client_name and info.get('name', None) != self.client_name:
+            commands.append(CmdLine('CLIENT', 'SETNAME', self.client_name))
+        cache = self.cache
+        if (cache is not None and cache.ready() and
+                info.get('tracking_id') != cache.client_id):
+            commands.extend(cache.tracking_commands())
+        return commands
+
+    def _on_setup(self, connection, future, error):
+        if connection.info.get('setup') is future:
+            connection.info['setup'] = None
+        future.set_result(error)
 
-        if data == '$-1':
-            response = None
-        elif data == '*0' or data == '*-1':
-            response = []
-        else:
-            head, tail = data[0], data[1:]
-
-            if head == '*':
-                return partial(self.consume_multibulk, int(tail), cmd_line)
-            elif head == '$':
-                return partial(self._consume_bulk, tail)
-            elif head == '+':
-                response = tail
-            elif head == ':':
-                response = int(tail)
-            elif head == '-':
-                if tail.startswith('ERR'):
-                    tail = tail[4:]
-                response = ResponseError(tail, cmd_line)
+    @gen.engine
+    def _setup_connection(self, commands, callback=None):
+        """
+        Sends the connection setup commands in a single request.
+        Passes the first error reply (or a ConnectionError) to the callback,
+        or None if all the commands succeeded.
+        """
+        connection = self.connection
+        info = connection.info
+        # Record the state right away to keep other commands
+        # from sending the same setup commands
+        for cmd_line in commands:
+            if cmd_line.cmd == 'AUTH':
+                info['pass'] = self.password
+            elif cmd_line.cmd == 'SELECT':
+                info['db'] = self.selected_db
+            elif cmd_line.args[0] == 'SETNAME':
+                info['name'] = self.client_name
             else:
-                raise ResponseError('Unknown response type %s' % head,
-                                    cmd_line)
-        return response
+                previous = info.get('tracking')
+                if previous is not None and previous is not self.cache:
+                    # Invalidations of the keys read for the other cache
+                    # are redirected to this one from now on
+                    previous.flush()
+                info['tracking'] = self.cache
+                info['tracking_id'] = self.cache.client_id
+        request = [buff for c in commands
+                   for buff in self.pack_command(c.cmd, *c.args)]
+        if not connection.connected():
+            # A pooled connection assigned while waiting
+            connection.connect()
+        connection.write(request)
+        read_reply = connection.read_reply
+        replies = yield [gen.Task(read_reply, **self._reply_options(c))
+                         for c in commands]
+        error = None
+        for cmd_line, reply in zip(commands, replies):
+            if isinstance(reply, (ConnectionError, TimeoutError)):
+                error = reply
+                break
+            reply = self.process_data(reply, cmd_line)
+            if isinstance(reply, ResponseError):
+                error = reply
+                break
+        if error is not None:
+            # Send the setup commands again with the next command
+            info['pass'] = None
+            info['db'] = None
+            info['name'] = None
+            if info.get('tracking') is not None:
+                # The tracking state of the connection is unknown
+                info['tracking'].flush()
+            info['tracking'] = None
+            info['tracking_id'] = None
+        if callback:
+            callback(error)
+
+    def _reply_options(self, cmd_line=None):
+        decode_responses = self.decode_responses
+        if cmd_line is not None and cmd_line.decode_responses is not None:
+            decode_responses = cmd_line.decode_responses
+        return {'encoding': self.encoding,
+                'decode_responses': decode_responses,
+                'timeout': self._reply_timeout(cmd_line)}
+
+    def _reply_timeout(self, cmd_line):
+        # Pub/Sub messages are not bound to a command
+        if cmd_line is None:
+            return None
+        if cmd_line.timeout is not None:
+            return cmd_line.timeout
+        timeout = self.command_timeout
+        if timeout and cmd_line.cmd in BLOCKING_COMMANDS:
+            try:
+                blocking_timeout = float(cmd_line.args[-1])
+            except (IndexError, TypeError, ValueError):
+                return timeout
+            if not blocking_timeout:
+                return None
+            timeout += blocking_timeout
+        return timeout
 
-    @gen.engine
-    def consume_multibulk(self, length, cmd_line, callback=None):
-        tokens = []
-        while len(tokens) < length:
-            data = yield gen.Task(self.connection.readline)
-            if not data:
-                raise ResponseError(
-                    'Not enough data in response to %s, accumulated tokens: %s'
-                    % (cmd_line, tokens),
-                    cmd_line)
-            token = self.process_data(data, cmd_line)
-            if isinstance(token, partial):
-                token = yield gen.Task(token)
-            tokens.append(token)
-
-        callback(tokens)
+    def process_data(self, data, cmd_line):
+        """
+        Attaches the command line to error replies found in
+        the reply data parsed by the connection reader.
+        """
+        if isinstance(data, list):
+            for n, item in enumerate(data):
+                if isinstance(item, (list, ResponseError)):
+                    data[n] = self.process_data(item, cmd_line)
+        elif isinstance(data, ResponseError):
+            message = data.message
+            if message.startswith('ERR'):
+                message = message[4:]
+            data = ResponseError(message, cmd_line)
+        return data
 
     ### MAINTENANCE
     def bgrewriteaof(self, callback=None):
-        self.execute_command('BGREWRITEAOF', callback=callback)
+        return self.execute_command('BGREWRITEAOF', callback=callback)
 
     def dbsize(self, callback=None):
-        self.execute_command('DBSIZE', callback=callback)
+        return self.execute_command('DBSIZE', callback=callback)
 
     def flushall(self, callback=None):
-        self.execute_command('FLUSHALL', callback=callback)
+        return self.execute_command('FLUSHALL', callback=callback)
 
     def flushdb(self, callback=None):
-        self.execute_command('FLUSHDB', callback=callback)
+        return self.execute_command('FLUSHDB', callback=callback)
 
     def ping(self, callback=None):
-        self.execute_command('PING', callback=callback)
+        return self.execute_command('PING', callback=callback)
 
     def object(self, infotype, key, callback=None):
-        self.execute_command('OBJECT', infotype, key, callback=callback)
+        return self.execute_command('OBJECT', infotype, key, callback=callback)
 
     def info(self, section_name=None, callback=None):
         args = ('INFO', )
         if section_name:
             args += (section_name, )
-        self.execute_command(*args, callback=callback)
+        return self.execute_command(*args, callback=callback)
 
     def echo(self, value, callback=None):
-        self.execute_command('ECHO', value, callback=callback)
+        return self.execute_command('ECHO', value, callback=callback)
 
     def time(self, callback=None):
         """
         Returns the server time as a 2-item tuple of ints:
         (seconds since epoch, microseconds into this second).
         """
-        self.execute_command('TIME', callback=callback)
+        return self.execute_command('TIME', callback=callback)
 
     def select(self, db, callback=None):
         self.selected_db = db
         if self.connection.info.get('db', None) != db:
             self.connection.info['db'] = db
-            self.execute_command('SELECT', '%s' % db, callback=callback)
-        elif callback:
-            callback(True)
+            return self.execute_command('SELECT', '%s' % db,
+                                        callback=callback)
+        return self._resolved(True, callback)
 
     def shutdown(self, callback=None):
-        self.execute_command('SHUTDOWN', callback=callback)
+        return self.execute_command('SHUTDOWN', callback=callback)
 
     def save(self, callback=None):
-        self.execute_command('SAVE', callback=callback)
+        return self.execute_command('SAVE', callback=callback)
 
     def bgsave(self, callback=None):
-        self.execute_command('BGSAVE', callback=callback)
+        return self.execute_command('BGSAVE', callback=callback)
 
     def lastsave(self, callback=None):
-        self.execute_command('LASTSAVE', callback=callback)
+        return self.execute_command('LASTSAVE', callback=callback)
 
     def keys(self, pattern='*', callback=None):
-        self.execute_command('KEYS', pattern, callback=callback)
+        return self.execute_command('KEYS', pattern, callback=callback)
 
     def auth(self, password, callback=None):
         self.password = password
         if self.connection.info.get('pass', None) != password:
             self.connection.info['pass'] = password
-            self.execute_command('AUTH', password, callback=callback)
-        elif callback:
-            callback(True)
+            return self.execute_command('AUTH', password, callback=callback)
+        return self._resolved(True, callback)
 
     ### BASIC KEY COMMANDS
     def append(self, key, value, callback=None):
-        self.execute_command('APPEND', key, value, callback=callback)
+        return self.execute_command('APPEND', key, value, callback=callback)
 
     def getrange(self, key, start, end, callback=None):
         """
         Returns the substring of the string value stored at ``key``,
         determined by the offsets ``start`` and ``end`` (both are inclusive)
         """
-        self.execute_command('GETRANGE', key, start, end, callback=callback)
+        return self.execute_command('GETRANGE', key, start, end,
+                                    callback=callback)
 
     def expire(self, key, ttl, callback=None):
-        self.execute_command('EXPIRE', key, ttl, callback=callback)
+        return self.execute_command('EXPIRE', key, ttl, callback=callback)
 
     def expireat(self, key, when, callback=None):
         """
@@ -595,28 +1117,28 @@ class Client(object):
         """
         if isinstance(when, datetime.datetime):
             when = int(mod_time.mktime(when.timetuple()))
-        self.execute_command('EXPIREAT', key, when, callback=callback)
+        return self.execute_command('EXPIREAT', key, when, callback=callback)
 
     def ttl(self, key, callback=None):
-        self.execute_command('TTL', key, callback=callback)
+        return self.execute_command('TTL', key, callback=callback)
 
     def type(self, key, callback=None):
-        self.execute_command('TYPE', key, callback=callback)
+        return self.execute_command('TYPE', key, callback=callback)
 
     def randomkey(self, callback=None):
-        self.execute_command('RANDOMKEY', callback=callback)
+        return self.execute_command('RANDOMKEY', callback=callback)
 
     def rename(self, src, dst, callback=None):
-        self.execute_command('RENAME', src, dst, callback=callback)
+        return self.execute_command('RENAME', src, dst, callback=callback)
 
     def renamenx(self, src, dst, callback=None):
-        self.execute_command('RENAMENX', src, dst, callback=callback)
+        return self.execute_command('RENAMENX', src, dst, callback=callback)
 
     def move(self, key, db, callback=None):
-        self.execute_command('MOVE', key, db, callback=callback)
+        return self.execute_command('MOVE', key, db, callback=callback)
 
     def persist(self, key, callback=None):
-        self.execute_command('PERSIST', key, callback=callback)
+        return self.execute_command('PERSIST', key, callback=callback)
 
     def pexpire(self, key, time, callback=None):
         """
@@ -627,7 +1149,7 @@ class Client(object):
         if isinstance(time, datetime.timedelta):
             ms = int(time.microseconds / 1000)
             time = time.seconds + time.days * 24 * 3600 * 1000 + ms
-        self.execute_command('PEXPIRE', key, time, callback=callback)
+        return self.execute_command('PEXPIRE', key, time, callback=callback)
 
     def pexpireat(self, key, when, callback=None):
         """
@@ -638,17 +1160,19 @@ class Client(object):
         if isinstance(when, datetime.datetime):
             ms = int(when.microsecond / 1000)
             when = int(mod_time.mktime(when.timetuple())) * 1000 + ms
-        self.execute_command('PEXPIREAT', key, when, callback=callback)
+        return self.execute_command('PEXPIREAT', key, when, callback=callback)
 
     def pttl(self, key, callback=None):
         "Returns the number of milliseconds until the key will expire"
-        self.execute_command('PTTL', key, callback=callback)
+        return self.execute_command('PTTL', key, callback=callback)
 
     def substr(self, key, start, end, callback=None):
-        self.execute_command('SUBSTR', key, start, end, callback=callback)
+        return self.execute_command('SUBSTR', key, start, end,
+                                    callback=callback)
 
     def delete(self, *keys, **kwargs):
-        self.execute_command('DEL', *keys, callback=kwargs.get('callback'))
+        return self.execute_command('DEL', *keys,
+                                    callback=kwargs.get('callback'))
 
     def set(self, key, value, expire=None, pexpire=None,
             only_if_not_exists=False, only_if_exists=False, callback=None):
@@ -665,39 +1189,42 @@ class Client(object):
         if only_if_exists:
             args.append("XX")
 
-        self.execute_command('SET', key, value, *args, callback=callback)
+        return self.execute_command('SET', key, value, *args,
+                                    callback=callback)
 
     def setex(self, key, ttl, value, callback=None):
-        self.execute_command('SETEX', key, ttl, value, callback=callback)
+        return self.execute_command('SETEX', key, ttl, value,
+                                    callback=callback)
 
     def setnx(self, key, value, callback=None):
-        self.execute_command('SETNX', key, value, callback=callback)
+        return self.execute_command('SETNX', key, value, callback=callback)
 
     def setrange(self, key, offset, value, callback=None):
-        self.execute_command('SETRANGE', key, offset, value, callback=callback)
+        return self.execute_command('SETRANGE', key, offset, value,
+                                    callback=callback)
 
     def strlen(self, key, callback=None):
-        self.execute_command('STRLEN', key, callback=callback)
+        return self.execute_command('STRLEN', key, callback=callback)
 
     def mset(self, mapping, callback=None):
         items = [i for k, v in mapping.items() for i in (k, v)]
-        self.execute_command('MSET', *items, callback=callback)
+        return self.execute_command('MSET', *items, callback=callback)
 
     def msetnx(self, mapping, callback=None):
         items = [i for k, v in mapping.items() for i in (k, v)]
-        self.execute_command('MSETNX', *items, callback=callback)
+        return self.execute_command('MSETNX', *items, callback=callback)
 
     def get(self, key, callback=None):
-        self.execute_command('GET', key, callback=callback)
+        return self.execute_command('GET', key, callback=callback)
 
     def mget(self, keys, callback=None):
-        self.execute_command('MGET', *keys, callback=callback)
+        return self.execute_command('MGET', *keys, callback=callback)
 
     def getset(self, key, value, callback=None):
-        self.execute_command('GETSET', key, value, callback=callback)
+        return self.execute_command('GETSET', key, value, callback=callback)
 
     def exists(self, key, callback=None):
-        self.execute_command('EXISTS', key, callback=callback)
+        return self.execute_command('EXISTS', key, callback=callback)
 
     def sort(self, key, start=None, num=None, by=None, get=None, desc=False,
              alpha=False, store=None, callback=None):
@@ -723,18 +1250,19 @@ class Client(object):
         if store is not None:
             tokens.append('STORE')
             tokens.append(store)
-        self.execute_command('SORT', *tokens, callback=callback)
+        return self.execute_command('SORT', *tokens, callback=callback)
 
     def getbit(self, key, offset, callback=None):
-        self.execute_command('GETBIT', key, offset, callback=callback)
+        return self.execute_command('GETBIT', key, offset, callback=callback)
 
     def setbit(self, key, offset, value, callback=None):
-        self.execute_command('SETBIT', key, offset, value, callback=callback)
+        return self.execute_command('SETBIT', key, offset, value,
+                                    callback=callback)
 
     def bitcount(self, key, start=None, end=None, callback=None):
         args = [a for a in (key, start, end) if a is not None]
         kwargs = {'callback': callback}
-        self.execute_command('BITCOUNT', *args, **kwargs)
+        return self.execute_command('BITCOUNT', *args, **kwargs)
 
     def bitop(self, operation, dest, *keys, **kwargs):
         """
@@ -742,172 +1270,184 @@ class Client(object):
         store the result in ``dest``.
         """
         kwargs = {'callback': kwargs.get('callback', None)}
-        self.execute_command('BITOP', operation, dest, *keys, **kwargs)
+        return self.execute_command('BITOP', operation, dest, *keys, **kwargs)
 
     ### COUNTERS COMMANDS
     def incr(self, key, callback=None):
-        self.execute_command('INCR', key, callback=callback)
+        return self.execute_command('INCR', key, callback=callback)
 
     def decr(self, key, callback=None):
-        self.execute_command('DECR', key, callback=callback)
+        return self.execute_command('DECR', key, callback=callback)
 
     def incrby(self, key, amount, callback=None):
-        self.execute_command('INCRBY', key, amount, callback=callback)
+        return self.execute_command('INCRBY', key, amount, callback=callback)
 
     def incrbyfloat(self, key, amount=1.0, callback=None):
-        self.execute_command('INCRBYFLOAT', key, amount, callback=callback)
+        return self.execute_command('INCRBYFLOAT', key, amount,
+                                    callback=callback)
 
     def decrby(self, key, amount, callback=None):
-        self.execute_command('DECRBY', key, amount, callback=callback)
+        return self.execute_command('DECRBY', key, amount, callback=callback)
 
     ### LIST COMMANDS
     def blpop(self, keys, timeout=0, callback=None):
         tokens = to_list(keys)
         tokens.append(timeout)
-        self.execute_command('BLPOP', *tokens, callback=callback)
+        return self.execute_command('BLPOP', *tokens, callback=callback)
 
     def brpop(self, keys, timeout=0, callback=None):
         tokens = to_list(keys)
         tokens.append(timeout)
-        self.execute_command('BRPOP', *tokens, callback=callback)
+        return self.execute_command('BRPOP', *tokens, callback=callback)
 
     def brpoplpush(self, src, dst, timeout=1, callback=None):
         tokens = [src, dst, timeout]
-        self.execute_command('BRPOPLPUSH', *tokens, callback=callback)
+        return self.execute_command('BRPOPLPUSH', *tokens, callback=callback)
 
     def lindex(self, key, index, callback=None):
-        self.execute_command('LINDEX', key, index, callback=callback)
+        return self.execute_command('LINDEX', key, index, callback=callback)
 
     def llen(self, key, callback=None):
-        self.execute_command('LLEN', key, callback=callback)
+        return self.execute_command('LLEN', key, callback=callback)
 
     def lrange(self, key, start, end, callback=None):
-        self.execute_command('LRANGE', key, start, end, callback=callback)
+        return self.execute_command('LRANGE', key, start, end,
+                                    callback=callback)
 
     def lrem(self, key, value, num=0, callback=None):
-        self.execute_command('LREM', key, num, value, callback=callback)
+        return self.execute_command('LREM', key, num, value, callback=callback)
 
     def lset(self, key, index, value, callback=None):
-        self.execute_command('LSET', key, index, value, callback=callback)
+        return self.execute_command('LSET', key, index, value,
+                                    callback=callback)
 
     def ltrim(self, key, start, end, callback=None):
-        self.execute_command('LTRIM', key, start, end, callback=callback)
+        return self.execute_command('LTRIM', key, start, end,
+                                    callback=callback)
 
     def lpush(self, key, *values, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('LPUSH', key, *values, callback=callback)
+        return self.execute_command('LPUSH', key, *values, callback=callback)
 
     def lpushx(self, key, value, callback=None):
-        self.execute_command('LPUSHX', key, value, callback=callback)
+        return self.execute_command('LPUSHX', key, value, callback=callback)
 
     def linsert(self, key, where, refvalue, value, callback=None):
-        self.execute_command('LINSERT', key, where, refvalue, value,
-                             callback=callback)
+        return self.execute_command('LINSERT', key, where, refvalue, value,
+                                    callback=callback)
 
     def rpush(self, key, *values, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('RPUSH', key, *values, callback=callback)
+        return self.execute_command('RPUSH', key, *values, callback=callback)
 
     def rpushx(self, key, value, **kwargs):
         "Push ``value`` onto the tail of the list ``name`` if ``name`` exists"
         callback = kwargs.get('callback', None)
-        self.execute_command('RPUSHX', key, value, callback=callback)
+        return self.execute_command('RPUSHX', key, value, callback=callback)
 
     def lpop(self, key, callback=None):
-        self.execute_command('LPOP', key, callback=callback)
+        return self.execute_command('LPOP', key, callback=callback)
 
     def rpop(self, key, callback=None):
-        self.execute_command('RPOP', key, callback=callback)
+        return self.execute_command('RPOP', key, callback=callback)
 
     def rpoplpush(self, src, dst, callback=None):
-        self.execute_command('RPOPLPUSH', src, dst, callback=callback)
+        return self.execute_command('RPOPLPUSH', src, dst, callback=callback)
 
     ### SET COMMANDS
     def sadd(self, key, *values, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('SADD', key, *values, callback=callback)
+        return self.execute_command('SADD', key, *values, callback=callback)
 
     def srem(self, key, *values, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('SREM', key, *values, callback=callback)
+        return self.execute_command('SREM', key, *values, callback=callback)
 
     def scard(self, key, callback=None):
-        self.execute_command('SCARD', key, callback=callback)
+        return self.execute_command('SCARD', key, callback=callback)
 
     def spop(self, key, callback=None):
-        self.execute_command('SPOP', key, callback=callback)
+        return self.execute_command('SPOP', key, callback=callback)
 
     def smove(self, src, dst, value, callback=None):
-        self.execute_command('SMOVE', src, dst, value, callback=callback)
+        return self.execute_command('SMOVE', src, dst, value,
+                                    callback=callback)
 
     def sismember(self, key, value, callback=None):
-        self.execute_command('SISMEMBER', key, value, callback=callback)
+        return self.execute_command('SISMEMBER', key, value, callback=callback)
 
     def smembers(self, key, callback=None):
-        self.execute_command('SMEMBERS', key, callback=callback)
+        return self.execute_command('SMEMBERS', key, callback=callback)
 
     def srandmember(self, key, number=None, callback=None):
         if number:
-            self.execute_command('SRANDMEMBER', key, number, callback=callback)
+            return self.execute_command('SRANDMEMBER', key, number,
+                                        callback=callback)
         else:
-            self.execute_command('SRANDMEMBER', key, callback=callback)
+            return self.execute_command('SRANDMEMBER', key, callback=callback)
 
     def sinter(self, keys, callback=None):
-        self.execute_command('SINTER', *keys, callback=callback)
+        return self.execute_command('SINTER', *keys, callback=callback)
 
     def sdiff(self, keys, callback=None):
-        self.execute_command('SDIFF', *keys, callback=callback)
+        return self.execute_command('SDIFF', *keys, callback=callback)
 
     def sunion(self, keys, callback=None):
-        self.execute_command('SUNION', *keys, callback=callback)
+        return self.execute_command('SUNION', *keys, callback=callback)
 
     def sinterstore(self, keys, dst, callback=None):
-        self.execute_command('SINTERSTORE', dst, *keys, callback=callback)
+        return self.execute_command('SINTERSTORE', dst, *keys,
+                                    callback=callback)
 
     def sunionstore(self, keys, dst, callback=None):
-        self.execute_command('SUNIONSTORE', dst, *keys, callback=callback)
+        return self.execute_command('SUNIONSTORE', dst, *keys,
+                                    callback=callback)
 
     def sdiffstore(self, keys, dst, callback=None):
-        self.execute_command('SDIFFSTORE', dst, *keys, callback=callback)
+        return self.execute_command('SDIFFSTORE', dst, *keys,
+                                    callback=callback)
 
     ### SORTED SET COMMANDS
     def zadd(self, key, *score_value, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('ZADD', key, *score_value, callback=callback)
+        return self.execute_command('ZADD', key, *score_value,
+                                    callback=callback)
 
     def zcard(self, key, callback=None):
-        self.execute_command('ZCARD', key, callback=callback)
+        return self.execute_command('ZCARD', key, callback=callback)
 
     def zincrby(self, key, value, amount, callback=None):
-        self.execute_command('ZINCRBY', key, amount, value, callback=callback)
+        return self.execute_command('ZINCRBY', key, amount, value,
+                                    callback=callback)
 
     def zrank(self, key, value, callback=None):
-        self.execute_command('ZRANK', key, value, callback=callback)
+        return self.execute_command('ZRANK', key, value, callback=callback)
 
     def zrevrank(self, key, value, callback=None):
-        self.execute_command('ZREVRANK', key, value, callback=callback)
+        return self.execute_command('ZREVRANK', key, value, callback=callback)
 
     def zrem(self, key, *values, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('ZREM', key, *values, callback=callback)
+        return self.execute_command('ZREM', key, *values, callback=callback)
 
     def zcount(self, key, start, end, callback=None):
-        self.execute_command('ZCOUNT', key, start, end, callback=callback)
+        return self.execute_command('ZCOUNT', key, start, end,
+                                    callback=callback)
 
     def zscore(self, key, value, callback=None):
-        self.execute_command('ZSCORE', key, value, callback=callback)
+        return self.execute_command('ZSCORE', key, value, callback=callback)
 
     def zrange(self, key, start, num, with_scores=True, callback=None):
         tokens = [key, start, num]
         if with_scores:
             tokens.append('WITHSCORES')
-        self.execute_command('ZRANGE', *tokens, callback=callback)
+        return self.execute_command('ZRANGE', *tokens, callback=callback)
 
     def zrevrange(self, key, start, num, with_scores, callback=None):
         tokens = [key, start, num]
         if with_scores:
             tokens.append('WITHSCORES')
-        self.execute_command('ZREVRANGE', *tokens, callback=callback)
+        return self.execute_command('ZREVRANGE', *tokens, callback=callback)
 
     def zrangebyscore(self, key, start, end, offset=None, limit=None,
                       with_scores=False, callback=None):
@@ -918,7 +1458,8 @@ class Client(object):
             tokens.append(limit)
         if with_scores:
             tokens.append('WITHSCORES')
-        self.execute_command('ZRANGEBYSCORE', *tokens, callback=callback)
+        return self.execute_command('ZRANGEBYSCORE', *tokens,
+                                    callback=callback)
 
     def zrevrangebyscore(self, key, end, start, offset=None, limit=None,
                          with_scores=False, callback=None):
@@ -929,15 +1470,16 @@ class Client(object):
             tokens.append(limit)
         if with_scores:
             tokens.append('WITHSCORES')
-        self.execute_command('ZREVRANGEBYSCORE', *tokens, callback=callback)
+        return self.execute_command('ZREVRANGEBYSCORE', *tokens,
+                                    callback=callback)
 
     def zremrangebyrank(self, key, start, end, callback=None):
-        self.execute_command('ZREMRANGEBYRANK', key, start, end,
-                             callback=callback)
+        return self.execute_command('ZREMRANGEBYRANK', key, start, end,
+                                    callback=callback)
 
     def zremrangebyscore(self, key, start, end, callback=None):
-        self.execute_command('ZREMRANGEBYSCORE', key, start, end,
-                             callback=callback)
+        return self.execute_command('ZREMRANGEBYSCORE', key, start, end,
+                                    callback=callback)
 
     def zinterstore(self, dest, keys, aggregate=None, callback=None):
         return self._zaggregate('ZINTERSTORE', dest, keys, aggregate, callback)
@@ -960,63 +1502,66 @@ class Client(object):
         if aggregate:
             tokens.append('AGGREGATE')
             tokens.append(aggregate)
-        self.execute_command(command, *tokens, callback=callback)
+        return self.execute_command(command, *tokens, callback=callback)
 
     ### HASH COMMANDS
     def hgetall(self, key, callback=None):
-        self.execute_command('HGETALL', key, callback=callback)
+        return self.execute_command('HGETALL', key, callback=callback)
 
     def hmset(self, key, mapping, callback=None):
         items = [i for k, v in mapping.items() for i in (k, v)]
-        self.execute_command('HMSET', key, *items, callback=callback)
+        return self.execute_command('HMSET', key, *items, callback=callback)
 
     def hset(self, key, field, value, callback=None):
-        self.execute_command('HSET', key, field, value, callback=callback)
+        return self.execute_command('HSET', key, field, value,
+                                    callback=callback)
 
     def hsetnx(self, key, field, value, callback=None):
-        self.execute_command('HSETNX', key, field, value, callback=callback)
+        return self.execute_command('HSETNX', key, field, value,
+                                    callback=callback)
 
     def hget(self, key, field, callback=None):
-        self.execute_command('HGET', key, field, callback=callback)
+        return self.execute_command('HGET', key, field, callback=callback)
 
     def hdel(self, key, *fields, **kwargs):
         callback = kwargs.get('callback')
-        self.execute_command('HDEL', key, *fields, callback=callback)
+        return self.execute_command('HDEL', key, *fields, callback=callback)
 
     def hlen(self, key, callback=None):
-        self.execute_command('HLEN', key, callback=callback)
+        return self.execute_command('HLEN', key, callback=callback)
 
     def hexists(self, key, field, callback=None):
-        self.execute_command('HEXISTS', key, field, callback=callback)
+        return self.execute_command('HEXISTS', key, field, callback=callback)
 
     def hincrby(self, key, field, amount=1, callback=None):
-        self.execute_command('HINCRBY', key, field, amount, callback=callback)
+        return self.execute_command('HINCRBY', key, field, amount,
+                                    callback=callback)
 
     def hincrbyfloat(self, key, field, amount=1.0, callback=None):
-        self.execute_command('HINCRBYFLOAT', key, field, amount,
-                             callback=callback)
+        return self.execute_command('HINCRBYFLOAT', key, field, amount,
+                                    callback=callback)
 
     def hkeys(self, key, callback=None):
-        self.execute_command('HKEYS', key, callback=callback)
+        return self.execute_command('HKEYS', key, callback=callback)
 
     def hmget(self, key, fields, callback=None):
-        self.execute_command('HMGET', key, *fields, callback=callback)
+        return self.execute_command('HMGET', key, *fields, callback=callback)
 
     def hvals(self, key, callback=None):
-        self.execute_command('HVALS', key, callback=callback)
+        return self.execute_command('HVALS', key, callback=callback)
 
     ### SCAN COMMANDS
     def scan(self, cursor, count=None, match=None, callback=None):
-        self._scan('SCAN', cursor, count, match, callback)
+        return self._scan('SCAN', cursor, count, match, callback)
 
     def hscan(self, key, cursor, count=None, match=None, callback=None):
-        self._scan('HSCAN', cursor, count, match, callback, key=key)
+        return self._scan('HSCAN', cursor, count, match, callback, key=key)
 
     def sscan(self, key, cursor, count=None, match=None, callback=None):
-        self._scan('SSCAN', cursor, count, match, callback, key=key)
+        return self._scan('SSCAN', cursor, count, match, callback, key=key)
 
     def zscan(self, key, cursor, count=None, match=None, callback=None):
-        self._scan('ZSCAN', cursor, count, match, callback, key=key)
+        return self._scan('ZSCAN', cursor, count, match, callback, key=key)
 
     def _scan(self, cmd, cursor, count, match, callback, key=None):
         tokens = [cmd]
@@ -1024,18 +1569,22 @@ class Client(object):
         tokens.append(cursor)
         match and tokens.extend(['MATCH', match])
         count and tokens.extend(['COUNT', count])
-        self.execute_command(*tokens, callback=callback)
+        return self.execute_command(*tokens, callback=callback)
 
     ### PUBSUB
     def subscribe(self, channels, callback=None):
-        self._subscribe('SUBSCRIBE', channels, callback=callback)
+        return self._subscribe('SUBSCRIBE', channels, callback=callback)
 
     def psubscribe(self, channels, callback=None):
-        self._subscribe('PSUBSCRIBE', channels, callback=callback)
+        return self._subscribe('PSUBSCRIBE', channels, callback=callback)
 
     def _subscribe(self, cmd, channels, callback=None):
         if isinstance(channels, str) or (not PY3 and isinstance(channels, unicode)):
             channels = [channels]
+        future = None
+        if not callback:
+            future = Future()
+            callback = future.set_result
         if not self.subscribed:
             listen_callback = None
             original_cb = stack_context.wrap(callback) if callback else None
@@ -1058,6 +1607,7 @@ class Client(object):
             # Do not execute the same callback multiple times
             listen_callback = None
         self.execute_command(cmd, *channels, callback=callback)
+        return future
 
     def on_subscribed(self, result):
         self.subscribed.add(result.channel)
@@ -1065,29 +1615,38 @@ class Client(object):
     def on_unsubscribed(self, channels, *args, **kwargs):
         channels = set(channels)
         self.subscribed -= channels
-        for cb_channels, cb in self.unsubscribe_callbacks:
+        callbacks = self.unsubscribe_callbacks
+        self.unsubscribe_callbacks = []
+        for cb_channels, cb in callbacks:
             cb_channels.difference_update(channels)
             if not cb_channels:
                 self._io_loop.add_callback(cb)
+            else:
+                self.unsubscribe_callbacks.append((cb_channels, cb))
 
     def unsubscribe(self, channels, callback=None):
-        self._unsubscribe('UNSUBSCRIBE', channels, callback=callback)
+        return self._unsubscribe('UNSUBSCRIBE', channels, callback=callback)
 
     def punsubscribe(self, channels, callback=None):
-        self._unsubscribe('PUNSUBSCRIBE', channels, callback=callback)
+        return self._unsubscribe('PUNSUBSCRIBE', channels, callback=callback)
 
     def _unsubscribe(self, cmd, channels, callback=None):
         if isinstance(channels, str) or (not PY3 and isinstance(channels, unicode)):
             channels = [channels]
-        if callback:
-            cb = stack_context.wrap(callback)
-            # TODO: Do we need to back this up with self._io_loop.add_timeout(time() + 1, cb)?
-            # FIXME: What about PUNSUBSCRIBEs?
-            self.unsubscribe_callbacks.append((set(channels), cb))
+        future = None
+        if not callback:
+            future = Future()
+            callback = partial(future.set_result, True)
+        cb = stack_context.wrap(callback)
+        # TODO: Do we need to back this up with self._io_loop.add_timeout(time() + 1, cb)?
+        # FIXME: What about PUNSUBSCRIBEs?
+        self.unsubscribe_callbacks.append((set(channels), cb))
         self.execute_command(cmd, *channels)
+        return future
 
     def publish(self, channel, message, callback=None):
-        self.execute_command('PUBLISH', channel, message, callback=callback)
+        return self.execute_command('PUBLISH', channel, message,
+                                    callback=callback)
 
     @gen.engine
     def listen(self, callback=None, exit_callback=None):
@@ -1117,6 +1676,10 @@ class Client(object):
             yield gen.Task(client.unsubscribe, 'channel_name')
 
         Unsubscribe from a channel to exit the 'listen' loop.
+
+        The loop waiting for messages keeps the client alive and its
+        connection open, keep a reference to the client to unsubscribe
+        or disconnect it. The client is released once the loop exits.
         """
         if callback:
             def error_wrapper(e):
@@ -1127,11 +1690,9 @@ class Client(object):
 
             cmd_listen = CmdLine('LISTEN')
             while self.subscribed:
-                data = yield gen.Task(self.connection.readline)
-                if isinstance(data, Exception):
-                    raise data
-
-                if data is None:
+                data = yield gen.Task(self.connection.read_reply,
+                                      **self._reply_options())
+                if isinstance(data, ConnectionError):
                     # If disconnected from the redis server clear the list
                     # of subscriber this client has subscribed to
                     channels = self.subscribed
@@ -1142,9 +1703,6 @@ class Client(object):
                     return
 
                 response = self.process_data(data, cmd_listen)
-
-                if isinstance(response, partial):
-                    response = yield gen.Task(response)
                 if isinstance(response, Exception):
                     raise response
 
@@ -1170,10 +1728,10 @@ class Client(object):
     ### CAS
     def watch(self, *key_names, **kwargs):
         callback = kwargs.get('callback', None)
-        self.execute_command('WATCH', *key_names, callback=callback)
+        return self.execute_command('WATCH', *key_names, callback=callback)
 
     def unwatch(self, callback=None):
-        self.execute_command('UNWATCH', callback=callback)
+        return self.execute_command('UNWATCH', callback=callback)
 
     ### LOCKS
     def lock(self, lock_name, lock_ttl=None, polling_interval=0.1):
@@ -1207,8 +1765,8 @@ class Client(object):
             args = []
         num_keys = len(keys)
         _args = keys + args
-        self.execute_command('EVAL', script, num_keys,
-                             *_args, callback=callback)
+        return self.execute_command('EVAL', script, num_keys,
+                                    *_args, callback=callback)
 
     def evalsha(self, shahash, keys=None, args=None, callback=None):
         if keys is None:
@@ -1217,24 +1775,26 @@ class Client(object):
             args = []
         num_keys = len(keys)
         keys.extend(args)
-        self.execute_command('EVALSHA', shahash, num_keys,
-                             *keys, callback=callback)
+        return self.execute_command('EVALSHA', shahash, num_keys,
+                                    *keys, callback=callback)
 
     def script_exists(self, shahashes, callback=None):
         # not yet implemented in the redis protocol
-        self.execute_command('SCRIPT EXISTS', *shahashes, callback=callback)
+        return self.execute_command('SCRIPT EXISTS', *shahashes,
+                                    callback=callback)
 
     def script_flush(self, callback=None):
         # not yet implemented in the redis protocol
-        self.execute_command('SCRIPT FLUSH', callback=callback, verbose=True)
+        return self.execute_command('SCRIPT FLUSH',
+                                    callback=callback, verbose=True)
 
     def script_kill(self, callback=None):
         # not yet implemented in the redis protocol
-        self.execute_command('SCRIPT KILL', callback=callback)
+        return self.execute_command('SCRIPT KILL', callback=callback)
 
     def script_load(self, script, callback=None):
         # not yet implemented in the redis protocol
-        self.execute_command('SCRIPT LOAD', script, callback=callback)
+        return self.execute_command('SCRIPT LOAD', script, callback=callback)
 
 
 class Pipeline(Client):
@@ -1276,11 +1836,25 @@ class Pipeline(Client):
         return results
 
     def format_pipeline_request(self, command_stack):
-        return ''.join(self.format_command(c.cmd, *c.args, **c.kwargs)
-                       for c in command_stack)
+        pack_command = self.pack_command
+        return [buff for c in command_stack
+                for buff in pack_command(c.cmd, *c.args)]
 
-    @gen.engine
     def execute(self, callback=None):
+        """
+        Sends the buffered commands to the Redis server and passes
+        the list of replies to the callback.
+        Returns a Future if called without the callback.
+        """
+        if callback:
+            self._execute(callback=callback)
+            return None
+        future = Future()
+        self._run_with_future(future, self._execute)
+        return future
+
+    @gen.engine
+    def _execute(self, callback=None):
         command_stack = self.command_stack
         self.command_stack = []
         self.executing = True
@@ -1292,22 +1866,21 @@ class Pipeline(Client):
 
             request = self.format_pipeline_request(command_stack)
 
-            password_should_be_sent = (
-                self.password and
-                self.connection.info.get('pass', None) != self.password)
-            if password_should_be_sent:
-                yield gen.Task(self.auth, self.password)
-            db_should_be_selected = (
-                self.selected_db and
-                self.connection.info.get('db', None) != self.selected_db)
-            if db_should_be_selected:
-                yield gen.Task(self.select, self.selected_db)
-
             if not self.connection.connected():
-                yield gen.Task(self.connection.connect)
+                error = yield gen.Task(self.connection.connect)
+                if isinstance(error, ConnectionError):
+                    raise error
 
             if not self.connection.ready():
-                yield gen.Task(self.connection.wait_until_ready)
+                error = yield gen.Task(self.connection.wait_until_ready)
+                if error is not None:
+                    raise error
+
+            setup = self._setup_commands()
+            if setup:
+                error = yield gen.Task(self._setup_connection, setup)
+                if error is not None:
+                    raise error
 
             try:
                 self.connection.write(request)
@@ -1320,30 +1893,37 @@ class Pipeline(Client):
                 self.connection.disconnect()
                 raise e
 
-            responses = []
-            total = len(command_stack)
-            cmds = iter(command_stack)
+            # Wait for all the replies at once to keep them
+            # from being claimed by commands sent after the request
+            read_reply = self.connection.read_reply
+            replies = yield [gen.Task(read_reply,
+                                      **self._reply_options(cmd_line))
+                             for cmd_line in command_stack]
+
+            for data in replies:
+                if isinstance(data, TimeoutError):
+                    self.connection.execute_pending_command()
+                    raise data
 
-            while len(responses) < total:
-                data = yield gen.Task(self.connection.readline)
-                if not data:
+            responses = []
+            for cmd_line, data in zip(command_stack, replies):
+                if isinstance(data, ConnectionError):
                     raise ResponseError('Not enough data after EXEC')
                 try:
-                    cmd_line = next(cmds)
                     if self.transactional and cmd_line.cmd != 'EXEC':
                         response = self.process_data(data,
                                                      CmdLine('MULTI_PART'))
                     else:
                         response = self.process_data(data, cmd_line)
-                    if isinstance(response, partial):
-                        response = yield gen.Task(response)
                     responses.append(response)
                 except Exception as e:
                     responses.append(e)
 
             if self.transactional:
                 command_stack = command_stack[:-1]
-                responses = responses[-1]
+                # EXEC returns a null multi-bulk reply
+                # if the transaction has been aborted
+                responses = responses[-1] or []
                 results = self.format_replies(command_stack[1:], responses)
             else:
                 results = self.format_replies(command_stack, responses)
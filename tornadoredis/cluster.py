@@ -0,0 +1,519 @@
+import logging
+import random
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.escape import to_basestring
+from tornado.ioloop import IOLoop
+
+from .client import (Client, RetryPolicy, PY3, TEXT_TYPE, PUB_SUB_COMMANDS,
+                     release_client)
+from .connection import ConnectionPool
+from .exceptions import (RedisError, ConnectionError, TimeoutError,
+                         ResponseError, RequestError, ClusterError)
+
+
+log = logging.getLogger('tornadoredis.cluster')
+
+
+CLUSTER_SLOTS = 16384
+
+# CRC16-CCITT (XMODEM) used by the Redis Cluster to map keys to slots
+CRC16_TABLE = []
+for n in range(256):
+    crc = n << 8
+    for __ in range(8):
+        crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xffff
+    CRC16_TABLE.append(crc)
+
+
+def crc16(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffff) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def key_slot(key):
+    """
+    Returns the cluster slot of the key (bytes). Only the part of the key
+    between the first '{' and the following '}' is hashed if not empty,
+    so keys sharing such a hash tag are stored in the same slot.
+    """
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc16(key) % CLUSTER_SLOTS
+
+
+# Commands sent to any node
+KEYLESS_COMMANDS = frozenset([
+    'PING', 'ECHO', 'INFO', 'TIME', 'DBSIZE', 'LASTSAVE', 'RANDOMKEY',
+    'SCAN', 'KEYS', 'FLUSHDB', 'FLUSHALL', 'SAVE', 'BGSAVE',
+    'BGREWRITEAOF', 'CONFIG', 'CLIENT', 'CLUSTER', 'SCRIPT', 'PUBLISH',
+    'COMMAND', 'SLOWLOG', 'MEMORY', 'WAIT',
+])
+
+# Commands with the key following the first argument
+SECOND_ARG_KEY_COMMANDS = frozenset(['BITOP', 'OBJECT'])
+
+# Commands with the keys following the STREAMS option
+STREAMS_KEY_COMMANDS = frozenset(['XREAD', 'XREADGROUP'])
+
+# Multi-key commands split by slots: the number of arguments per key
+# and the function merging the replies of the slots (None for MGET,
+# the values are put in the order of the keys)
+MULTI_KEY_COMMANDS = {
+    'MGET': (1, None),
+    'MSET': (2, all),
+    'DEL': (1, any),
+    'EXISTS': (1, any),
+    'UNLINK': (1, sum),
+    'TOUCH': (1, sum),
+}
+
+
+def command_key(cmd, args):
+    """
+    Returns the key the command is routed by,
+    or None if the command does not take keys.
+    """
+    if cmd in KEYLESS_COMMANDS or not args:
+        return None
+    if cmd in ('EVAL', 'EVALSHA'):
+        if len(args) < 3 or not int(args[1]):
+            return None
+        return args[2]
+    if cmd in SECOND_ARG_KEY_COMMANDS:
+        if len(args) < 2:
+            return None
+        return args[1]
+    if cmd in STREAMS_KEY_COMMANDS:
+        return streams_key(args)
+    return args[0]
+
+
+def streams_key(args):
+    """
+    Returns the first key following the STREAMS option of XREAD
+    or XREADGROUP, or None if there is no such option.
+    """
+    n = 0
+    while n < len(args) - 1:
+        option = args[n]
+        if isinstance(option, (bytes, TEXT_TYPE)):
+            option = to_basestring(option).upper()
+            if option == 'STREAMS':
+                return args[n + 1]
+            if option == 'GROUP':
+                # The group and consumer names may be anything
+                n += 2
+        n += 1
+    return None
+
+
+def split_keys(cmd, args, key_group):
+    """
+    Groups the keys of the multi-key command by key_group(key).
+    Returns a dict mapping the groups to the positions of their keys
+    in the arguments.
+    """
+    step = MULTI_KEY_COMMANDS[cmd][0]
+    groups = {}
+    for n in range(0, len(args), step):
+        groups.setdefault(key_group(args[n]), []).append(n)
+    return groups
+
+
+def group_args(cmd, args, positions):
+    """
+    Returns the arguments of the command for the keys at the positions.
+    """
+    step = MULTI_KEY_COMMANDS[cmd][0]
+    return [args[n + i] for n in positions for i in range(step)]
+
+
+def merge_replies(cmd, args, groups, replies):
+    """
+    Merges the replies to the commands sent for the groups of keys
+    (a dict mapping the groups to the replies) in the reply
+    of the multi-key command. Groups without replies are skipped,
+    MGET returns None values for their keys.
+    """
+    step, merge = MULTI_KEY_COMMANDS[cmd]
+    if merge is not None:
+        return merge(replies.values())
+    result = [None] * (len(args) // step)
+    for group, reply in replies.items():
+        for n, value in zip(groups[group], reply):
+            result[n // step] = value
+    return result
+
+
+@gen.coroutine
+def capture_error(future):
+    """
+    Returns the error raised by the command instead of raising it,
+    so a failed command does not abandon the commands sent along.
+    """
+    try:
+        reply = yield future
+    except RedisError as e:
+        reply = e
+    raise gen.Return(reply)
+
+
+# Commands changing the state of the connection, which is released
+# back to the pool right after the command
+CONNECTION_STATE_COMMANDS = frozenset(PUB_SUB_COMMANDS + ('SELECT', 'AUTH'))
+
+
+class RoutingClient(Client):
+    """
+    A base class of the clients sending each command over a connection
+    of the server the command is routed to.
+
+    Pipelines, Pub/Sub, SELECT and AUTH are rejected with RequestError,
+    pass the selected_db and password arguments to the client instead.
+    """
+    def _unsupported(self, feature):
+        return RequestError('%s not supported by the %s'
+                            % (feature, self.__class__.__name__))
+
+    def check_command(self, cmd):
+        """
+        Raises RequestError if the command can't be routed.
+        """
+        if cmd in CONNECTION_STATE_COMMANDS:
+            raise self._unsupported('%s is' % cmd)
+
+    def pipeline(self, transactional=False):
+        raise self._unsupported('Pipelines are')
+
+    def select(self, db, callback=None):
+        raise self._unsupported('SELECT is')
+
+    def auth(self, password, callback=None):
+        raise self._unsupported('AUTH is')
+
+    def _subscribe(self, cmd, channels, callback=None):
+        raise self._unsupported('Pub/Sub is')
+
+    def _unsubscribe(self, cmd, channels, callback=None):
+        raise self._unsupported('Pub/Sub is')
+
+    def listen(self, callback=None, exit_callback=None):
+        raise self._unsupported('Pub/Sub is')
+
+
+class ClusterClient(RoutingClient):
+    """
+    Sends commands to the Redis Cluster node serving the slot
+    of the command key, using a connection pool per node.
+
+    Arguments:
+        startup_nodes - a list of (host, port) addresses of cluster nodes
+                        to load the slot map from,
+        max_redirects - a maximum number of MOVED and ASK redirections
+                        to follow for a command,
+        pool_kwargs - a dict of ConnectionPool arguments for node pools,
+        **client_kwargs - arguments of the clients sending commands
+                          to the nodes, e.g. password or command_timeout.
+
+    The slot map is loaded with CLUSTER SLOTS before the first command.
+    A MOVED redirection updates the slot right away and reloads the map
+    in the background, an ASK redirection is followed for the single
+    command.
+
+    MGET, MSET, DEL, EXISTS, UNLINK and TOUCH with keys in different
+    slots are split into a command per slot, the commands are sent
+    to the nodes in parallel, pipelined per node, and the replies are
+    merged in the order of the keys. ClusterError is raised if some
+    of the nodes fail. Other commands with keys in different slots fail
+    with the CROSSSLOT error. Pipelines, Pub/Sub and SELECT are not
+    supported, RequestError is raised for them.
+    """
+    def __init__(self, startup_nodes, io_loop=None, max_redirects=5,
+                 pool_kwargs=None, **client_kwargs):
+        self._io_loop = io_loop or IOLoop.current()
+        # Commands are sent by the node clients
+        self._connection_pool = None
+        self.connection = None
+        self.subscribed = set()
+        self.selected_db = 0
+        # Shared by the node clients
+        client_kwargs.setdefault('retry_policy', RetryPolicy())
+        self.retry_policy = client_kwargs['retry_policy']
+        self.startup_nodes = [tuple(node) for node in startup_nodes]
+        self.max_redirects = max_redirects
+        self.pool_kwargs = pool_kwargs or {}
+        self.client_kwargs = client_kwargs
+        # Keys are hashed as encoded by the node clients
+        self.encoding = (client_kwargs.get('encoding') or
+                         self.pool_kwargs.get('encoding') or 'utf-8')
+        # The node address serving each slot
+        self.slots = None
+        self.pools = {}
+        self._refreshing = None
+        self._refreshes = 0
+        self._redirects = 0
+
+    def __repr__(self):
+        return 'tornadoredis.ClusterClient (%s)' % (
+            ', '.join('%s:%s' % node for node in self.startup_nodes))
+
+    def execute_command(self, cmd, *args, **kwargs):
+        """
+        Sends the command to the node serving its key and passes
+        the reply to the callback.
+
+        Returns a Future resolved with the reply if called without
+        the callback.
+        """
+        self.check_command(cmd)
+        callback = kwargs.pop('callback', None)
+        if callback:
+            self._execute_cluster_command(cmd, args, kwargs,
+                                          callback=callback)
+            return None
+        future = Future()
+        self._run_with_future(future, self._execute_cluster_command,
+                              cmd, args, kwargs)
+        return future
+
+    def command_slot(self, cmd, args):
+        """
+        Returns the slot of the command key,
+        or None if the command does not take keys.
+        """
+        key = command_key(cmd, args)
+        if key is None:
+            return None
+        return key_slot(self.encode(key))
+
+    def node_for_slot(self, slot):
+        """
+        Returns the (host, port) address of the node serving the slot.
+        """
+        node = None
+        if slot is not None and self.slots is not None:
+            node = self.slots[slot]
+        if node is None:
+            # Keyless commands and slots not covered by the map
+            nodes = list(self.pools) or self.startup_nodes
+            node = random.choice(nodes)
+        return node
+
+    def get_pool(self, node):
+        """
+        Returns the connection pool of the node.
+        """
+        pool = self.pools.get(node)
+        if pool is None:
+            kwargs = dict(self.pool_kwargs)
+            kwargs.setdefault('io_loop', self._io_loop)
+            pool = ConnectionPool(host=node[0], port=node[1], **kwargs)
+            self.pools[node] = pool
+        return pool
+
+    def node_client(self, node, auto_pipeline=False):
+        """
+        Returns a client holding a connection of the node pool.
+        Call release_client once done with the client.
+        """
+        kwargs = self.client_kwargs
+        if auto_pipeline:
+            kwargs = dict(kwargs, multiplexed=True, auto_pipeline=True)
+        return Client(connection_pool=self.get_pool(node),
+                      io_loop=self._io_loop, **kwargs)
+
+    release_client = staticmethod(release_client)
+
+    def refresh_slots(self, callback=None):
+        """
+        Loads the slot map with CLUSTER SLOTS asking the known nodes
+        in turn. Concurrent calls share the same request.
+        """
+        if self._refreshing is None:
+            self._refreshing = Future()
+            self._run_with_future(self._refreshing, self._load_slots)
+            self._refreshing.add_done_callback(self._on_slots_loaded)
+        future = self._refreshing
+        if callback:
+            self._io_loop.add_future(future,
+                                     lambda future: callback(future.result()))
+            return None
+        return future
+
+    def close(self):
+        """
+        Closes idle connections of the node pools.
+        """
+        for pool in self.pools.values():
+            pool.close()
+
+    def stats(self):
+        """
+        Returns a dict with numbers of known nodes, slot map loads
+        and redirections followed.
+        """
+        return {
+            'nodes': len(self.pools),
+            'refreshes': self._refreshes,
+            'redirects': self._redirects,
+        }
+
+    def _on_slots_loaded(self, future):
+        self._refreshing = None
+        error = future.exception()
+        if error is not None:
+            log.warning('%s', error)
+
+    @gen.engine
+    def _load_slots(self, callback=None):
+        nodes = list(self.pools) + [node for node in self.startup_nodes
+                                    if node not in self.pools]
+        error = None
+        for node in nodes:
+            client = self.node_client(node)
+            try:
+                reply = yield client.execute_command('CLUSTER', 'SLOTS')
+            except (ConnectionError, TimeoutError) as e:
+                log.warning('Failed to load the slot map from %s:%s: %s',
+                            node[0], node[1], e)
+                error = e
+                continue
+            finally:
+                self.release_client(client)
+            if isinstance(reply, ResponseError) or not reply:
+                error = reply
+                continue
+            self._set_slots(node, reply)
+            callback(True)
+            return
+        raise ConnectionError('Failed to load the cluster slot map: %s'
+                              % error)
+
+    def _set_slots(self, queried_node, reply):
+        slots = [None] * CLUSTER_SLOTS
+        for entry in reply:
+            host, port = entry[2][0], int(entry[2][1])
+            if not PY3 and isinstance(host, unicode):
+                host = host.encode('utf-8')
+            # Older servers return an empty host for the queried node
+            node = (host or queried_node[0], port)
+            self.get_pool(node)
+            for slot in range(int(entry[0]), int(entry[1]) + 1):
+                slots[slot] = node
+        self.slots = slots
+        self._refreshes += 1
+        nodes = set(slots)
+        for node in list(self.pools):
+            if node not in nodes and node not in self.startup_nodes:
+                self.pools.pop(node).close()
+
+    @gen.engine
+    def _execute_cluster_command(self, cmd, args, kwargs, callback=None):
+        if self.slots is None:
+            yield self.refresh_slots()
+        if cmd in MULTI_KEY_COMMANDS:
+            groups = split_keys(cmd, args,
+                                lambda key: key_slot(self.encode(key)))
+            if len(groups) > 1:
+                reply = yield self._execute_split_command(cmd, args, kwargs,
+                                                          groups)
+                callback(reply)
+                return
+        slot = self.command_slot(cmd, args)
+        node = self.node_for_slot(slot)
+        asking = False
+        redirects = 0
+        while True:
+            client = self.node_client(node)
+            try:
+                if asking:
+                    yield client.execute_command('ASKING')
+                reply = yield client.execute_command(cmd, *args, **kwargs)
+            except ConnectionError:
+                # The node may have failed over to a replica
+                self.refresh_slots()
+                raise
+            finally:
+                self.release_client(client)
+            redirect = self._redirection(reply)
+            if redirect is None or redirects >= self.max_redirects:
+                break
+            redirects += 1
+            self._redirects += 1
+            kind, slot, node = redirect
+            asking = kind == 'ASK'
+            if kind == 'MOVED':
+                if self.slots is not None:
+                    self.slots[slot] = node
+                # Other slots served by the node have likely moved too
+                self.refresh_slots()
+        callback(reply)
+
+    def _redirection(self, reply):
+        if not isinstance(reply, ResponseError):
+            return None
+        parts = reply.message.split()
+        if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+            return None
+        host, __, port = parts[2].rpartition(':')
+        return parts[0], int(parts[1]), (host, int(port))
+
+    @gen.coroutine
+    def _execute_split_command(self, cmd, args, kwargs, groups):
+        slot_args = {}
+        node_slots = {}
+        for slot, positions in groups.items():
+            slot_args[slot] = group_args(cmd, args, positions)
+            node = self.node_for_slot(slot)
+            node_slots.setdefault(node, []).append(slot)
+        nodes = list(node_slots)
+        batches = yield [self._execute_batch(node, cmd, node_slots[node],
+                                             slot_args, kwargs)
+                         for node in nodes]
+        replies = {}
+        errors = {}
+        for node, batch in zip(nodes, batches):
+            for slot, reply in zip(node_slots[node], batch):
+                if isinstance(reply, RedisError):
+                    errors.setdefault(node, reply)
+                else:
+                    replies[slot] = reply
+        result = merge_replies(cmd, args, groups, replies)
+        if errors:
+            raise ClusterError(
+                '%s failed on %d of %d nodes: %s' % (
+                    cmd, len(errors), len(nodes),
+                    '; '.join('%s:%s %s' % (node[0], node[1], errors[node])
+                              for node in sorted(errors))),
+                errors=errors, result=result)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _execute_batch(self, node, cmd, slots, slot_args, kwargs):
+        # The commands are written to the node in a single request
+        client = self.node_client(node, auto_pipeline=True)
+        try:
+            replies = yield [capture_error(client.execute_command(
+                cmd, *slot_args[slot], **kwargs)) for slot in slots]
+        finally:
+            self.release_client(client)
+        if any(isinstance(reply, ConnectionError) for reply in replies):
+            # The node may have failed over to a replica
+            self.refresh_slots()
+        redirected = [n for n, reply in enumerate(replies)
+                      if self._redirection(reply) is not None]
+        if redirected:
+            # The slots have moved, the commands follow the redirections
+            # one by one
+            results = yield [capture_error(self.execute_command(
+                cmd, *slot_args[slots[n]], **kwargs)) for n in redirected]
+            for n, reply in zip(redirected, results):
+                replies[n] = reply
+        raise gen.Return(replies)
@@ -1,13 +1,29 @@
 import sys
 import socket
+import random
+import time
 from functools import partial
 import weakref
 from collections import deque
 
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.iostream import IOStream
+from tornado.netutil import (Resolver, BlockingResolver, ThreadedResolver,
+                             is_valid_ip)
 from tornado import stack_context
 
-from .exceptions import ConnectionError
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+from .exceptions import (ConnectionError, ResponseError, InvalidResponse,
+                         TimeoutError)
 
 
 PY3 = sys.version > '3'
@@ -16,31 +32,365 @@ if PY3:
 else:
     CRLF = '\r\n'
 
+# Maximum number of bytes requested from the stream per read operation
+READ_CHUNK_SIZE = 65536
+
+# Buffers larger than this are written to the stream without
+# being joined with other buffers
+BUFFER_CUTOFF = 6000
+
+# Bulk replies larger than this are received directly into
+# a preallocated buffer by the PythonReader
+LARGE_BULK_SIZE = 256 * 1024
+
+# Reply type markers as returned by indexing a bytearray
+_STATUS_REPLY = ord('+')
+_ERROR_REPLY = ord('-')
+_INTEGER_REPLY = ord(':')
+_BULK_REPLY = ord('$')
+_MULTI_BULK_REPLY = ord('*')
+
+
+def default_resolver():
+    """
+    Returns a new instance of the configured Resolver class,
+    or a ThreadedResolver if it's the BlockingResolver (the Tornado 4
+    default, blocking the IOLoop) and concurrent.futures is available.
+    """
+    if (futures is not None and
+            Resolver.configured_class() is BlockingResolver):
+        return ThreadedResolver()
+    return Resolver()
+
+
+class PythonReader(object):
+    """
+    An incremental Redis protocol (RESP) parser.
+
+    Accepts chunks of data of arbitrary size using the ``feed`` method
+    and returns complete (and possibly nested) replies one by one from the
+    ``gets`` method. ``gets`` returns False if the buffered data
+    does not contain a complete reply yet.
+
+    Bulk replies larger than LARGE_BULK_SIZE are copied from the fed
+    chunks into a preallocated bytearray, which is returned as is
+    if the reader has no encoding.
+
+    Arguments:
+        protocolError - an exception class raised on malformed data,
+        replyError - a class used to instantiate error replies,
+        encoding - decode status and bulk replies using this encoding
+                   if specified, return them as bytes otherwise,
+        hashable_members - return large bulk replies nested in
+                           multi-bulk replies as bytes, so that they
+                           can be used as set members or dict keys.
+    """
+    def __init__(self, protocolError=InvalidResponse,
+                 replyError=ResponseError, encoding=None,
+                 hashable_members=False):
+        self.protocolError = protocolError
+        self.replyError = replyError
+        self.encoding = encoding
+        self.hashable_members = hashable_members
+        self._buffer = bytearray()
+        self._pos = 0
+        # Multi-bulk replies being assembled: [items, expected_length]
+        self._stack = []
+        # A large bulk reply being received, including the trailing CRLF
+        self._bulk = None
+        self._bulk_pos = 0
+
+    def set_encoding(self, encoding=None, errors=None):
+        self.encoding = encoding
+
+    def feed(self, data):
+        bulk = self._bulk
+        if bulk is not None and self._bulk_pos < len(bulk):
+            start = self._bulk_pos
+            size = min(len(bulk) - start, len(data))
+            if size < len(data):
+                bulk[start:start + size] = data[:size]
+                data = data[size:]
+            else:
+                bulk[start:start + size] = data
+                data = b''
+            self._bulk_pos = start + size
+            if not data:
+                return
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer += data
+
+    def _start_bulk(self, start, length):
+        buf = self._buffer
+        bulk = bytearray(length + 2)
+        size = min(len(buf) - start, len(bulk))
+        bulk[:size] = buf[start:start + size]
+        self._bulk = bulk
+        self._bulk_pos = size
+        self._pos = start + size
+
+    def _finish_bulk(self):
+        bulk = self._bulk
+        self._bulk = None
+        self._bulk_pos = 0
+        # Trimming the end of a bytearray does not copy it
+        del bulk[-2:]
+        if self.encoding:
+            return bulk.decode(self.encoding)
+        if self.hashable_members and self._stack:
+            return bytes(bulk)
+        return bulk
+
+    def gets(self):
+        stack = self._stack
+        if self._bulk is not None:
+            if self._bulk_pos < len(self._bulk):
+                return False
+            value = self._finish_bulk()
+            while stack:
+                items = stack[-1][0]
+                items.append(value)
+                if len(items) < stack[-1][1]:
+                    break
+                value = items
+                stack.pop()
+            else:
+                return value
+        buf = self._buffer
+        pos = self._pos
+        encoding = self.encoding
+        while True:
+            eol = buf.find(CRLF, pos)
+            if eol == -1:
+                break
+            head = buf[pos]
+            if head == _BULK_REPLY:
+                length = int(buf[pos + 1:eol])
+                if length < 0:
+                    value = None
+                    pos = eol + 2
+                else:
+                    start = eol + 2
+                    end = start + length
+                    if len(buf) < end + 2:
+                        if length > LARGE_BULK_SIZE:
+                            self._start_bulk(start, length)
+                            return False
+                        break
+                    value = bytes(buf[start:end])
+                    if encoding:
+                        value = value.decode(encoding)
+                    pos = end + 2
+            elif head == _INTEGER_REPLY:
+                value = int(buf[pos + 1:eol])
+                pos = eol + 2
+            elif head == _MULTI_BULK_REPLY:
+                length = int(buf[pos + 1:eol])
+                pos = eol + 2
+                if length > 0:
+                    stack.append([[], length])
+                    continue
+                value = None if length < 0 else []
+            elif head == _STATUS_REPLY:
+                value = bytes(buf[pos + 1:eol])
+                if encoding:
+                    value = value.decode(encoding)
+                pos = eol + 2
+            elif head == _ERROR_REPLY:
+                value = self.replyError(
+                    bytes(buf[pos + 1:eol]).decode('utf-8', 'replace'))
+                pos = eol + 2
+            else:
+                raise self.protocolError(
+                    'Protocol error, got %r as reply type byte'
+                    % bytes(buf[pos:pos + 1]))
+
+            # Attach the value to the multi-bulk reply being assembled
+            while stack:
+                items = stack[-1][0]
+                items.append(value)
+                if len(items) < stack[-1][1]:
+                    break
+                value = items
+                stack.pop()
+            else:
+                self._pos = pos
+                return value
+        self._pos = pos
+        return False
+
+
+# Use the C parser shipped with the hiredis package if it is installed.
+# Reader classes are expected to provide the hiredis.Reader interface.
+if hiredis:
+    DefaultReader = hiredis.Reader
+else:
+    DefaultReader = PythonReader
+
+
+class ReconnectPolicy(object):
+    """
+    Delays connection attempts following failed ones with an exponential
+    backoff and random jitter, and fails connection attempts right away
+    while the Redis server seems to be down.
+
+    After ``failure_threshold`` consecutive failed attempts the circuit
+    breaker opens and connection attempts fail with ConnectionError.
+    In ``recovery_timeout`` seconds a single attempt is let through
+    (the breaker is half-open), the breaker closes if it succeeds
+    and opens again otherwise.
+
+    Share an instance between connections to the same Redis server,
+    e.g. pass it to the ConnectionPool.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, base_delay=0.1, max_delay=10, failure_threshold=5,
+                 recovery_timeout=10):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def connect_delay(self):
+        """
+        Returns a number of seconds to wait before the connection attempt.
+        Raises ConnectionError if the circuit breaker is open.
+        """
+        if self.state == self.OPEN:
+            if time.time() - self._opened_at < self.recovery_timeout:
+                raise ConnectionError('Circuit breaker is open')
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                raise ConnectionError('Circuit breaker is open')
+            self._probing = True
+            return 0
+        if not self.failures:
+            return 0
+        delay = min(self.base_delay * 2 ** min(self.failures - 1, 32),
+                    self.max_delay)
+        # Spread the attempts of connections failed at the same time
+        return random.uniform(0, delay)
+
+    def connect_succeeded(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def connect_failed(self):
+        self.failures += 1
+        self._probing = False
+        if (self.state == self.HALF_OPEN or
+                self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self._opened_at = time.time()
+
+    def connect_cancelled(self):
+        self._probing = False
+
 
 class Connection(object):
+    """
+    A Redis server connection.
+
+    Replies are decoded using the ``encoding`` unless
+    ``decode_responses`` is False, in which case bulk and status
+    replies are returned as bytes.
+
+    The host name is resolved using the ``resolver`` (by default
+    a new instance of the configured tornado.netutil.Resolver class,
+    or a ThreadedResolver in place of the blocking one), IP addresses
+    are not resolved unless the resolver is passed.
+    Connection attempts taking longer than ``connect_timeout``
+    seconds (``stop_after`` by default) fail.
+    Connection attempts are delayed or failed by the ``reconnect_policy``
+    (a ReconnectPolicy instance) if given.
+    """
     def __init__(self, host='localhost', port=6379, unix_socket_path=None,
-                 event_handler_proxy=None, stop_after=None, io_loop=None):
+                 event_handler_proxy=None, stop_after=None, io_loop=None,
+                 reader_class=None, encoding='utf-8', decode_responses=True,
+                 connect_timeout=None, resolver=None, reconnect_policy=None):
         self.host = host
         self.port = port
         self.unix_socket_path = unix_socket_path
         self._event_handler = event_handler_proxy
         self.timeout = stop_after
+        self.connect_timeout = connect_timeout or stop_after
+        self.resolver = resolver
+        self.reconnect_policy = reconnect_policy
         self._stream = None
         self._io_loop = io_loop
+        # The stream being connected, or True while resolving the host
+        self._connecting = None
+        self._connect_callbacks = []
+        self._connect_timeout = None
+        self._connect_delay = None
+        # The error the last connection attempt has failed with
+        self.connect_error = None
 
         self.in_progress = False
         self.read_callbacks = set()
         self.ready_callbacks = deque()
+        # Callbacks waiting for replies, in the order of the sent commands
+        self.reply_callbacks = deque()
+        # The earliest reply deadline and its IOLoop timeout
+        self._reply_deadline = None
+        self._reply_timeout = None
+        self._reading = False
+        # Data to be written at the end of the current IOLoop iteration
+        self._write_queue = []
         self._lock = 0
-        self.info = {'db': 0, 'pass': None}
+        # The NearCache the connection tracks keys for
+        # and the ID of its subscriber connection, and a Future
+        # of the setup commands sent ahead of multiplexed commands
+        self.info = {'db': 0, 'pass': None, 'name': None,
+                     'tracking': None, 'tracking_id': None, 'setup': None}
+        self.encoding = encoding
+        self.decode_responses = decode_responses
+        self.reader_class = reader_class or DefaultReader
+        self._reader = self.make_reader()
 
     def __del__(self):
         self.disconnect()
 
+    def make_reader(self):
+        self._reader_encoding = self.reply_encoding()
+        kwargs = {}
+        if issubclass(self.reader_class, PythonReader):
+            # Members of SMEMBERS and HGETALL replies are put in
+            # sets and used as dict keys
+            kwargs['hashable_members'] = True
+        return self.reader_class(protocolError=InvalidResponse,
+                                 replyError=ResponseError,
+                                 encoding=self._reader_encoding,
+                                 **kwargs)
+
+    def reply_encoding(self, encoding=None, decode_responses=None):
+        """
+        Returns the encoding used to decode replies, or None if replies
+        should be returned as bytes.
+        Arguments default to the connection settings.
+        """
+        if decode_responses is None:
+            decode_responses = self.decode_responses
+        if not decode_responses:
+            return None
+        return encoding or self.encoding
+
     def execute_pending_command(self):
         # Continue with the pending command execution
         # if all read operations are completed.
-        if not self.read_callbacks and self.ready_callbacks:
+        if (not self.read_callbacks and not self.reply_callbacks and
+                self.ready_callbacks):
             # Pop a SINGLE callback from the queue and execute it.
             # The next one will be executed from the code
             # invoked by the callback
@@ -48,6 +398,15 @@ class Connection(object):
             callback()
 
     def ready(self):
+        return (not self.read_callbacks and
+                not self.reply_callbacks and
+                not self.ready_callbacks)
+
+    def multiplexable(self):
+        """
+        Returns True if a command may be sent before the replies
+        to previously sent commands are received.
+        """
         return (not self.read_callbacks and
                 not self.ready_callbacks)
 
@@ -60,40 +419,223 @@ class Connection(object):
                 callback()
 
     def connect(self, callback=None):
-        if not self._stream:
-            try:
-                if self.unix_socket_path:
-                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                    endpoint = self.unix_socket_path
-                else:
-                    sock = socket.create_connection(
-                        (self.host, self.port),
-                        timeout=self.timeout
-                    )
-                    sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-                    endpoint = (self.host, self.port)
-                sock.settimeout(self.timeout)
-                self._stream = IOStream(sock, io_loop=self._io_loop)
-                self._stream.connect(endpoint, partial(self._on_connect, callback))
-            except socket.error as e:
-                raise ConnectionError(str(e))
-
-    def _on_connect(self, callback):
+        """
+        Connects to the Redis server without blocking the IOLoop.
+
+        The callback is called without arguments when connected, or with
+        a ConnectionError instance if the connection attempt has failed.
+        """
+        if callback:
+            self._connect_callbacks.append(stack_context.wrap(callback))
+        if self._connecting:
+            return
+        if self._stream:
+            self._run_connect_callbacks()
+            return
+        self._connecting = True
+        self.connect_error = None
+        self._reader = self.make_reader()
         self.info['db'] = 0
         self.info['pass'] = None
-        self._stream.set_close_callback(self.on_stream_close)
-        callback()
+        self.info['name'] = None
+        self.info['tracking'] = None
+        self.info['tracking_id'] = None
+        self.info['setup'] = None
+        # Replies to commands sent over the previous stream
+        # will never arrive
+        self._fail_replies(ConnectionError('Connection lost'))
+        delay = 0
+        if self.reconnect_policy is not None:
+            try:
+                delay = self.reconnect_policy.connect_delay()
+            except ConnectionError as e:
+                # Rejected by the circuit breaker, the pending probe
+                # (if any) belongs to another attempt
+                self._connect_failed(e, rejected=True)
+                return
+        if delay:
+            io_loop = self._io_loop or IOLoop.current()
+            self._connect_delay = io_loop.add_timeout(io_loop.time() + delay,
+                                                      self._start_connect)
+        else:
+            self._start_connect()
+
+    def _start_connect(self):
+        self._connect_delay = None
+        io_loop = self._io_loop or IOLoop.current()
+        if self.connect_timeout:
+            self._connect_timeout = io_loop.add_timeout(
+                io_loop.time() + self.connect_timeout,
+                partial(self._connect_failed,
+                        ConnectionError('Connection timed out')))
+        if self.unix_socket_path:
+            self._connect_stream(socket.AF_UNIX, self.unix_socket_path)
+            return
+        if self.resolver is None:
+            if is_valid_ip(self.host):
+                # Nothing to resolve
+                family = socket.AF_INET
+                if ':' in self.host:
+                    family = socket.AF_INET6
+                self._connect_stream(family, (self.host, self.port))
+                return
+            self.resolver = default_resolver()
+        try:
+            future = self.resolver.resolve(self.host, self.port)
+        except socket.error as e:
+            self._connect_failed(ConnectionError(str(e)))
+            return
+        io_loop.add_future(future, self._on_resolve)
+
+    def _on_resolve(self, future):
+        if self._connecting is not True:
+            # Disconnected or timed out while resolving the host name
+            return
+        try:
+            family, address = future.result()[0]
+        except Exception as e:
+            self._connect_failed(ConnectionError(str(e)))
+            return
+        self._connect_stream(family, address)
+
+    def _connect_stream(self, family, address):
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            if family != getattr(socket, 'AF_UNIX', None):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            stream = IOStream(sock, io_loop=self._io_loop)
+        except socket.error as e:
+            self._connect_failed(ConnectionError(str(e)))
+            return
+        self._connecting = stream
+        stream.set_close_callback(partial(self.on_stream_close, stream))
+        stream.connect(address, partial(self._on_connect, stream))
+
+    def _on_connect(self, stream):
+        if stream is not self._connecting:
+            return
+        self._clear_connect_timeout()
+        self._connecting = None
+        self._stream = stream
+        # Send the commands written while connecting
+        if self._write_queue:
+            self.write([])
+        if self.reply_callbacks:
+            self._read_replies()
+        if self.reconnect_policy is not None:
+            self.reconnect_policy.connect_succeeded()
+        self._run_connect_callbacks()
         self.fire_event('on_connect')
 
-    def on_stream_close(self):
-        if self._stream:
+    def _connect_failed(self, error, attempted=True, rejected=False):
+        stream = self._connecting
+        if not stream:
+            return
+        self._clear_connect_timeout()
+        self._connecting = None
+        self.connect_error = error
+        if self._connect_delay is not None:
+            io_loop = self._io_loop or IOLoop.current()
+            io_loop.remove_timeout(self._connect_delay)
+            self._connect_delay = None
+            attempted = False
+        policy = self.reconnect_policy
+        if policy is None or rejected:
+            pass
+        elif attempted:
+            policy.connect_failed()
+        else:
+            policy.connect_cancelled()
+        if stream is not True:
+            stream.set_close_callback(None)
+            stream.close()
+        self._write_queue = []
+        self._fail_replies(error)
+        self._run_connect_callbacks(error)
+
+    def _clear_connect_timeout(self):
+        if self._connect_timeout is not None:
+            io_loop = self._io_loop or IOLoop.current()
+            io_loop.remove_timeout(self._connect_timeout)
+            self._connect_timeout = None
+
+    def _run_connect_callbacks(self, *args):
+        callbacks = self._connect_callbacks
+        self._connect_callbacks = []
+        for callback in callbacks:
+            callback(*args)
+
+    def on_stream_close(self, stream=None):
+        if stream is not None and stream is self._connecting:
+            error = stream.error or 'Connection refused'
+            self._connect_failed(ConnectionError(str(error)))
+            return
+        # Ignore streams closed before reconnecting
+        if self._stream and stream in (None, self._stream):
             self.disconnect()
             callbacks = self.read_callbacks
             self.read_callbacks = set()
             for callback in callbacks:
                 callback()
+            self._fail_replies(ConnectionError('Connection lost'))
+
+    def _fail_replies(self, error):
+        self._reading = False
+        self._clear_reply_timeout()
+        callbacks = self.reply_callbacks
+        self.reply_callbacks = deque()
+        while callbacks:
+            callbacks.popleft()[0](error)
+
+    def _set_reply_timeout(self, deadline):
+        io_loop = self._io_loop or IOLoop.current()
+        self._clear_reply_timeout()
+        self._reply_deadline = deadline
+        self._reply_timeout = io_loop.add_timeout(deadline,
+                                                  self._on_reply_timeout)
+
+    def _clear_reply_timeout(self):
+        if self._reply_timeout is not None:
+            io_loop = self._io_loop or IOLoop.current()
+            io_loop.remove_timeout(self._reply_timeout)
+            self._reply_timeout = None
+            self._reply_deadline = None
+
+    def _on_reply_timeout(self):
+        self._reply_timeout = None
+        self._reply_deadline = None
+        now = (self._io_loop or IOLoop.current()).time()
+        deadlines = [deadline for __, __, deadline in self.reply_callbacks
+                     if deadline is not None]
+        if not deadlines:
+            return
+        if min(deadlines) > now:
+            # The reply the timeout has been set for is received
+            self._set_reply_timeout(min(deadlines))
+            return
+        # Replies are read in order, so the late reply would be taken
+        # for a reply to the next command. Drop the connection, commands
+        # waiting for replies are sent again by the client.
+        callbacks = self.reply_callbacks
+        self.reply_callbacks = deque()
+        self._reading = False
+        self.disconnect()
+        write_callbacks = self.read_callbacks
+        self.read_callbacks = set()
+        for callback in write_callbacks:
+            callback()
+        for callback, __, deadline in callbacks:
+            if deadline is not None and deadline <= now:
+                callback(TimeoutError('Timed out waiting for reply'))
+            else:
+                callback(ConnectionError('Connection reset after '
+                                         'a command timeout'))
 
     def disconnect(self):
+        self._write_queue = []
+        if self._connecting:
+            self._connect_failed(ConnectionError('Disconnected'),
+                                 attempted=False)
         if self._stream:
             s = self._stream
             self._stream = None
@@ -103,6 +645,12 @@ class Connection(object):
                 s.close()
             except:
                 pass
+            cache = self.info.get('tracking')
+            if cache is not None:
+                self.info['tracking'] = None
+                self.info['tracking_id'] = None
+                # Keys read over the connection are no longer tracked
+                cache.flush()
 
     def fire_event(self, event):
         event_handler = self._event_handler
@@ -113,9 +661,29 @@ class Connection(object):
                 pass
 
     def write(self, data, callback=None):
+        """
+        Writes the data to the stream.
+
+        The data is either a string or a list of buffers
+        as returned by the Client.pack_command method.
+        """
         if not self._stream:
-            raise ConnectionError('Tried to write to '
-                                  'non-existent connection')
+            if not self._connecting:
+                raise ConnectionError('Tried to write to '
+                                      'non-existent connection')
+            # The data is written once connected
+            self._write_queue.extend(self._to_buffers(data))
+            if callback:
+                callback = stack_context.wrap(callback)
+                _callback = lambda: callback(None)
+                self.read_callbacks.add(_callback)
+                self._connect_callbacks.append(
+                    lambda *args: self.read_callback(_callback))
+            return
+        # Keep the data written after the deferred data
+        buffers = self._write_queue
+        self._write_queue = []
+        buffers.extend(self._to_buffers(data))
 
         if callback:
             callback = stack_context.wrap(callback)
@@ -125,26 +693,141 @@ class Connection(object):
         else:
             cb = None
         try:
-            if PY3:
-                data = bytes(data, encoding='utf-8')
-            self._stream.write(data, callback=cb)
+            self._write_buffers(buffers, cb)
         except IOError as e:
             self.disconnect()
-            raise ConnectionError(e.message)
+            self._fail_replies(ConnectionError(str(e)))
+            raise ConnectionError(str(e))
+
+    def _to_buffers(self, data):
+        if isinstance(data, list):
+            return data
+        if PY3 and isinstance(data, str):
+            data = data.encode('utf-8')
+        return [data]
+
+    def _write_buffers(self, buffers, callback):
+        # Join small buffers to send them with a single system call,
+        # large ones are passed to the stream as is
+        small = []
+        for buff in buffers:
+            if len(buff) > BUFFER_CUTOFF:
+                if small:
+                    self._stream.write(b''.join(small))
+                    small = []
+                self._stream.write(buff)
+            else:
+                small.append(buff)
+        self._stream.write(b''.join(small), callback=callback)
+
+    def write_deferred(self, data):
+        """
+        Buffers the data to be written to the stream along with all the
+        other data buffered during the current IOLoop iteration.
+        """
+        if not self._stream:
+            self.write(data)
+            return
+        if not self._write_queue:
+            io_loop = self._io_loop or IOLoop.current()
+            io_loop.add_callback(self._flush_write_queue)
+        self._write_queue.extend(self._to_buffers(data))
 
-    def read(self, length, callback=None):
+    def _flush_write_queue(self):
+        if not self._write_queue:
+            return
         try:
-            if not self._stream:
+            self.write([])
+        except ConnectionError as e:
+            self._fail_replies(e)
+
+    def read_reply(self, callback=None, encoding=None, decode_responses=None,
+                   timeout=None):
+        """
+        Reads a single complete reply from the Redis server.
+
+        Replies are passed to callbacks in the order of read_reply calls,
+        so a caller may send several commands and wait for their replies
+        at once.
+        The callback receives the parsed reply, or a ConnectionError
+        instance if the connection has been closed before the reply
+        has been received.
+
+        The encoding and decode_responses arguments override
+        the connection settings for this reply.
+
+        If the reply is not received in ``timeout`` seconds the callback
+        receives a TimeoutError instance and the connection is closed,
+        the other callbacks waiting for replies receive a ConnectionError.
+        """
+        encoding = self.reply_encoding(encoding, decode_responses)
+        if not self.reply_callbacks:
+            self._set_reader_encoding(encoding)
+            reply = self._reader.gets()
+            if reply is not False:
+                callback(reply)
+                return
+        if not self._stream and not self._connecting:
+            self.disconnect()
+            raise ConnectionError('Tried to read from '
+                                  'non-existent connection')
+        deadline = None
+        if timeout:
+            io_loop = self._io_loop or IOLoop.current()
+            deadline = io_loop.time() + timeout
+            if (self._reply_deadline is None or
+                    deadline < self._reply_deadline):
+                self._set_reply_timeout(deadline)
+        self.reply_callbacks.append((stack_context.wrap(callback), encoding,
+                                     deadline))
+        if self._stream:
+            self._read_replies()
+
+    def _read_replies(self):
+        if not self._reading:
+            self._reading = True
+            try:
+                self._stream.read_bytes(READ_CHUNK_SIZE,
+                                        callback=self._on_read_chunk,
+                                        partial=True)
+            except IOError:
+                self._reading = False
+                self.fire_event('on_disconnect')
+
+    def _on_read_chunk(self, data):
+        reader = self._reader
+        reader.feed(data)
+        while self.reply_callbacks:
+            callback, encoding, __ = self.reply_callbacks[0]
+            try:
+                self._set_reader_encoding(encoding)
+                reply = reader.gets()
+            except InvalidResponse as e:
                 self.disconnect()
-                raise ConnectionError('Tried to read from '
-                                      'non-existent connection')
-            callback = stack_context.wrap(callback)
-            self.read_callbacks.add(callback)
-            self._stream.read_bytes(length,
-                                    callback=partial(self.read_callback,
-                                                     callback))
-        except IOError:
-            self.fire_event('on_disconnect')
+                self._fail_replies(ConnectionError(str(e)))
+                return
+            if reply is False:
+                break
+            # The callback may send commands and wait for replies itself
+            self.reply_callbacks.popleft()
+            callback(reply)
+            if reader is not self._reader:
+                # Reconnected by the callback, the new stream is read
+                # by its own read_reply calls
+                return
+        if self.reply_callbacks and self._stream:
+            self._stream.read_bytes(READ_CHUNK_SIZE,
+                                    callback=self._on_read_chunk,
+                                    partial=True)
+        else:
+            self._reading = False
+            if not self.reply_callbacks:
+                self._clear_reply_timeout()
+
+    def _set_reader_encoding(self, encoding):
+        if encoding != self._reader_encoding:
+            self._reader.set_encoding(encoding)
+            self._reader_encoding = encoding
 
     def read_callback(self, callback, *args, **kwargs):
         try:
@@ -153,21 +836,12 @@ class Connection(object):
             pass
         callback(*args, **kwargs)
 
-    def readline(self, callback=None):
-        try:
-            if not self._stream:
-                self.disconnect()
-                raise ConnectionError('Tried to read from '
-                                      'non-existent connection')
-            callback = stack_context.wrap(callback)
-            self.read_callbacks.add(callback)
-            callback = partial(self.read_callback, callback)
-            self._stream.read_until(CRLF, callback=callback)
-        except IOError:
-            self.fire_event('on_disconnect')
-
     def connected(self):
-        if self._stream:
+        """
+        Returns True if connected or connecting to the Redis server.
+        Commands written while connecting are sent once connected.
+        """
+        if self._stream or self._connecting:
             return True
         return False
 
@@ -182,52 +856,151 @@ class ConnectionPool(object):
         wait_for_available - do not raise an exceptionbut wait for a next
                              available connection if a connection limit
                              has been reached.
+        wait_timeout - a maximum number of seconds to wait for
+                       an available connection, commands waiting longer
+                       fail with the TimeoutError,
+        max_waiting - a maximum number of clients waiting for
+                      an available connection, ConnectionError is raised
+                      for clients exceeding the limit,
+        min_idle - a number of idle connections opened in the background
+                   when the pool is created and kept open,
+        max_idle - a maximum number of idle connections, connections
+                   released to the pool holding that many idle
+                   connections are closed,
+        idle_timeout - close connections idle for that many seconds,
+                       keeping at least min_idle connections,
+        health_check_interval - PING idle connections every that many
+                                seconds, closing connections which
+                                do not reply in time,
+        adaptive - adjust the connection limit between min_connections
+                   and max_connections to the load, clients wait for
+                   available connections in this mode,
+        min_connections - the lowest connection limit in adaptive mode,
+        adjust_interval - adjust the connection limit every that many
+                          seconds,
+        target_hold_time - lower the connection limit if clients hold
+                           connections for longer than that many seconds
+                           on average, i.e. the Redis server is slow
+                           to reply,
         **connection_kwargs
+
+    Waiting clients get connections in the order they started to wait.
+    Other clients get the most recently released connection,
+    preferably one with the client's database selected already,
+    so the connections not needed under the current load stay idle.
+
+    Idle timeouts and the min_idle limit are checked along with
+    the health check, call the close method to stop the checks.
+
+    In adaptive mode the connection limit is raised by increase_step
+    if clients had to wait for a connection and lowered by
+    decrease_factor if less than a half of the connections were in use
+    or the average hold time exceeds target_hold_time.
     """
+    increase_step = 1
+    decrease_factor = 0.5
+    # The weight of the latest hold time in the average
+    hold_time_weight = 0.1
+
     def __init__(self, max_connections=None, wait_for_available=False,
-                 **connection_kwargs):
+                 wait_timeout=None, max_waiting=None, min_idle=0,
+                 max_idle=None, idle_timeout=None, health_check_interval=None,
+                 adaptive=False, min_connections=1, adjust_interval=1,
+                 target_hold_time=None, **connection_kwargs):
         self.connection_kwargs = connection_kwargs
         self.max_connections = max_connections or 2048
-        self.wait_for_available = wait_for_available
+        self.wait_for_available = wait_for_available or adaptive
+        self.wait_timeout = wait_timeout
+        self.max_waiting = max_waiting
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
         self._created_connections = 0
-        self._available_connections = set()
+        # Idle connections, the most recently released one is the last
+        self._available_connections = []
         self._in_use_connections = set()
-        self._waiting_clients = set()
+        self._waiting_clients = deque()
+        # Idle connections waiting for the health check PING reply
+        self._pinging = set()
+        # Waiting statistics
+        self._waits = 0
+        self._wait_time = 0
+        self._max_wait_time = 0
+        self._wait_timeouts = 0
+        self._closed_connections = 0
+        # Adaptive sizing
+        self.adaptive = adaptive
+        self.min_connections = min_connections
+        self.target_hold_time = target_hold_time
+        if adaptive:
+            self.connection_limit = min(max(min_connections, min_idle, 1),
+                                        self.max_connections)
+        else:
+            self.connection_limit = self.max_connections
+        self._hold_time = None
+        self._peak_in_use = 0
+        self._peak_waiting = 0
+        self._increases = 0
+        self._decreases = 0
+        self._last_adjustment = None
+        self._health_check = None
+        self._adjust = None
+        # The callbacks do not keep the pool from being collected
+        if health_check_interval:
+            self._health_check = PeriodicCallback(
+                partial(_call_pool, weakref.ref(self), 'check_connections'),
+                health_check_interval * 1000,
+                io_loop=self._io_loop())
+            self._health_check.start()
+        if adaptive:
+            self._adjust = PeriodicCallback(
+                partial(_call_pool, weakref.ref(self), 'adjust_size'),
+                adjust_interval * 1000,
+                io_loop=self._io_loop())
+            self._adjust.start()
+        if min_idle:
+            self._io_loop().add_callback(
+                partial(_call_pool, weakref.ref(self), 'check_connections'))
+
+    def __del__(self):
+        self._stop_callbacks()
 
-    def get_connection(self, event_handler_ref=None):
+    def get_connection(self, event_handler_ref=None, db=None):
         """
-        Returns a pooled Redis server connection
+        Returns a pooled Redis server connection,
+        preferably one with the ``db`` database selected.
         """
-        try:
-            connection = self._available_connections.pop()
-        except KeyError:
-            connection = self.make_connection()
+        connection = (self._pop_available(db) or
+                      self.make_connection())
         if connection:
             connection._event_handler = event_handler_ref
-            self._in_use_connections.add(connection)
+            self._check_out(connection)
         elif self.wait_for_available:
-            connection = self.make_proxy(client_proxy=event_handler_ref)
+            connection = self.make_proxy(client_proxy=event_handler_ref,
+                                         db=db)
         else:
             raise ConnectionError("Too many connections")
         return connection
 
-    def make_proxy(self, client_proxy=None, connected=True):
+    def make_proxy(self, client_proxy=None, connected=True, db=None):
         """
         Creates a proxy object to substitute client's connection
         until a connection be available
         """
         connection = ConnectionProxy(pool=self,
                                      client_proxy=client_proxy,
-                                     connected=connected)
+                                     connected=connected,
+                                     db=db)
         if connected:
-            self._waiting_clients.add(connection)
+            self._add_waiting(connection)
         return connection
 
     def make_connection(self):
         """
         Creates a new connection to Redis server
         """
-        if self._created_connections >= self.max_connections:
+        if self._created_connections >= self.connection_limit:
             return None
         self._created_connections += 1
         return Connection(**self.connection_kwargs)
@@ -237,65 +1010,342 @@ class ConnectionPool(object):
         Releases the connection back to the pool
         """
         if isinstance(connection, ConnectionProxy):
-            try:
-                self._waiting_clients.remove(connection)
-            except KeyError:
-                pass
+            self._remove_waiting(connection)
+            connection._connected = False
             return
         connection._event_handler = None
+        self._update_hold_time(connection)
         if self._waiting_clients:
-            waiting = self._waiting_clients.pop()
+            waiting = self._pop_waiting()
+            connection._checked_out = self._io_loop().time()
             waiting.assign_connection(connection)
         else:
             try:
                 self._in_use_connections.remove(connection)
             except (KeyError, ValueError):
                 pass
-            self._available_connections.add(connection)
+            if (self._created_connections > self.connection_limit or
+                    (self.max_idle is not None and
+                     len(self._available_connections) >= self.max_idle)):
+                self._close_connection(connection)
+            else:
+                self._add_available(connection)
 
     def reconnect(self, connection_proxy):
-        if self._available_connections:
-            connection = self._available_connections.pop()
+        connection = (self._pop_available(connection_proxy.db) or
+                      self.make_connection())
+        if connection:
+            self._check_out(connection)
             connection_proxy.assign_connection(connection)
         else:
-            self._waiting_clients.add(connection_proxy)
+            self._add_waiting(connection_proxy)
+
+    def check_connections(self):
+        """
+        Closes connections idle for longer than idle_timeout,
+        checks other idle connections with PING and opens new ones
+        to keep at least min_idle connections.
+        Called periodically if health_check_interval is set.
+        """
+        now = self._io_loop().time()
+        # Starting with the least recently used connections
+        for connection in list(self._available_connections):
+            if (self.idle_timeout and
+                    len(self._available_connections) > self.min_idle and
+                    now - connection._idle_since > self.idle_timeout):
+                self._discard(connection)
+            elif not connection.connected():
+                self._discard(connection)
+            elif self.health_check_interval and connection.ready():
+                self._ping(connection)
+        while len(self._available_connections) < self.min_idle:
+            connection = self.make_connection()
+            if connection is None:
+                break
+            connection.connect(partial(self._on_connect, connection))
+            self._add_available(connection)
+
+    def adjust_size(self):
+        """
+        Adjusts the connection limit to the load observed since
+        the previous call. Called periodically in adaptive mode.
+        """
+        limit = self.connection_limit
+        if (self.target_hold_time and self._hold_time is not None and
+                self._hold_time > self.target_hold_time):
+            # More connections would only add load to the server
+            decision = 'decrease'
+        elif self._peak_waiting:
+            decision = 'increase'
+        elif self._peak_in_use * 2 < limit:
+            decision = 'decrease'
+        else:
+            decision = None
+        if decision == 'increase':
+            limit = min(limit + self.increase_step, self.max_connections)
+        elif decision == 'decrease':
+            limit = max(int(limit * self.decrease_factor),
+                        self.min_connections, 1)
+        if limit > self.connection_limit:
+            self._increases += 1
+            self._last_adjustment = 'increase'
+        elif limit < self.connection_limit:
+            self._decreases += 1
+            self._last_adjustment = 'decrease'
+        self.connection_limit = limit
+        self._peak_in_use = len(self._in_use_connections)
+        self._peak_waiting = len(self._waiting_clients)
+        # Connections in use are closed once released
+        while (self._created_connections > limit and
+                self._available_connections):
+            self._discard(self._available_connections[0])
+        self._serve_waiting()
+
+    def close(self):
+        """
+        Stops the health check and closes idle connections.
+        """
+        self._stop_callbacks()
+        self.min_idle = 0
+        for connection in list(self._available_connections):
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Returns a dict with the pool usage statistics:
+        numbers of created, available and used connections,
+        a number of clients waiting for a connection, numbers of
+        completed and timed out waits, the total and maximum time
+        (in seconds) clients waited for a connection.
+        """
+        return {
+            'created': self._created_connections,
+            'available': len(self._available_connections),
+            'in_use': len(self._in_use_connections),
+            'waiting': len(self._waiting_clients),
+            'waits': self._waits,
+            'wait_timeouts': self._wait_timeouts,
+            'wait_time': self._wait_time,
+            'max_wait_time': self._max_wait_time,
+            'closed': self._closed_connections,
+            'limit': self.connection_limit,
+            'hold_time': self._hold_time,
+            'increases': self._increases,
+            'decreases': self._decreases,
+            'last_adjustment': self._last_adjustment,
+        }
+
+    def _stop_callbacks(self):
+        for callback in (self._health_check, self._adjust):
+            if callback is not None:
+                callback.stop()
+        self._health_check = None
+        self._adjust = None
+
+    def _check_out(self, connection):
+        connection._checked_out = self._io_loop().time()
+        self._in_use_connections.add(connection)
+        self._peak_in_use = max(self._peak_in_use,
+                                len(self._in_use_connections))
+
+    def _update_hold_time(self, connection):
+        checked_out = getattr(connection, '_checked_out', None)
+        if checked_out is None:
+            return
+        hold_time = self._io_loop().time() - checked_out
+        connection._checked_out = None
+        if self._hold_time is None:
+            self._hold_time = hold_time
+        else:
+            weight = self.hold_time_weight
+            self._hold_time = (self._hold_time * (1 - weight) +
+                               hold_time * weight)
+
+    def _add_available(self, connection):
+        connection._idle_since = self._io_loop().time()
+        self._available_connections.append(connection)
+
+    def _pop_available(self, db=None):
+        available = self._available_connections
+        # Connections being checked are handed out once replied to
+        indexes = [n for n in range(len(available) - 1, -1, -1)
+                   if available[n] not in self._pinging]
+        if db is not None:
+            # Save the SELECT command round trip
+            for n in indexes:
+                if available[n].info.get('db', 0) == db:
+                    return available.pop(n)
+        if indexes:
+            return available.pop(indexes[0])
+        return None
+
+    def _close_connection(self, connection):
+        connection.disconnect()
+        self._created_connections -= 1
+        self._closed_connections += 1
+
+    def _discard(self, connection):
+        # The connection may be taken by a client in the meantime
+        if connection in self._available_connections:
+            self._available_connections.remove(connection)
+            self._pinging.discard(connection)
+            self._close_connection(connection)
+
+    def _ping(self, connection):
+        self._pinging.add(connection)
+        try:
+            connection.write(b'*1\r\n$4\r\nPING\r\n')
+            connection.read_reply(partial(self._on_ping, connection),
+                                  timeout=self.health_check_interval)
+        except ConnectionError:
+            self._pinging.discard(connection)
+            self._discard(connection)
+            self._serve_waiting()
+
+    def _on_ping(self, connection, reply):
+        self._pinging.discard(connection)
+        if isinstance(reply, (ConnectionError, TimeoutError)):
+            self._discard(connection)
+        # A client may wait for the reply to be read, it reconnects
+        # if the connection has been lost
+        connection.execute_pending_command()
+        self._serve_waiting()
+
+    def _serve_waiting(self):
+        """
+        Assigns idle or new connections to the waiting clients.
+        """
+        while self._waiting_clients:
+            connection = self._pop_available() or self.make_connection()
+            if connection is None:
+                break
+            self._check_out(connection)
+            self._pop_waiting().assign_connection(connection)
+
+    def _on_connect(self, connection, error=None):
+        if error is not None:
+            self._discard(connection)
+
+    def _io_loop(self):
+        return self.connection_kwargs.get('io_loop') or IOLoop.current()
+
+    def _add_waiting(self, connection_proxy):
+        if (self.max_waiting is not None and
+                len(self._waiting_clients) >= self.max_waiting):
+            raise ConnectionError('Too many clients waiting '
+                                  'for a connection')
+        io_loop = self._io_loop()
+        connection_proxy._wait_started = io_loop.time()
+        if self.wait_timeout:
+            connection_proxy._wait_timeout = io_loop.add_timeout(
+                connection_proxy._wait_started + self.wait_timeout,
+                partial(self._on_wait_timeout, connection_proxy))
+        self._waiting_clients.append(connection_proxy)
+        self._peak_waiting = max(self._peak_waiting,
+                                 len(self._waiting_clients))
+
+    def _pop_waiting(self):
+        connection_proxy = self._waiting_clients.popleft()
+        self._clear_wait_timeout(connection_proxy)
+        wait_time = self._io_loop().time() - connection_proxy._wait_started
+        self._waits += 1
+        self._wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        return connection_proxy
+
+    def _remove_waiting(self, connection_proxy):
+        self._clear_wait_timeout(connection_proxy)
+        try:
+            self._waiting_clients.remove(connection_proxy)
+        except ValueError:
+            return False
+        return True
+
+    def _clear_wait_timeout(self, connection_proxy):
+        if connection_proxy._wait_timeout is not None:
+            self._io_loop().remove_timeout(connection_proxy._wait_timeout)
+            connection_proxy._wait_timeout = None
+
+    def _on_wait_timeout(self, connection_proxy):
+        connection_proxy._wait_timeout = None
+        if self._remove_waiting(connection_proxy):
+            self._wait_timeouts += 1
+            connection_proxy.fail(TimeoutError('Timed out waiting for '
+                                               'an available connection'))
+
+
+def _call_pool(pool_ref, method_name):
+    pool = pool_ref()
+    if pool is not None:
+        getattr(pool, method_name)()
 
 
 class ConnectionProxy(object):
     """
     A stub object to replace a client's connection until one is available.
     """
-    def __init__(self, pool=None, client_proxy=None, connected=True):
+    def __init__(self, pool=None, client_proxy=None, connected=True,
+                 db=None):
         self.client = client_proxy
+        # The database selected by the client
+        self.db = db
         self._pool = weakref.ref(pool)
         self.ready_callbacks = []
         self._connected = connected
+        self.connect_error = None
+        self._wait_started = None
+        self._wait_timeout = None
         self.info = {'db': -1}
 
     @property
     def pool(self):
         return self._pool()
 
+    @property
+    def encoding(self):
+        # The encoding of the connections the pool makes
+        return self.pool.connection_kwargs.get('encoding', 'utf-8')
+
     def connected(self):
         return self._connected
 
-    def connect(self):
+    def connect(self, callback=None):
         # Add this proxy to the waiting_clients list
         if not self._connected:
             self.pool.reconnect(self)
             self._connected = True
+        if callback:
+            callback()
 
     def ready(self):
         return False
 
+    def multiplexable(self):
+        return False
+
     def wait_until_ready(self, callback=None):
         if callback:
-            self.ready_callbacks.append(callback)
+            if self._connected:
+                self.ready_callbacks.append(callback)
+            else:
+                # Released without getting a connection
+                callback()
         return self
 
     def execute_pending_command(self):
         pass
 
+    def fail(self, error):
+        """
+        Passes the error to commands waiting for a connection.
+        The next command puts the client to the waiting list again.
+        """
+        self._connected = False
+        callbacks = self.ready_callbacks
+        self.ready_callbacks = []
+        for callback in callbacks:
+            callback(error)
+
     def assign_connection(self, connection):
         """
         Replaces given connection proxy with the connection object.
@@ -308,4 +1358,6 @@ class ConnectionProxy(object):
         self.pool.release(self)
         if connection.connected():
             connection.fire_event('on_connect')
+        else:
+            connection.connect()
         connection.execute_pending_command()
@@ -10,6 +10,14 @@ class ConnectionError(RedisError):
     pass
 
 
+class TimeoutError(RedisError):
+    pass
+
+
+class MasterNotFoundError(ConnectionError):
+    pass
+
+
 class RequestError(RedisError):
     def __init__(self, message, cmd_line=None):
         self.message = message
@@ -40,6 +48,20 @@ class ResponseError(RedisError):
     __str__ = __repr__
 
 
+class ClusterError(RedisError):
+    """
+    A multi-key command split over the cluster nodes (or the shards
+    of a ShardedClient) failed on some of them. The errors attribute
+    maps the failed nodes to their errors, the result attribute holds
+    the reply assembled from the nodes which succeeded.
+    """
+    def __init__(self, message, errors=None, result=None):
+        super(ClusterError, self).__init__(message)
+        self.message = message
+        self.errors = errors or {}
+        self.result = result
+
+
 class InvalidResponse(RedisError):
     pass
 
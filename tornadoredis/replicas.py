@@ -0,0 +1,324 @@
+import logging
+import math
+from collections import deque
+
+from tornado import gen
+from tornado.concurrent import Future
+
+from .client import (Client, Pipeline, COMMAND_SAFETY, READ_ONLY,
+                     release_client)
+from .exceptions import RedisError, ConnectionError, TimeoutError
+
+
+log = logging.getLogger('tornadoredis.replicas')
+
+
+ROUND_ROBIN = 'round_robin'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+# Read-only commands sent to the replicas. Server commands such as INFO
+# describe the server they are sent to and stay on the primary.
+REPLICA_COMMANDS = frozenset(
+    cmd for cmd, safety in COMMAND_SAFETY.items()
+    if safety == READ_ONLY and
+    cmd not in ('PING', 'ECHO', 'TIME', 'INFO', 'LASTSAVE'))
+
+
+class HedgePolicy(object):
+    """
+    Decides when to send a read-only command to another replica
+    if the first one has not replied yet.
+
+    The command is sent again once it has waited longer than
+    ``percentile`` per cent of the latest ``window`` replica replies,
+    but not sooner than ``min_delay`` seconds. ``initial_delay`` is used
+    until ``min_samples`` replies are recorded. The delay is updated
+    every ``update_interval`` replies.
+    A single policy may be shared by several clients.
+    """
+    def __init__(self, percentile=95, min_delay=0.001, initial_delay=0.01,
+                 window=1000, min_samples=20, update_interval=50):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.update_interval = update_interval
+        self._samples = deque(maxlen=window)
+        self._delay = max(initial_delay, min_delay)
+        self._recorded = 0
+        self._hedged = 0
+        self._wins = 0
+
+    def delay(self):
+        """
+        Returns the number of seconds to wait for a reply before
+        sending the command to another replica.
+        """
+        return self._delay
+
+    def record(self, reply_time):
+        """
+        Records the number of seconds a replica took to reply.
+        """
+        self._samples.append(reply_time)
+        self._recorded += 1
+        if (len(self._samples) >= self.min_samples and
+                self._recorded % self.update_interval == 0):
+            samples = sorted(self._samples)
+            n = int(math.ceil(len(samples) * self.percentile / 100.0)) - 1
+            self._delay = max(samples[max(n, 0)], self.min_delay)
+
+    def hedged(self, won=False):
+        """
+        Counts a command sent to another replica, ``won`` is True
+        if the reply of the second replica was used.
+        """
+        if won:
+            self._wins += 1
+        else:
+            self._hedged += 1
+
+    def stats(self):
+        """
+        Returns a dict with numbers of commands sent to another replica,
+        commands replied by the second replica first, and the current
+        delay.
+        """
+        return {
+            'hedged': self._hedged,
+            'wins': self._wins,
+            'delay': self._delay,
+        }
+
+
+class ReplicaPipeline(Pipeline):
+    """
+    A pipeline of the ReplicaClient, the transaction ends the WATCH
+    of the client.
+    """
+    def __init__(self, client, transactional, *args, **kwargs):
+        super(ReplicaPipeline, self).__init__(transactional, *args, **kwargs)
+        self.client = client
+
+    def execute(self, callback=None):
+        if self.transactional:
+            self.client.watching = False
+        return super(ReplicaPipeline, self).execute(callback=callback)
+
+
+class ReplicaClient(Client):
+    """
+    Sends read-only commands to replica servers and other commands
+    to the primary server.
+
+    Arguments:
+        primary_pool - the ConnectionPool of the primary server,
+        replica_pools - a list of ConnectionPools of the replicas,
+        selection - 'round_robin' to send commands to the replicas
+                    in turn, or 'least_outstanding' to send them to the
+                    replica waiting for the fewest replies,
+        hedge_policy - a HedgePolicy to send read-only commands
+                       to another replica if the first one is slow
+                       to reply,
+        **client_kwargs - Client arguments, e.g. selected_db
+                          or command_timeout, used for the replicas too.
+
+    Writes, server commands, Pub/Sub and pipelines are sent to the
+    primary, and so are all commands between WATCH or MULTI and the end
+    of the transaction. Pass replica=False to execute_command to read from
+    the primary, e.g. the data written by the same request.
+    A command failing on a replica with ConnectionError is sent
+    to the primary.
+
+    With the hedge policy, the reply received first is used, the other
+    one is dropped when it arrives, releasing the connection.
+    """
+    def __init__(self, primary_pool, replica_pools, selection=ROUND_ROBIN,
+                 hedge_policy=None, **client_kwargs):
+        if selection not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError('Unknown replica selection: %s' % selection)
+        super(ReplicaClient, self).__init__(connection_pool=primary_pool,
+                                            **client_kwargs)
+        self.replica_pools = list(replica_pools)
+        self.selection = selection
+        self.hedge_policy = hedge_policy
+        # Shared by the replica clients
+        client_kwargs['retry_policy'] = self.retry_policy
+        client_kwargs['io_loop'] = self._io_loop
+        self.client_kwargs = client_kwargs
+        # The client has watched keys on the primary
+        self.watching = False
+        # The client has started a transaction with MULTI
+        self.in_multi = False
+        self._next = 0
+        # Commands waiting for replies per replica
+        self._outstanding = [0] * len(self.replica_pools)
+        self._replica_commands = [0] * len(self.replica_pools)
+        self._primary_commands = 0
+        self._fallbacks = 0
+
+    def __repr__(self):
+        return 'tornadoredis.ReplicaClient (db=%s, replicas=%d)' % (
+            self.selected_db, len(self.replica_pools))
+
+    def pipeline(self, transactional=False):
+        if not self._pipeline:
+            self._pipeline = ReplicaPipeline(
+                self,
+                transactional=transactional,
+                selected_db=self.selected_db,
+                password=self.password,
+                io_loop=self._io_loop,
+                encoding=self.encoding,
+                decode_responses=self.decode_responses,
+                command_timeout=self.command_timeout,
+                client_name=self.client_name,
+            )
+            self._pipeline.connection = self.connection
+        return self._pipeline
+
+    def execute_command(self, cmd, *args, **kwargs):
+        """
+        Sends a read-only command to a replica, other commands
+        to the primary, and passes the reply to the callback.
+        Pass replica=False to send the command to the primary.
+
+        Returns a Future resolved with the reply if called without
+        the callback.
+        """
+        replica = kwargs.pop('replica', True)
+        if not (replica and self.use_replica(cmd)):
+            if cmd == 'WATCH':
+                self.watching = True
+            elif cmd == 'MULTI':
+                self.in_multi = True
+            elif cmd == 'UNWATCH':
+                self.watching = False
+            elif cmd in ('EXEC', 'DISCARD'):
+                self.watching = False
+                self.in_multi = False
+            self._primary_commands += 1
+            return super(ReplicaClient, self).execute_command(cmd, *args,
+                                                              **kwargs)
+        callback = kwargs.pop('callback', None)
+        if callback:
+            self._execute_on_replica(cmd, args, kwargs, callback=callback)
+            return None
+        future = Future()
+        self._run_with_future(future, self._execute_on_replica,
+                              cmd, args, kwargs)
+        return future
+
+    def use_replica(self, cmd):
+        """
+        Returns True if the command is to be sent to a replica.
+        """
+        return (cmd in REPLICA_COMMANDS and bool(self.replica_pools) and
+                not self.watching and not self.in_multi and
+                not self.subscribed)
+
+    def select_replica(self, exclude=None):
+        """
+        Returns the index of the replica to send the next command to,
+        other than the ``exclude`` one.
+        """
+        count = len(self.replica_pools)
+        start = self._next
+        self._next = (start + 1) % count
+        indexes = [(start + n) % count for n in range(count)
+                   if (start + n) % count != exclude]
+        if self.selection == LEAST_OUTSTANDING:
+            # Ties are broken in turn
+            return min(indexes, key=self._outstanding.__getitem__)
+        return indexes[0]
+
+    def replica_client(self, index):
+        """
+        Returns a client holding a connection of the replica pool.
+        Call release_client once done with the client.
+        """
+        return Client(connection_pool=self.replica_pools[index],
+                      **self.client_kwargs)
+
+    release_client = staticmethod(release_client)
+
+    def close(self):
+        """
+        Closes idle connections of the replica pools.
+        """
+        for pool in self.replica_pools:
+            pool.close()
+
+    def stats(self):
+        """
+        Returns a dict with numbers of commands sent to the primary,
+        to each of the replicas, commands waiting for replica replies
+        and commands sent to the primary after replica failures,
+        along with the hedge policy stats.
+        """
+        stats = {
+            'primary': self._primary_commands,
+            'replicas': list(self._replica_commands),
+            'outstanding': list(self._outstanding),
+            'fallbacks': self._fallbacks,
+        }
+        if self.hedge_policy is not None:
+            stats['hedge'] = self.hedge_policy.stats()
+        return stats
+
+    @gen.engine
+    def _execute_on_replica(self, cmd, args, kwargs, callback=None):
+        index = self.select_replica()
+        futures = [self._send_to_replica(index, cmd, args, kwargs)]
+        if self.hedge_policy is not None and len(self.replica_pools) > 1:
+            try:
+                yield gen.with_timeout(
+                    self._io_loop.time() + self.hedge_policy.delay(),
+                    futures[0], io_loop=self._io_loop,
+                    quiet_exceptions=RedisError)
+            except gen.TimeoutError:
+                self.hedge_policy.hedged()
+                futures.append(self._send_to_replica(
+                    self.select_replica(exclude=index), cmd, args, kwargs))
+            except RedisError:
+                # Raised below
+                pass
+        error = None
+        waiter = gen.WaitIterator(*futures)
+        while not waiter.done():
+            try:
+                reply = yield waiter.next()
+            except (ConnectionError, TimeoutError) as e:
+                error = e
+                continue
+            if waiter.current_index == 1:
+                self.hedge_policy.hedged(won=True)
+            for future in futures:
+                # The other reply is dropped
+                self._io_loop.add_future(future, lambda f: f.exception())
+            callback(reply)
+            return
+        if not isinstance(error, ConnectionError):
+            raise error
+        log.warning('Replica %d failed, sending %s to the primary: %s',
+                    index, cmd, error)
+        self._fallbacks += 1
+        self._primary_commands += 1
+        reply = yield super(ReplicaClient, self).execute_command(
+            cmd, *args, **kwargs)
+        callback(reply)
+
+    @gen.coroutine
+    def _send_to_replica(self, index, cmd, args, kwargs):
+        client = self.replica_client(index)
+        self._outstanding[index] += 1
+        self._replica_commands[index] += 1
+        start = self._io_loop.time()
+        try:
+            reply = yield client.execute_command(cmd, *args, **kwargs)
+        finally:
+            self._outstanding[index] -= 1
+            self.release_client(client)
+        if self.hedge_policy is not None:
+            self.hedge_policy.record(self._io_loop.time() - start)
+        raise gen.Return(reply)
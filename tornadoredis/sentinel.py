@@ -0,0 +1,285 @@
+import logging
+import socket
+import weakref
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.netutil import Resolver
+
+from .client import Client
+from .connection import ConnectionPool, default_resolver
+from .exceptions import ConnectionError, TimeoutError, MasterNotFoundError
+
+
+log = logging.getLogger('tornadoredis.sentinel')
+
+
+SWITCH_MASTER_CHANNEL = '+switch-master'
+
+
+def pairs_to_dict(reply):
+    return dict(zip(reply[::2], reply[1::2]))
+
+
+class Sentinel(object):
+    """
+    Discovers Redis servers monitored by Redis Sentinel and
+    watches for the master switches.
+
+    Arguments:
+        sentinels - a list of (host, port) addresses of Sentinel servers,
+        retry_interval - a number of seconds to wait before subscribing
+                         to the master switches again after losing the
+                         connection to the Sentinel,
+        **client_kwargs - arguments of the clients connected to
+                          the Sentinels, e.g. connect_timeout
+                          or command_timeout.
+
+    Sentinels are asked in the order given, the one that replied
+    is asked first the next time.
+    """
+    def __init__(self, sentinels, io_loop=None, retry_interval=1,
+                 **client_kwargs):
+        self.sentinels = list(sentinels)
+        self.retry_interval = retry_interval
+        self.client_kwargs = client_kwargs
+        # The last known master addresses by service names
+        self.masters = {}
+        self._io_loop = io_loop or IOLoop.current()
+        self._clients = {}
+        self._pools = weakref.WeakSet()
+        self._watcher = None
+        self._watching = False
+        self._retry = None
+        self._closed = False
+
+    @gen.coroutine
+    def discover_master(self, service_name):
+        """
+        Returns the (host, port) address of the service master.
+        Raises MasterNotFoundError if no Sentinel knows the master.
+        """
+        reply = yield self._ask_sentinels('get-master-addr-by-name',
+                                          service_name)
+        if not reply:
+            raise MasterNotFoundError('No master found for %r'
+                                      % service_name)
+        address = (reply[0], int(reply[1]))
+        self.masters[service_name] = address
+        raise gen.Return(address)
+
+    @gen.coroutine
+    def discover_replicas(self, service_name):
+        """
+        Returns a list of (host, port) addresses of the service replicas
+        not known to be down.
+        """
+        reply = yield self._ask_sentinels('slaves', service_name)
+        replicas = []
+        for info in reply or []:
+            info = pairs_to_dict(info)
+            flags = set(info.get('flags', '').split(','))
+            if flags & set(['s_down', 'o_down', 'disconnected']):
+                continue
+            replicas.append((info['ip'], int(info['port'])))
+        raise gen.Return(replicas)
+
+    def add_pool(self, pool):
+        """
+        Closes connections of the pool once the master
+        of its service is switched.
+        """
+        self._pools.add(pool)
+        self.watch()
+
+    def watch(self):
+        """
+        Subscribes to the master switches announced by a Sentinel.
+        """
+        if not self._watching and not self._closed:
+            self._watching = True
+            self._subscribe()
+
+    def close(self):
+        """
+        Stops watching for the master switches and closes
+        the connections to the Sentinels.
+        """
+        self._closed = True
+        self._watching = False
+        if self._retry is not None:
+            self._io_loop.remove_timeout(self._retry)
+            self._retry = None
+        if self._watcher is not None:
+            self._watcher.connection.disconnect()
+            self._watcher = None
+        for client in self._clients.values():
+            client.connection.disconnect()
+        self._clients = {}
+
+    @gen.coroutine
+    def _ask_sentinels(self, *args):
+        for address in list(self.sentinels):
+            client = self._client(address)
+            try:
+                reply = yield client.execute_command('SENTINEL', *args)
+            except (ConnectionError, TimeoutError) as e:
+                log.warning('Sentinel %s:%s failed: %s',
+                            address[0], address[1], e)
+                continue
+            if isinstance(reply, Exception):
+                log.warning('Sentinel %s:%s failed: %s',
+                            address[0], address[1], reply)
+                continue
+            if address in self.sentinels:
+                self.sentinels.remove(address)
+                self.sentinels.insert(0, address)
+            raise gen.Return(reply)
+        raise MasterNotFoundError('No Sentinel replied')
+
+    def _client(self, address):
+        client = self._clients.get(address)
+        if client is None:
+            client = self._make_client(address)
+            self._clients[address] = client
+        return client
+
+    def _make_client(self, address):
+        return Client(host=address[0], port=address[1],
+                      io_loop=self._io_loop, **self.client_kwargs)
+
+    @gen.coroutine
+    def _subscribe(self):
+        self._retry = None
+        for address in list(self.sentinels):
+            client = self._make_client(address)
+            try:
+                # SUBSCRIBE does not wait for the connection
+                yield gen.Task(client.connect)
+                yield gen.Task(client.subscribe, SWITCH_MASTER_CHANNEL)
+            except (ConnectionError, TimeoutError) as e:
+                log.warning('Failed to subscribe to Sentinel %s:%s: %s',
+                            address[0], address[1], e)
+                client.connection.disconnect()
+                continue
+            if self._closed:
+                client.connection.disconnect()
+                return
+            self._watcher = client
+            client.listen(self._on_message)
+            # The master may have been switched while not subscribed
+            for service_name, address in list(self.masters.items()):
+                self._check_master(service_name, address)
+            return
+        self._schedule_subscribe()
+
+    def _schedule_subscribe(self):
+        if not self._closed:
+            self._retry = self._io_loop.add_timeout(
+                self._io_loop.time() + self.retry_interval, self._subscribe)
+
+    @gen.coroutine
+    def _check_master(self, service_name, address):
+        try:
+            master = yield self.discover_master(service_name)
+        except (ConnectionError, TimeoutError):
+            return
+        if master != address:
+            self._switch_master(service_name, master)
+
+    def _on_message(self, msg):
+        if msg.kind == 'disconnect':
+            log.warning('Lost the Sentinel connection')
+            self._watcher = None
+            self._schedule_subscribe()
+        elif msg.kind == 'message' and msg.channel == SWITCH_MASTER_CHANNEL:
+            try:
+                (service_name, __, __,
+                 host, port) = msg.body.split()
+                address = (host, int(port))
+            except ValueError:
+                log.warning('Invalid master switch message: %r', msg.body)
+                return
+            self._switch_master(service_name, address)
+
+    def _switch_master(self, service_name, address):
+        log.info('Master of %s switched to %s:%s',
+                 service_name, address[0], address[1])
+        self.masters[service_name] = address
+        for pool in list(self._pools):
+            if pool.service_name == service_name:
+                pool.switch_master(address)
+
+
+class SentinelResolver(Resolver):
+    """
+    Resolves the service name passed as a host name to the address
+    of the service master, or one of its replicas for the 'replica'
+    role, found with the Sentinel.
+
+    IP addresses returned by the Sentinel are resolved with
+    the ``resolver`` (the default_resolver() if not given).
+    """
+    def initialize(self, sentinel, role='master', resolver=None):
+        self.sentinel = sentinel
+        self.role = role
+        self.resolver = resolver or default_resolver()
+        self._next_replica = 0
+
+    @gen.coroutine
+    def resolve(self, host, port, family=socket.AF_UNSPEC, callback=None):
+        address = None
+        if self.role == 'replica':
+            replicas = yield self.sentinel.discover_replicas(host)
+            if replicas:
+                # Spread connections over the replicas
+                self._next_replica += 1
+                address = replicas[self._next_replica % len(replicas)]
+        if address is None:
+            address = yield self.sentinel.discover_master(host)
+        result = yield self.resolver.resolve(address[0], address[1], family)
+        raise gen.Return(result)
+
+
+class SentinelConnectionPool(ConnectionPool):
+    """
+    A connection pool for the master (or replicas, with role='replica')
+    of the service monitored by the Sentinel.
+
+    Connections are made to the address found with the Sentinel
+    on each connection attempt. Once the Sentinel switches the master
+    all the pool connections are closed, commands waiting for replies
+    fail with the ConnectionError and are sent again using a connection
+    to the new master if the client's retry policy allows it.
+
+    Takes the ConnectionPool arguments except host and port.
+    """
+    def __init__(self, service_name, sentinel, role='master',
+                 **pool_kwargs):
+        self.service_name = service_name
+        self.sentinel = sentinel
+        self.role = role
+        self._switches = 0
+        pool_kwargs['host'] = service_name
+        pool_kwargs['resolver'] = SentinelResolver(
+            sentinel, role=role, resolver=pool_kwargs.get('resolver'))
+        super(SentinelConnectionPool, self).__init__(**pool_kwargs)
+        sentinel.add_pool(self)
+
+    def switch_master(self, address):
+        """
+        Closes the connections made to the previous master.
+        Called by the Sentinel.
+        """
+        self._switches += 1
+        for connection in list(self._available_connections):
+            self._discard(connection)
+        for connection in list(self._in_use_connections):
+            # Clients connect to the new master with the next command
+            connection.on_stream_close()
+            connection.disconnect()
+
+    def stats(self):
+        stats = super(SentinelConnectionPool, self).stats()
+        stats['switches'] = self._switches
+        return stats
@@ -0,0 +1,227 @@
+import bisect
+import hashlib
+import struct
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from .client import Client, RetryPolicy, release_client
+from .cluster import (RoutingClient, MULTI_KEY_COMMANDS, command_key,
+                      split_keys, group_args, merge_replies, capture_error)
+from .exceptions import RedisError, RequestError, ClusterError
+
+
+def pool_name(pool):
+    """
+    Returns the 'host:port' address (or the socket path)
+    of the Redis server the pool connects to.
+    """
+    kwargs = pool.connection_kwargs
+    if kwargs.get('unix_socket_path'):
+        return kwargs['unix_socket_path']
+    return '%s:%s' % (kwargs.get('host', 'localhost'),
+                      kwargs.get('port', 6379))
+
+
+class HashRing(object):
+    """
+    A ketama consistent hash ring.
+
+    Each node is placed at vnodes points of the ring (times its weight),
+    four points per MD5 hash of '<node>-<n>'. A key is served by the node
+    of the first point following the hash of the key, so adding
+    or removing one of N nodes remaps about 1/N of the keys.
+    """
+    def __init__(self, nodes=(), vnodes=160):
+        self.vnodes = vnodes
+        # Node weights by names
+        self.nodes = {}
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.nodes[node] = 1
+        self._build()
+
+    def add_node(self, node, weight=1):
+        self.nodes[node] = weight
+        self._build()
+
+    def remove_node(self, node):
+        del self.nodes[node]
+        self._build()
+
+    def get_node(self, key):
+        """
+        Returns the node serving the key (bytes),
+        or None if the ring is empty.
+        """
+        if not self._points:
+            return None
+        n = bisect.bisect(self._points, self._hash(key)[0])
+        return self._owners[n % len(self._owners)]
+
+    def _build(self):
+        points = []
+        for node, weight in self.nodes.items():
+            for n in range(max(self.vnodes * weight // 4, 1)):
+                name = ('%s-%d' % (node, n)).encode('utf-8')
+                points.extend((point, node) for point in self._hash(name))
+        points.sort()
+        self._points = [point for point, __ in points]
+        self._owners = [node for __, node in points]
+
+    def _hash(self, data):
+        return struct.unpack('<4I', hashlib.md5(data).digest())
+
+
+class ShardedClient(RoutingClient):
+    """
+    Shards keys over independent Redis servers with a consistent
+    hash ring.
+
+    Arguments:
+        pools - a list of ConnectionPools of the servers, or a dict
+                mapping shard names to the pools, the names default
+                to the 'host:port' addresses of the servers,
+        vnodes - a number of ring points per shard,
+        **client_kwargs - arguments of the clients sending commands
+                          to the shards, e.g. command_timeout.
+
+    Commands are sent to the shard of their key. MGET, MSET, DEL, EXISTS,
+    UNLINK and TOUCH are split into a command per shard, sent in parallel,
+    and the replies are merged in the order of the keys. ClusterError
+    is raised if some of the shards fail.
+
+    Commands without keys are not sent, use shard_client to run them
+    on a shard. Pipelines, Pub/Sub, SELECT and AUTH are not supported,
+    RequestError is raised for them.
+    """
+    def __init__(self, pools, io_loop=None, vnodes=160, **client_kwargs):
+        self._io_loop = io_loop or IOLoop.current()
+        # Commands are sent by the shard clients
+        self._connection_pool = None
+        self.connection = None
+        self.subscribed = set()
+        self.selected_db = 0
+        # Shared by the shard clients
+        client_kwargs.setdefault('retry_policy', RetryPolicy())
+        self.retry_policy = client_kwargs['retry_policy']
+        self.client_kwargs = client_kwargs
+        # Keys are hashed as encoded by the shard clients
+        self.encoding = client_kwargs.get('encoding') or 'utf-8'
+        if not isinstance(pools, dict):
+            pools = dict((pool_name(pool), pool) for pool in pools)
+        self.pools = dict(pools)
+        self.ring = HashRing(self.pools, vnodes=vnodes)
+
+    def __repr__(self):
+        return 'tornadoredis.ShardedClient (%s)' % (
+            ', '.join(sorted(self.pools)))
+
+    def add_shard(self, pool, name=None, weight=1):
+        """
+        Adds the server to the ring, the shard takes over about
+        weight/total weight of the keys.
+        """
+        name = name or pool_name(pool)
+        self.pools[name] = pool
+        self.ring.add_node(name, weight)
+
+    def remove_shard(self, name):
+        """
+        Removes the shard from the ring, its keys are spread over
+        the other shards. Returns the pool of the shard.
+        """
+        self.ring.remove_node(name)
+        return self.pools.pop(name)
+
+    def shard_for_key(self, key):
+        """
+        Returns the name of the shard serving the key.
+        """
+        return self.ring.get_node(self.encode(key))
+
+    def shard_client(self, name):
+        """
+        Returns a client holding a connection of the shard pool.
+        Call release_client once done with the client.
+        """
+        return Client(connection_pool=self.pools[name],
+                      io_loop=self._io_loop, **self.client_kwargs)
+
+    release_client = staticmethod(release_client)
+
+    def execute_command(self, cmd, *args, **kwargs):
+        """
+        Sends the command to the shard serving its key and passes
+        the reply to the callback.
+
+        Returns a Future resolved with the reply if called without
+        the callback.
+        """
+        self.check_command(cmd)
+        callback = kwargs.pop('callback', None)
+        if callback:
+            self._execute_sharded_command(cmd, args, kwargs,
+                                          callback=callback)
+            return None
+        future = Future()
+        self._run_with_future(future, self._execute_sharded_command,
+                              cmd, args, kwargs)
+        return future
+
+    def close(self):
+        """
+        Closes idle connections of the shard pools.
+        """
+        for pool in self.pools.values():
+            pool.close()
+
+    @gen.engine
+    def _execute_sharded_command(self, cmd, args, kwargs, callback=None):
+        if cmd in MULTI_KEY_COMMANDS:
+            groups = split_keys(cmd, args, self.shard_for_key)
+            if len(groups) > 1:
+                reply = yield self._execute_split_command(cmd, args, kwargs,
+                                                          groups)
+                callback(reply)
+                return
+        key = command_key(cmd, args)
+        if key is None:
+            raise RequestError('%s does not take a key, send it '
+                               'with a shard client' % cmd)
+        client = self.shard_client(self.shard_for_key(key))
+        try:
+            reply = yield client.execute_command(cmd, *args, **kwargs)
+        finally:
+            self.release_client(client)
+        callback(reply)
+
+    @gen.coroutine
+    def _execute_split_command(self, cmd, args, kwargs, groups):
+        shards = list(groups)
+        clients = [self.shard_client(shard) for shard in shards]
+        try:
+            results = yield [capture_error(client.execute_command(
+                cmd, *group_args(cmd, args, groups[shard]), **kwargs))
+                for shard, client in zip(shards, clients)]
+        finally:
+            for client in clients:
+                self.release_client(client)
+        replies = {}
+        errors = {}
+        for shard, reply in zip(shards, results):
+            if isinstance(reply, RedisError):
+                errors[shard] = reply
+            else:
+                replies[shard] = reply
+        result = merge_replies(cmd, args, groups, replies)
+        if errors:
+            raise ClusterError(
+                '%s failed on %d of %d shards: %s' % (
+                    cmd, len(errors), len(shards),
+                    '; '.join('%s %s' % (shard, errors[shard])
+                              for shard in sorted(errors))),
+                errors=errors, result=result)
+        raise gen.Return(result)
@@ -7,3 +7,15 @@ from .test_reconnect import *
 from .test_pool import *
 from .test_locks import *
 from .test_ipv6 import *
+from .test_reader import *
+from .test_multiplexed import *
+from .test_responses import *
+from .test_futures import *
+from .test_timeouts import *
+from .test_handshake import *
+from .test_retry import *
+from .test_sentinel import *
+from .test_cluster import *
+from .test_sharding import *
+from .test_replicas import *
+from .test_caching import *
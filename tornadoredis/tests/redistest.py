@@ -1,6 +1,10 @@
 import sys
 import time
 
+from tornado import gen
+from tornado.escape import to_basestring, utf8
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
 from tornado.testing import AsyncTestCase
 
 import tornadoredis
@@ -28,6 +32,54 @@ def async_test(func):
     return _inner(func)
 
 
+def bulk(value):
+    value = utf8(value)
+    return b'$' + utf8(str(len(value))) + b'\r\n' + value + b'\r\n'
+
+
+def array(items):
+    return b'*' + utf8(str(len(items))) + b'\r\n' + b''.join(items)
+
+
+def multi_bulk(values):
+    return array([bulk(value) for value in values])
+
+
+class FakeRedisServer(TCPServer):
+    """
+    A stub Redis server replying to commands with the reply method,
+    which returns the reply bytes or a Future of them.
+    """
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        try:
+            while True:
+                args = yield self._read_command(stream)
+                reply = self.reply(stream, args)
+                if not isinstance(reply, bytes):
+                    # A Future of the reply
+                    reply = yield reply
+                yield stream.write(reply)
+        except StreamClosedError:
+            self.on_close(stream)
+
+    @gen.coroutine
+    def _read_command(self, stream):
+        line = yield stream.read_until(b'\r\n')
+        args = []
+        for __ in range(int(line[1:])):
+            line = yield stream.read_until(b'\r\n')
+            arg = yield stream.read_bytes(int(line[1:]) + 2)
+            args.append(to_basestring(arg[:-2]))
+        raise gen.Return(args)
+
+    def reply(self, stream, args):
+        raise NotImplementedError()
+
+    def on_close(self, stream):
+        pass
+
+
 class TestRedisClient(tornadoredis.Client):
 
     def __init__(self, *args, **kwargs):
@@ -89,7 +141,8 @@ class RedisTestCase(AsyncTestCase):
     def setUp(self):
         super(RedisTestCase, self).setUp()
         self.client = self._new_client()
-        self.client.flushdb()
+        self.client.flushdb(callback=self.stop)
+        self.wait()
 
     def tearDown(self):
         try:
@@ -99,14 +152,16 @@ class RedisTestCase(AsyncTestCase):
             pass
         super(RedisTestCase, self).tearDown()
 
-    def _new_client(self, pool=None, on_destroy=None, selected_db=None):
+    def _new_client(self, pool=None, on_destroy=None, selected_db=None,
+                    **kwargs):
         if selected_db is None:
             selected_db = self.test_db
         client = TestRedisClient(io_loop=self.io_loop,
                                  port=self.test_port,
                                  selected_db=selected_db,
                                  connection_pool=pool,
-                                 on_destroy=on_destroy)
+                                 on_destroy=on_destroy,
+                                 **kwargs)
         return client
 
     def delayed(self, timeout, cb):
@@ -0,0 +1,176 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+from tornadoredis.caching import NearCache, ENTRY_OVERHEAD, value_size
+from tornadoredis.connection import PythonReader, LARGE_BULK_SIZE
+
+from .redistest import RedisTestCase
+
+
+class NearCacheTestCase(RedisTestCase):
+
+    def _cache(self, **kwargs):
+        cache = NearCache(selected_db=self.test_db, port=self.test_port,
+                          io_loop=self.io_loop, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    @gen_test
+    def test_cache(self):
+        cache = self._cache()
+        yield cache.start()
+        c = self._new_client(cache=cache)
+        yield self.client.set('foo', 'bar')
+        yield self.client.hmset('hash', {'a': 1, 'b': 2})
+        yield self.client.sadd('set', 'x', 'y')
+        for __ in range(2):
+            res = yield [c.get('foo'), c.hget('hash', 'a'), c.hgetall('hash'),
+                         c.smembers('set'), c.get('missing')]
+            self.assertEqual(res, ['bar', '1', {'a': '1', 'b': '2'},
+                                   set(['x', 'y']), None])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (5, 5, 5))
+        # Replies are copied
+        res[2].pop('a')
+        res = yield c.hgetall('hash')
+        self.assertEqual(res, {'a': '1', 'b': '2'})
+        # Not cached
+        res = yield c.execute_command('GET', 'foo', cache=False)
+        self.assertEqual(res, 'bar')
+        self.assertEqual(cache.stats()['hits'], 6)
+
+    @gen_test
+    def test_invalidation(self):
+        cache = self._cache()
+        yield cache.start()
+        c = self._new_client(cache=cache)
+        yield self.client.set('foo', 'bar')
+        yield self.client.hmset('hash', {'a': 1})
+        yield [c.get('foo'), c.hget('hash', 'a'), c.hgetall('hash')]
+        yield [self.client.set('foo', 'baz'), self.client.hset('hash', 'a', 2)]
+        yield gen.sleep(0.05)
+        self.assertEqual(cache.stats()['entries'], 0)
+        res = yield [c.get('foo'), c.hget('hash', 'a')]
+        self.assertEqual(res, ['baz', '2'])
+        # FLUSHDB flushes the cache
+        yield self.client.flushdb()
+        yield gen.sleep(0.05)
+        self.assertEqual(cache.stats()['entries'], 0)
+        res = yield c.get('foo')
+        self.assertEqual(res, None)
+
+    @gen_test
+    def test_bcast(self):
+        cache = self._cache(bcast=True, prefixes=['user:'])
+        yield cache.start()
+        c = self._new_client(cache=cache)
+        yield self.client.set('user:1', 'John')
+        res = yield c.get('user:1')
+        self.assertEqual(res, 'John')
+        yield self.client.set('user:1', 'Jane')
+        yield gen.sleep(0.05)
+        res = yield c.get('user:1')
+        self.assertEqual(res, 'Jane')
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        # Tracking is registered again on a new connection
+        c.connection.disconnect()
+        res = yield c.get('user:1')
+        self.assertEqual(res, 'Jane')
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    @gen_test
+    def test_disconnect(self):
+        cache = self._cache(retry_interval=0.05)
+        yield cache.start()
+        c = self._new_client(cache=cache)
+        yield c.get('foo')
+        self.assertEqual(cache.stats()['entries'], 1)
+        c.connection.disconnect()
+        self.assertEqual(cache.stats()['entries'], 0)
+        yield c.get('foo')
+        # The subscriber connection is lost
+        client_id = cache.client_id
+        yield self.client.execute_command('CLIENT', 'KILL', 'ID', client_id)
+        yield gen.sleep(0.02)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertFalse(cache.ready())
+        yield gen.sleep(0.1)
+        self.assertTrue(cache.ready())
+        self.assertNotEqual(cache.client_id, client_id)
+        # The tracking is redirected to the new subscriber
+        yield c.get('foo')
+        yield self.client.set('foo', 'bar')
+        yield gen.sleep(0.05)
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+
+    @gen_test
+    def test_databases(self):
+        cache = self._cache()
+        yield cache.start()
+        c = self._new_client(cache=cache)
+        other = self._new_client(cache=cache, selected_db=self.test_db + 1)
+        yield self.client.set('foo', 'bar')
+        yield other.set('foo', 'baz')
+        for __ in range(2):
+            res = yield [c.get('foo'), other.get('foo')]
+            self.assertEqual(res, ['bar', 'baz'])
+        self.assertEqual(cache.stats()['entries'], 2)
+        # Keys are invalidated in all the databases
+        yield other.delete('foo')
+        yield gen.sleep(0.05)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    @gen_test
+    def test_large_raw_value(self):
+        cache = self._cache()
+        yield cache.start()
+        c = self._new_client(cache=cache, decode_responses=False,
+                             reader_class=PythonReader)
+        value = b'v' * (LARGE_BULK_SIZE + 1)
+        yield self.client.set('foo', value)
+        for __ in range(2):
+            res = yield c.get('foo')
+            self.assertEqual(res, value)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(value_size(bytearray(b'abc')), 3)
+
+    @gen_test
+    def test_not_ready(self):
+        cache = self._cache()
+        c = self._new_client(cache=cache)
+        yield self.client.set('foo', 'bar')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        self.assertEqual(cache.stats()['entries'], 0)
+        # The first read starts the cache
+        yield cache.start()
+        yield c.get('foo')
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_lru(self):
+        cache = NearCache(max_size=3 * (ENTRY_OVERHEAD + 4),
+                          io_loop=self.io_loop)
+        for key in (b'k1', b'k2', b'k3'):
+            cache.set(key, ('GET', key), 'va')
+        self.assertEqual(cache.get(b'k1', ('GET', b'k1')), (True, 'va'))
+        cache.set(b'k4', ('GET', b'k4'), 'va')
+        # The least recently used entry is evicted
+        self.assertEqual(cache.get(b'k2', ('GET', b'k2')), (False, None))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 3 * (ENTRY_OVERHEAD + 4))
+        # Too large to be cached
+        cache.set(b'k5', ('GET', b'k5'), 'v' * 1000)
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_read_race(self):
+        cache = NearCache(io_loop=self.io_loop)
+        cache.begin_read(b'foo')
+        cache.begin_read(b'bar')
+        cache.invalidate(b'foo')
+        self.assertFalse(cache.end_read(b'foo'))
+        self.assertTrue(cache.end_read(b'bar'))
+        cache.begin_read(b'foo')
+        cache.flush()
+        self.assertFalse(cache.end_read(b'foo'))
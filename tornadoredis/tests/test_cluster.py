@@ -0,0 +1,277 @@
+from tornado import gen
+from tornado.escape import utf8
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornadoredis.cluster import ClusterClient, key_slot, crc16, command_key
+from tornadoredis.exceptions import (RequestError, ResponseError,
+                                     ClusterError)
+
+from .redistest import FakeRedisServer, array, bulk
+
+
+class FakeCluster(object):
+    """
+    Slot ranges served by the FakeClusterNode servers.
+    """
+    def __init__(self, ranges):
+        # (first slot, last slot, port) tuples
+        self.ranges = list(ranges)
+        self.nodes = {}
+
+    def owner(self, slot):
+        for first, last, port in self.ranges:
+            if first <= slot <= last:
+                return port
+
+    def start(self, io_loop):
+        for port in set(port for __, __, port in self.ranges):
+            node = FakeClusterNode(self, port, io_loop=io_loop)
+            node.listen(port)
+            self.nodes[port] = node
+
+    def stop(self):
+        for node in self.nodes.values():
+            node.stop()
+
+
+class FakeClusterNode(FakeRedisServer):
+    """
+    Serves GET, SET, MGET, MSET and DEL for the keys in its slots,
+    replies with MOVED and ASK redirections for other keys.
+    """
+    def __init__(self, cluster, port, **kwargs):
+        super(FakeClusterNode, self).__init__(**kwargs)
+        self.cluster = cluster
+        self.port = port
+        self.data = {}
+        # Slots migrating to other nodes by ports
+        self.migrating = {}
+        self.importing = set()
+        self.commands = 0
+        self._asking = set()
+
+    def reply(self, stream, args):
+        command = args[0].upper()
+        if command == 'CLUSTER' and args[1].upper() == 'SLOTS':
+            return array([array([b':%d\r\n' % first, b':%d\r\n' % last,
+                                 array([bulk('127.0.0.1'),
+                                        b':%d\r\n' % port,
+                                        bulk('node-%d' % port)])])
+                          for first, last, port in self.cluster.ranges])
+        if command == 'ASKING':
+            self._asking.add(stream)
+            return b'+OK\r\n'
+        if command == 'PING':
+            return b'+PONG\r\n'
+        self.commands += 1
+        if command == 'MSET':
+            keys = args[1::2]
+        elif command in ('MGET', 'DEL'):
+            keys = args[1:]
+        else:
+            keys = args[1:2]
+        slots = set(key_slot(utf8(key)) for key in keys)
+        if len(slots) > 1:
+            return (b"-CROSSSLOT Keys in request don't hash "
+                    b"to the same slot\r\n")
+        slot = slots.pop()
+        asking = stream in self._asking
+        self._asking.discard(stream)
+        if self.cluster.owner(slot) == self.port:
+            if slot in self.migrating and keys[0] not in self.data:
+                return utf8('-ASK %d 127.0.0.1:%d\r\n'
+                            % (slot, self.migrating[slot]))
+        elif not (slot in self.importing and asking):
+            return utf8('-MOVED %d 127.0.0.1:%d\r\n'
+                        % (slot, self.cluster.owner(slot)))
+        if command in ('SET', 'MSET'):
+            self.data.update(zip(args[1::2], args[2::2]))
+            return b'+OK\r\n'
+        if command == 'GET':
+            if keys[0] not in self.data:
+                return b'$-1\r\n'
+            return bulk(self.data[keys[0]])
+        if command == 'MGET':
+            return array([bulk(self.data[key]) if key in self.data
+                          else b'$-1\r\n' for key in keys])
+        if command == 'DEL':
+            return b':%d\r\n' % len([key for key in keys
+                                      if self.data.pop(key, None)
+                                      is not None])
+        return b'-ERR unknown command\r\n'
+
+
+class ClusterTestCase(AsyncTestCase):
+    ports = (27001, 27002)
+
+    def setUp(self):
+        super(ClusterTestCase, self).setUp()
+        self.cluster = FakeCluster([(0, 8191, self.ports[0]),
+                                    (8192, 16383, self.ports[1])])
+        self.cluster.start(self.io_loop)
+        self.client = ClusterClient([('127.0.0.1', self.ports[0])],
+                                    io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.client.close()
+        self.cluster.stop()
+        super(ClusterTestCase, self).tearDown()
+
+    def _node(self, n):
+        return self.cluster.nodes[self.ports[n]]
+
+    def test_key_slot(self):
+        self.assertEqual(key_slot(b'foo'), 12182)
+        self.assertEqual(key_slot(b'bar'), 5061)
+        self.assertEqual(key_slot(b'{user1}.name'), key_slot(b'user1'))
+        self.assertEqual(key_slot(b'{user1}.name'),
+                         key_slot(b'{user1}.email'))
+        # Empty hash tags are not used
+        self.assertNotEqual(key_slot(b'{}foo'), key_slot(b''))
+        self.assertEqual(key_slot(b'foo{}{bar}'),
+                         crc16(b'foo{}{bar}') % 16384)
+        self.assertEqual(key_slot(b'foo{{bar}}'), key_slot(b'{bar'))
+
+    def test_command_key(self):
+        self.assertEqual(command_key('GET', ['foo']), 'foo')
+        self.assertEqual(command_key('PING', []), None)
+        self.assertEqual(command_key('BITOP', ['AND', 'dest', 'src']), 'dest')
+        self.assertEqual(command_key('EVAL', ['return 1', 1, 'foo']), 'foo')
+        self.assertEqual(command_key('EVAL', ['return 1', 0]), None)
+        self.assertEqual(command_key('XREAD', ['COUNT', 10, 'STREAMS',
+                                               'foo', 'bar', '0', '0']),
+                         'foo')
+        self.assertEqual(command_key('XREAD', [b'streams', b'foo', b'0']),
+                         b'foo')
+        self.assertEqual(command_key('XREADGROUP',
+                                     ['GROUP', 'streams', 'STREAMS',
+                                      'NOACK', 'STREAMS', 'foo', '>']),
+                         'foo')
+        self.assertEqual(command_key('XREAD', ['COUNT', 10]), None)
+
+    @gen_test
+    def test_routing(self):
+        yield [self.client.set('bar', 1), self.client.set('foo', 2)]
+        self.assertEqual(self._node(0).data, {'bar': '1'})
+        self.assertEqual(self._node(1).data, {'foo': '2'})
+        res = yield [self.client.get('bar'), self.client.get('foo')]
+        self.assertEqual(res, ['1', '2'])
+        res = yield self.client.ping()
+        self.assertEqual(res, True)
+        self.assertEqual(self.client.stats(),
+                         {'nodes': 2, 'refreshes': 1, 'redirects': 0})
+
+    @gen_test
+    def test_moved(self):
+        yield self.client.set('bar', 1)
+        # The slots are moved to the second node
+        self._node(1).data = self._node(0).data
+        self.cluster.ranges = [(0, 16383, self.ports[1])]
+        res = yield self.client.get('bar')
+        self.assertEqual(res, '1')
+        self.assertEqual(self.client.stats()['redirects'], 1)
+        # The slot map is reloaded in the background
+        yield gen.Task(self.io_loop.add_timeout, self.io_loop.time() + 0.1)
+        self.assertEqual(self.client.stats()['refreshes'], 2)
+        self.assertEqual(set(self.client.slots),
+                         set([('127.0.0.1', self.ports[1])]))
+        commands = self._node(0).commands
+        yield self.client.get('{bar}1')
+        self.assertEqual(self._node(0).commands, commands)
+
+    @gen_test
+    def test_ask(self):
+        slot = key_slot(b'bar')
+        self._node(0).migrating[slot] = self.ports[1]
+        self._node(1).importing.add(slot)
+        res = yield self.client.set('bar', 1)
+        self.assertEqual(res, True)
+        self.assertEqual(self._node(1).data, {'bar': '1'})
+        res = yield self.client.get('bar')
+        self.assertEqual(res, '1')
+        self.assertEqual(self.client.stats()['redirects'], 2)
+        # The slot map is not changed
+        self.assertEqual(self.client.slots[slot],
+                         ('127.0.0.1', self.ports[0]))
+
+    @gen_test
+    def test_max_redirects(self):
+        client = ClusterClient([('127.0.0.1', self.ports[0])],
+                               io_loop=self.io_loop, max_redirects=2)
+        slot = key_slot(b'bar')
+        # Both nodes redirect the command to each other
+        self._node(0).migrating[slot] = self.ports[1]
+        res = yield client.get('bar')
+        self.assertIsInstance(res, ResponseError)
+        self.assertEqual(client.stats()['redirects'], 2)
+        client.close()
+
+    @gen_test
+    def test_multi_key(self):
+        # 'bar' and 'baz' are served by the first node, 'foo' by the second
+        res = yield self.client.mset({'foo': 1, 'bar': 2, 'baz': 3})
+        self.assertEqual(res, True)
+        self.assertEqual(self._node(0).data, {'bar': '2', 'baz': '3'})
+        self.assertEqual(self._node(1).data, {'foo': '1'})
+        commands = [self._node(0).commands, self._node(1).commands]
+        res = yield self.client.mget(['foo', 'bar', 'quux', 'baz'])
+        self.assertEqual(res, ['1', '2', None, '3'])
+        # A command per slot
+        self.assertEqual(self._node(0).commands - commands[0], 3)
+        self.assertEqual(self._node(1).commands - commands[1], 1)
+        res = yield self.client.delete('foo', 'baz')
+        self.assertEqual(res, True)
+        res = yield self.client.mget(['foo', 'bar', 'baz'])
+        self.assertEqual(res, [None, '2', None])
+        # Keys of the same slot are sent in a single command
+        res = yield self.client.mget(['{bar}1', '{bar}2'])
+        self.assertEqual(res, [None, None])
+        self.assertEqual(self.client.stats()['redirects'], 0)
+
+    @gen_test
+    def test_multi_key_moved(self):
+        yield self.client.mset({'foo': 1, 'bar': 2})
+        # The slots of the first node are moved to the second node
+        self._node(1).data.update(self._node(0).data)
+        self.cluster.ranges = [(0, 16383, self.ports[1])]
+        res = yield self.client.mget(['foo', 'bar'])
+        self.assertEqual(res, ['1', '2'])
+        self.assertEqual(self.client.stats()['redirects'], 1)
+
+    @gen_test
+    def test_multi_key_node_failure(self):
+        yield self.client.mset({'foo': 1, 'bar': 2})
+        self._node(1).stop()
+        # Drop the idle connection of the stopped node
+        self.client.get_pool(('127.0.0.1', self.ports[1])).close()
+        try:
+            yield self.client.mget(['foo', 'bar'])
+        except ClusterError as e:
+            self.assertEqual(list(e.errors),
+                             [('127.0.0.1', self.ports[1])])
+            self.assertIn('MGET failed on 1 of 2 nodes', str(e))
+            self.assertEqual(e.result, [None, '2'])
+        else:
+            self.fail('ClusterError not raised')
+
+    def test_pipeline(self):
+        self.assertRaises(RequestError, self.client.pipeline)
+
+    @gen_test
+    def test_connection_state_commands(self):
+        client = self.client
+        self.assertRaises(RequestError, client.subscribe, 'foo')
+        self.assertRaises(RequestError, client.psubscribe, 'foo*')
+        self.assertRaises(RequestError, client.unsubscribe, 'foo')
+        self.assertRaises(RequestError, client.listen, lambda msg: None)
+        self.assertRaises(RequestError, client.select, 1)
+        self.assertRaises(RequestError, client.auth, 'secret')
+        self.assertRaises(RequestError, client.execute_command,
+                          'SUBSCRIBE', 'foo')
+        self.assertRaises(RequestError, client.execute_command,
+                          'SELECT', 1)
+        self.assertEqual(client.subscribed, set())
+        # No node connection is left in a subscribed state
+        self.assertEqual(client.pools, {})
+        res = yield client.ping()
+        self.assertEqual(res, True)
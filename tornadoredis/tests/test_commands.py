@@ -26,6 +26,33 @@ class ServerCommandsTestCase(RedisTestCase):
         self.assertEqual(res, u'бар')
         self.stop()
 
+    def test_pack_command(self):
+        value = b'x' * 10000
+        buffers = self.client.pack_command('SET', 'foo', value)
+        self.assertEqual(b''.join(buffers),
+                         b'*3\r\n$3\r\nSET\r\n$3\r\nfoo\r\n$10000\r\n' +
+                         value + b'\r\n')
+        # Large values are passed as separate buffers without copying
+        self.assertTrue(any(buff is value for buff in buffers))
+        self.assertEqual(self.client.format_command('GET', 1, 1.5),
+                         b'*3\r\n$3\r\nGET\r\n$1\r\n1\r\n$3\r\n1.5\r\n')
+
+    @async_test
+    @gen.engine
+    def test_setget_binary(self):
+        res = yield gen.Task(self.client.set, 'foo', b'bar')
+        self.assertEqual(res, True)
+        res = yield gen.Task(self.client.get, 'foo')
+        self.assertEqual(res, 'bar')
+        value = b'x' * 100000
+        res = yield gen.Task(self.client.set, 'foo', memoryview(value))
+        self.assertEqual(res, True)
+        res = yield gen.Task(self.client.set, 'bar', bytearray(value))
+        self.assertEqual(res, True)
+        res = yield gen.Task(self.client.mget, ['foo', 'bar'])
+        self.assertEqual(res, [value.decode(), value.decode()])
+        self.stop()
+
     @async_test
     @gen.engine
     def test_set(self):
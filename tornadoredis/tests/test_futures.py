@@ -0,0 +1,126 @@
+import sys
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import gen_test
+
+from tornadoredis.exceptions import ResponseError, RequestError
+
+from .redistest import RedisTestCase
+
+
+class FutureTestCase(RedisTestCase):
+
+    @gen_test
+    def test_commands(self):
+        future = self.client.set('foo', 'bar')
+        self.assertIsInstance(future, Future)
+        res = yield future
+        self.assertEqual(res, True)
+        res = yield self.client.get('foo')
+        self.assertEqual(res, 'bar')
+        res = yield self.client.select(self.test_db)
+        self.assertEqual(res, True)
+
+    @gen_test
+    def test_callback(self):
+        res = self.client.set('foo', 'bar', callback=lambda result: None)
+        self.assertEqual(res, None)
+        res = yield gen.Task(self.client.get, 'foo')
+        self.assertEqual(res, 'bar')
+
+    @gen_test
+    def test_concurrent_commands(self):
+        for client in (self.client, self._new_client(multiplexed=True)):
+            res = yield [client.incr('foo') for __ in range(10)]
+            self.assertEqual(sorted(res), list(range(1, 11)))
+            yield client.delete('foo')
+
+    @gen_test
+    def test_error_reply(self):
+        yield self.client.set('foo', 'bar')
+        res = yield self.client.incr('foo')
+        self.assertIsInstance(res, ResponseError)
+        # Error replies are not formatted
+        res = yield self.client.execute_command('SET', 'foo')
+        self.assertIsInstance(res, ResponseError)
+
+    if sys.version_info >= (3, 5):
+        # Native coroutines are a syntax error on Python 2
+        exec("""
+@gen_test
+async def test_native_coroutine(self):
+    res = await self.client.set('foo', 'bar')
+    self.assertEqual(res, True)
+    res = await gen.multi([self.client.get('foo'), self.client.ping()])
+    self.assertEqual(res, ['bar', True])
+    # Error replies are not raised
+    res = await self.client.incr('foo')
+    self.assertIsInstance(res, ResponseError)
+    try:
+        await self.client.execute_command('TIME', unexpected=1)
+    except ResponseError:
+        pass
+    else:
+        self.fail('ResponseError is not raised')
+""")
+
+    @gen_test
+    def test_reply_format_error(self):
+        yield self.client.set('foo', 'bar')
+        try:
+            yield self.client.execute_command('TIME', unexpected=1)
+        except ResponseError:
+            pass
+        else:
+            self.fail('ResponseError is not raised')
+        res = yield self.client.get('foo')
+        self.assertEqual(res, 'bar')
+
+    @gen_test
+    def test_pipeline(self):
+        pipe = self.client.pipeline()
+        pipe.set('foo', 'bar')
+        pipe.get('foo')
+        res = yield pipe.execute()
+        self.assertEqual(res, [True, 'bar'])
+
+    @gen_test
+    def test_pubsub(self):
+        c = self._new_client()
+        res = yield c.subscribe('foo')
+        self.assertEqual(res, True)
+        self.assertEqual(c.subscribed, set(['foo']))
+        messages = []
+        c.listen(messages.append)
+        res = yield c.unsubscribe('foo')
+        self.assertEqual(res, True)
+        self.assertEqual(c.subscribed, set())
+        self.assertEqual([m.kind for m in messages],
+                         ['subscribe', 'unsubscribe'])
+
+    @gen_test
+    def test_subscribed_command(self):
+        c = self._new_client()
+        yield c.subscribe('foo')
+        messages = []
+        c.listen(messages.append)
+        try:
+            yield c.get('foo')
+        except RequestError:
+            pass
+        else:
+            self.fail('RequestError is not raised')
+        # The command has not been sent, the loop still receives messages
+        yield self.client.publish('foo', 'bar')
+        yield c.unsubscribe('foo')
+        self.assertEqual([m.kind for m in messages],
+                         ['subscribe', 'message', 'unsubscribe'])
+
+    @gen_test
+    def test_disconnect(self):
+        c = self._new_client()
+        yield c.ping()
+        res = yield c.disconnect()
+        self.assertEqual(res, False)
+        self.assertFalse(c.connection.connected())
@@ -0,0 +1,96 @@
+from tornado import gen
+
+import tornadoredis
+from tornadoredis.exceptions import ResponseError
+
+from .redistest import RedisTestCase, async_test
+
+
+class HandshakeTestCase(RedisTestCase):
+
+    def _count_writes(self, client):
+        writes = []
+        write = client.connection.write
+
+        def counting_write(data, *args, **kwargs):
+            # Skip flushing the data buffered while connecting
+            if data:
+                writes.append(data)
+            return write(data, *args, **kwargs)
+        client.connection.write = counting_write
+        return writes
+
+    @async_test
+    @gen.engine
+    def test_single_request(self):
+        c = self._new_client(client_name='tornadoredis-test')
+        writes = self._count_writes(c)
+        res = yield gen.Task(c.set, 'foo', 'bar')
+        self.assertEqual(res, True)
+        # SELECT and CLIENT SETNAME are sent in a single request
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(c.connection.info['db'], self.test_db)
+        self.assertEqual(c.connection.info['name'], 'tornadoredis-test')
+        res = yield gen.Task(c.execute_command, 'CLIENT', 'GETNAME')
+        self.assertEqual(res, 'tornadoredis-test')
+        self.assertEqual(len(writes), 3)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_reconnect(self):
+        c = self._new_client(client_name='tornadoredis-test')
+        yield gen.Task(c.set, 'foo', 'bar')
+        c.connection.disconnect()
+        self.assertEqual(c.connection.info['name'], 'tornadoredis-test')
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        res = yield gen.Task(c.execute_command, 'CLIENT', 'GETNAME')
+        self.assertEqual(res, 'tornadoredis-test')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_setup_error(self):
+        # The test server does not require a password
+        c = self._new_client(password='secret')
+        try:
+            yield gen.Task(c.get, 'foo')
+        except ResponseError:
+            pass
+        else:
+            self.fail('ResponseError is not raised')
+        self.assertEqual(c.connection.info['pass'], None)
+        self.assertEqual(c.connection.info['db'], None)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pipeline(self):
+        c = self._new_client(client_name='tornadoredis-test')
+        writes = self._count_writes(c)
+        pipe = c.pipeline()
+        pipe.set('foo', 'bar')
+        pipe.execute_command('CLIENT', 'GETNAME')
+        res = yield gen.Task(pipe.execute)
+        self.assertEqual(res, [True, 'tornadoredis-test'])
+        self.assertEqual(len(writes), 2)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pool(self):
+        pool = tornadoredis.ConnectionPool(max_connections=1,
+                                           io_loop=self.io_loop,
+                                           port=self.test_port)
+        c = self._new_client(pool=pool, client_name='tornadoredis-test')
+        # Other tests leave keys in the next database, only the test one
+        # is flushed
+        key = 'handshake-pool'
+        yield gen.Task(c.set, key, 'bar')
+        yield gen.Task(c.disconnect)
+        c = self._new_client(pool=pool, selected_db=self.test_db + 1)
+        res = yield gen.Task(c.get, key)
+        self.assertEqual(res, None)
+        self.assertEqual(c.connection.info['db'], self.test_db + 1)
+        self.stop()
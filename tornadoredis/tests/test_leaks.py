@@ -1,10 +1,12 @@
 import sys
 import gc
 import random
+import weakref
 
 from tornado import gen
 import tornado.ioloop
 
+import tornadoredis
 from tornadoredis.exceptions import ResponseError
 
 from .redistest import RedisTestCase, async_test
@@ -109,3 +111,92 @@ class MiscTestCase(RedisTestCase):
         yield gen.Task(some_code)
 
         self.stop()
+
+    if not PYPY_INTERPRETER:
+        @async_test
+        @gen.engine
+        def test_no_reference_cycles(self):
+            """
+            Tests if a Client instance is destroyed by reference counting
+            as soon as it's not used, i.e. it is not a part of
+            a reference cycle.
+            """
+            pool = tornadoredis.ConnectionPool(io_loop=self.io_loop,
+                                               port=self.test_port)
+            client_kwargs = ({}, {'multiplexed': True},
+                             {'auto_pipeline': True}, {'pool': pool})
+            gc.disable()
+            try:
+                for kwargs in client_kwargs:
+                    c = self._new_client(**kwargs)
+                    yield gen.Task(c.set, 'foo', 'bar')
+                    res = yield [c.get('foo'), gen.Task(c.get, 'foo')]
+                    self.assertEqual(res, ['bar', 'bar'])
+                    pipe = c.pipeline()
+                    pipe.get('foo')
+                    res = yield pipe.execute()
+                    self.assertEqual(res, ['bar'])
+                    yield gen.Task(c.subscribe, 'foo')
+                    c.listen(lambda msg: None)
+                    yield gen.Task(c.unsubscribe, 'foo')
+                    yield c.disconnect()
+                    c.connect()
+                    res = yield c.get('foo')
+                    self.assertEqual(res, 'bar')
+                    ref = weakref.ref(c)
+                    del c, pipe
+                    self.assertEqual(ref(), None)
+            finally:
+                gc.enable()
+            self.stop()
+
+        @async_test
+        @gen.engine
+        def test_pending_command(self):
+            """
+            Tests if a Client instance is destroyed after receiving
+            the reply to a command sent before releasing the instance.
+            """
+            gc.disable()
+            try:
+                c = self._new_client()
+                destroyed = []
+                c._on_destroy = lambda: destroyed.append(True)
+                c.get('foo')
+                del c
+                yield gen.Task(self.io_loop.add_callback)
+                while not destroyed:
+                    yield gen.Task(self.pause, 0.01)
+            finally:
+                gc.enable()
+            self.stop()
+
+        @async_test
+        @gen.engine
+        def test_listen(self):
+            """
+            Tests if a listening Client instance is kept alive by the
+            listening loop, and destroyed as soon as the loop exits.
+            """
+            messages = []
+            gc.disable()
+            try:
+                c = self._new_client()
+                yield gen.Task(c.subscribe, 'foo')
+                c.listen(messages.append)
+                ref = weakref.ref(c)
+                connection = c.connection
+                del c
+                gc.collect()
+                yield gen.Task(self.client.publish, 'foo', 'bar')
+                while not messages or messages[-1].kind != 'message':
+                    yield gen.Task(self.pause, 0.01)
+                self.assertEqual(messages[-1].body, 'bar')
+                yield gen.Task(ref().unsubscribe, 'foo')
+                while ref() is not None:
+                    yield gen.Task(self.pause, 0.01)
+                self.assertEqual(messages[-1].kind, 'unsubscribe')
+                self.assertFalse(connection.connected())
+            finally:
+                gc.enable()
+            self.stop()
@@ -0,0 +1,116 @@
+from tornado import gen
+
+from tornadoredis.exceptions import ResponseError
+
+from .redistest import RedisTestCase, async_test
+
+
+class MultiplexedClientTestCase(RedisTestCase):
+
+    def _new_multiplexed_client(self, **kwargs):
+        return self._new_client(multiplexed=True, **kwargs)
+
+    @async_test
+    @gen.engine
+    def test_concurrent_commands(self):
+        c = self._new_multiplexed_client()
+        # Commands wait for the database to be selected
+        yield gen.Task(c.ping)
+        tasks = [gen.Task(c.incr, 'foo') for __ in range(100)]
+        # All the commands have been sent without waiting for replies
+        self.assertTrue(len(c.connection.reply_callbacks) > 1)
+        res = yield tasks
+        self.assertEqual(res, list(range(1, 101)))
+        res = yield gen.Task(self.client.get, 'foo')
+        self.assertEqual(res, '100')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_reply_order(self):
+        c = self._new_multiplexed_client()
+        yield gen.Task(c.rpush, 'lst', 'a', 'b', 'c')
+        res = yield [gen.Task(c.set, 'foo', 'bar'),
+                     gen.Task(c.lrange, 'lst', 0, -1),
+                     gen.Task(c.get, 'foo'),
+                     gen.Task(c.get, 'missing'),
+                     gen.Task(c.llen, 'foo'),
+                     gen.Task(c.hgetall, 'missing'),
+                     gen.Task(c.llen, 'lst')]
+        set_res, lrange_res, get_res, missing, error, hgetall_res, llen = res
+        self.assertEqual(set_res, True)
+        self.assertEqual(lrange_res, ['a', 'b', 'c'])
+        self.assertEqual(get_res, 'bar')
+        self.assertEqual(missing, None)
+        self.assertIsInstance(error, Exception)
+        self.assertEqual(hgetall_res, {})
+        self.assertEqual(llen, 3)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_selected_db(self):
+        c = self._new_multiplexed_client(selected_db=10)
+        yield [gen.Task(c.set, 'foo%d' % n, n) for n in range(10)]
+        res = yield gen.Task(self.client.get, 'foo1')
+        self.assertEqual(res, None)
+        yield gen.Task(self.client.select, 10)
+        res = yield gen.Task(self.client.mget, ['foo%d' % n for n in range(10)])
+        self.assertEqual(res, ['%d' % n for n in range(10)])
+        yield gen.Task(self.client.flushdb)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_setup_error(self):
+        # The database index is out of range
+        c = self._new_multiplexed_client(selected_db=99)
+        futures = [c.set('foo', 'bar'), c.set('foo', 'baz')]
+        # The command issued behind SELECT fails too
+        # and is not sent to the default database
+        for future in futures:
+            try:
+                yield future
+            except ResponseError:
+                pass
+            else:
+                self.fail('ResponseError is not raised')
+        res = yield gen.Task(self._new_client(selected_db=0).get, 'foo')
+        self.assertEqual(res, None)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pipeline(self):
+        c = self._new_multiplexed_client()
+        pipe = c.pipeline()
+        pipe.set('foo', 'bar')
+        pipe.incr('counter')
+        pipe.get('foo')
+        tasks = [gen.Task(c.incr, 'counter') for __ in range(5)]
+        tasks.append(gen.Task(pipe.execute))
+        tasks.extend(gen.Task(c.incr, 'counter') for __ in range(5))
+        res = yield tasks
+        self.assertEqual(res[:5], [1, 2, 3, 4, 5])
+        self.assertEqual(res[5], [True, 6, 'bar'])
+        self.assertEqual(res[6:], [7, 8, 9, 10, 11])
+        self.stop()
+
+
+class AutoPipelineTestCase(MultiplexedClientTestCase):
+
+    def _new_multiplexed_client(self, **kwargs):
+        return self._new_client(auto_pipeline=True, **kwargs)
+
+    @async_test
+    @gen.engine
+    def test_single_write(self):
+        c = self._new_multiplexed_client()
+        yield gen.Task(c.ping)
+        tasks = [gen.Task(c.incr, 'foo') for __ in range(10)]
+        # The commands are buffered until the end of the IOLoop iteration
+        self.assertEqual(len(c.connection._write_queue), 10)
+        res = yield tasks
+        self.assertEqual(res, list(range(1, 11)))
+        self.assertEqual(c.connection._write_queue, [])
+        self.stop()
@@ -7,7 +7,7 @@ from tornado import gen
 import tornado.ioloop
 
 import tornadoredis
-from tornadoredis.exceptions import ConnectionError
+from tornadoredis.exceptions import ConnectionError, TimeoutError
 
 from .redistest import RedisTestCase, async_test
 
@@ -53,6 +53,269 @@ class ConnectionPoolTestCase(RedisTestCase):
 
         self.stop()
 
+    @gen.engine
+    def _push_and_disconnect(self, client, value, callback=None):
+        yield gen.Task(client.rpush, 'order', value)
+        yield gen.Task(client.disconnect)
+        callback(True)
+
+    @async_test
+    @gen.engine
+    def test_waiting_order(self):
+        pool = self._new_pool(max_connections=1, wait_for_available=True)
+        c1 = self._new_client(pool)
+        yield gen.Task(c1.delete, 'order')
+        clients = [self._new_client(pool) for __ in range(5)]
+        for n, c in enumerate(clients):
+            self._push_and_disconnect(c, n, callback=(yield gen.Callback(n)))
+        self.assertEqual(pool.stats()['waiting'], 5)
+        yield gen.Task(c1.disconnect)
+        yield gen.WaitAll(list(range(5)))
+        c1 = self._new_client(pool)
+        res = yield gen.Task(c1.lrange, 'order', 0, -1)
+        self.assertEqual(res, ['0', '1', '2', '3', '4'])
+        stats = pool.stats()
+        self.assertEqual(stats['waiting'], 0)
+        self.assertEqual(stats['waits'], 5)
+        self.assertTrue(stats['max_wait_time'] > 0)
+        self.assertTrue(stats['wait_time'] >= stats['max_wait_time'])
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_wait_timeout(self):
+        pool = self._new_pool(max_connections=1, wait_for_available=True,
+                              wait_timeout=0.1)
+        c1 = self._new_client(pool)
+        yield gen.Task(c1.set, 'foo', 'bar')
+        c2 = self._new_client(pool)
+        try:
+            yield gen.Task(c2.get, 'foo')
+        except TimeoutError:
+            pass
+        else:
+            self.fail('TimeoutError is not raised')
+        self.assertEqual(pool.stats()['wait_timeouts'], 1)
+        self.assertEqual(pool.stats()['waiting'], 0)
+        # The client waits for a connection again
+        yield gen.Task(c1.disconnect)
+        res = yield gen.Task(c2.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.stop()
+
+    def test_max_waiting(self):
+        pool = self._new_pool(max_connections=1, wait_for_available=True,
+                              max_waiting=1)
+        c1 = self._new_client(pool=pool)
+        c2 = self._new_client(pool=pool)
+        self.assertRaises(ConnectionError,
+                          partial(self._new_client, pool=pool))
+
+    @async_test
+    @gen.engine
+    def test_min_idle(self):
+        pool = self._new_pool(max_connections=3, min_idle=2)
+        yield gen.Task(self.pause, 0.1)
+        stats = pool.stats()
+        self.assertEqual(stats['available'], 2)
+        self.assertEqual(stats['created'], 2)
+        c = self._new_client(pool)
+        yield gen.Task(c.set, 'foo', 'bar')
+        self.assertEqual(pool.stats()['created'], 2)
+        yield gen.Task(c.disconnect)
+        pool.close()
+        self.assertEqual(pool.stats()['available'], 0)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_max_idle(self):
+        pool = self._new_pool(max_connections=3, max_idle=1)
+        c1 = self._new_client(pool)
+        c2 = self._new_client(pool)
+        yield [gen.Task(c1.set, 'foo', 'bar'), gen.Task(c2.get, 'foo')]
+        yield [gen.Task(c1.disconnect), gen.Task(c2.disconnect)]
+        stats = pool.stats()
+        self.assertEqual(stats['available'], 1)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['closed'], 1)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_idle_timeout(self):
+        pool = self._new_pool(idle_timeout=0.05)
+        c = self._new_client(pool)
+        yield gen.Task(c.set, 'foo', 'bar')
+        yield gen.Task(c.disconnect)
+        pool.check_connections()
+        self.assertEqual(pool.stats()['available'], 1)
+        yield gen.Task(self.pause, 0.1)
+        pool.check_connections()
+        self.assertEqual(pool.stats()['available'], 0)
+        self.assertEqual(pool.stats()['closed'], 1)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_health_check(self):
+        pool = self._new_pool(health_check_interval=0.05)
+        c = self._new_client(pool)
+        yield gen.Task(c.set, 'foo', 'bar')
+        address = c.connection._stream.socket.getsockname()
+        yield gen.Task(c.disconnect)
+        # Kill the idle connection on the server side
+        killer = self._new_client()
+        yield gen.Task(killer.execute_command, 'CLIENT', 'KILL',
+                       '%s:%d' % address[:2])
+        yield gen.Task(self.pause, 0.2)
+        stats = pool.stats()
+        self.assertEqual(stats['available'], 0)
+        self.assertEqual(stats['closed'], 1)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        pool.close()
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_health_check_pending(self):
+        pool = self._new_pool(max_connections=1, wait_for_available=True)
+        c = self._new_client(pool)
+        yield gen.Task(c.set, 'foo', 'bar')
+        yield gen.Task(c.disconnect)
+        connection = pool._available_connections[0]
+        pool._ping(connection)
+        # The connection is assigned once the PING is replied to
+        c = self._new_client(pool)
+        self.assertFalse(c.connection is connection)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.assertTrue(c.connection is connection)
+        yield gen.Task(c.disconnect)
+        # A new connection is made if the PING fails
+        pauser = self._new_client()
+        yield gen.Task(pauser.execute_command, 'CLIENT', 'PAUSE', 100)
+        pool._ping(connection)
+        c = self._new_client(pool)
+        connection._stream.close()
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.assertFalse(c.connection is connection)
+        self.assertEqual(pool.stats()['closed'], 1)
+        yield gen.Task(c.disconnect)
+        pool.close()
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_lifo_reuse(self):
+        pool = self._new_pool(max_connections=3)
+        clients = [self._new_client(pool) for __ in range(3)]
+        yield [gen.Task(c.ping) for c in clients]
+        connections = [c.connection for c in clients]
+        for c in clients:
+            yield gen.Task(c.disconnect)
+        c = self._new_client(pool)
+        self.assertTrue(c.connection is connections[-1])
+        yield gen.Task(c.ping)
+        yield gen.Task(c.disconnect)
+        # The released connection is reused again
+        clients = [self._new_client(pool) for __ in range(3)]
+        self.assertEqual([id(c.connection) for c in clients],
+                         [id(conn) for conn in reversed(connections)])
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_db_affinity(self):
+        pool = self._new_pool(max_connections=2)
+        c1 = self._new_client(pool)
+        c2 = self._new_client(pool, selected_db=self.test_db + 1)
+        yield [gen.Task(c1.ping), gen.Task(c2.ping)]
+        connection = c1.connection
+        self.assertEqual(connection.info['db'], self.test_db)
+        yield gen.Task(c1.disconnect)
+        yield gen.Task(c2.disconnect)
+        # Not the most recently released connection
+        c = self._new_client(pool)
+        self.assertTrue(c.connection is connection)
+        self.assertTrue(c._can_send('PING'))
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_default_db(self):
+        pool = self._new_pool(max_connections=1)
+        c = self._new_client(pool)
+        yield gen.Task(c.set, 'foo', 'bar')
+        yield gen.Task(c.disconnect)
+        # The connection has the test database selected
+        c = self._new_client(pool, selected_db=0)
+        self.assertFalse(c._can_send('GET'))
+        res = yield gen.Task(c.get, 'foo')
+        self.assertNotEqual(res, 'bar')
+        self.assertEqual(c.connection.info['db'], 0)
+        yield gen.Task(c.disconnect)
+        pool.close()
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_adaptive_size(self):
+        # The limit is adjusted by the test
+        pool = self._new_pool(max_connections=4, adaptive=True,
+                              adjust_interval=1000)
+        self.assertEqual(pool.stats()['limit'], 1)
+        clients = [self._new_client(pool) for __ in range(3)]
+        self.assertEqual(pool.stats()['waiting'], 2)
+        pool.adjust_size()
+        stats = pool.stats()
+        self.assertEqual(stats['limit'], 2)
+        self.assertEqual(stats['waiting'], 1)
+        self.assertEqual(stats['last_adjustment'], 'increase')
+        for c in clients:
+            yield gen.Task(c.ping)
+            # Pass the connection to the waiting client
+            yield gen.Task(c.disconnect)
+        # A client was waiting since the previous adjustment
+        pool.adjust_size()
+        self.assertEqual(pool.stats()['limit'], 3)
+        # No connections used since the previous adjustment
+        pool.adjust_size()
+        stats = pool.stats()
+        self.assertEqual(stats['limit'], 1)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['last_adjustment'], 'decrease')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_adaptive_hold_time(self):
+        pool = self._new_pool(max_connections=4, adaptive=True,
+                              adjust_interval=1000, target_hold_time=0.01)
+        c1 = self._new_client(pool)
+        c2 = self._new_client(pool)
+        yield gen.Task(c1.ping)
+        pool.adjust_size()
+        self.assertEqual(pool.stats()['limit'], 2)
+        yield gen.Task(c2.ping)
+        yield gen.Task(self.pause, 0.05)
+        yield gen.Task(c1.disconnect)
+        self.assertTrue(pool.stats()['hold_time'] > 0.01)
+        pool.adjust_size()
+        stats = pool.stats()
+        self.assertEqual(stats['limit'], 1)
+        self.assertEqual(stats['decreases'], 1)
+        # The surplus connection is closed once released
+        yield gen.Task(c2.disconnect)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['closed'], 1)
+        self.stop()
+
     @async_test
     @gen.engine
     def test_reconnect(self):
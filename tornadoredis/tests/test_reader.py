@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from tornadoredis.connection import PythonReader, LARGE_BULK_SIZE, hiredis
+from tornadoredis.exceptions import ResponseError, InvalidResponse
+
+
+class PythonReaderTestCase(TestCase):
+    reader_class = PythonReader
+
+    def _new_reader(self, **kwargs):
+        kwargs.setdefault('protocolError', InvalidResponse)
+        kwargs.setdefault('replyError', ResponseError)
+        return self.reader_class(**kwargs)
+
+    def _feed_bytewise(self, reader, data):
+        replies = []
+        for n in range(len(data)):
+            reader.feed(data[n:n + 1])
+            reply = reader.gets()
+            while reply is not False:
+                replies.append(reply)
+                reply = reader.gets()
+        return replies
+
+    def test_simple_replies(self):
+        reader = self._new_reader()
+        reader.feed(b'+OK\r\n:42\r\n$3\r\nfoo\r\n$-1\r\n*0\r\n*-1\r\n')
+        self.assertEqual(reader.gets(), b'OK')
+        self.assertEqual(reader.gets(), 42)
+        self.assertEqual(reader.gets(), b'foo')
+        self.assertEqual(reader.gets(), None)
+        self.assertEqual(reader.gets(), [])
+        self.assertEqual(reader.gets(), None)
+        self.assertEqual(reader.gets(), False)
+
+    def test_error_reply(self):
+        reader = self._new_reader()
+        reader.feed(b'-ERR unknown command\r\n')
+        reply = reader.gets()
+        self.assertIsInstance(reply, ResponseError)
+        self.assertEqual(reply.message, 'ERR unknown command')
+
+    def test_encoding(self):
+        reader = self._new_reader(encoding='utf-8')
+        reader.feed(b'$6\r\n\xd0\xb1\xd0\xb0\xd1\x80\r\n+OK\r\n')
+        self.assertEqual(reader.gets(), u'бар')
+        self.assertEqual(reader.gets(), u'OK')
+
+    def test_binary_bulk(self):
+        reader = self._new_reader()
+        reader.feed(b'$4\r\n\r\n\r\n\r\n')
+        self.assertEqual(reader.gets(), b'\r\n\r\n')
+
+    def test_nested_multibulk(self):
+        data = (b'*3\r\n$3\r\nfoo\r\n*2\r\n:1\r\n-ERR fail\r\n'
+                b'*2\r\n*1\r\n$-1\r\n*0\r\n+PONG\r\n')
+        replies = self._feed_bytewise(self._new_reader(), data)
+        self.assertEqual(len(replies), 2)
+        foo, (one, error), ((nil, ), empty) = replies[0]
+        self.assertEqual((foo, one, nil, empty), (b'foo', 1, None, []))
+        self.assertIsInstance(error, ResponseError)
+        self.assertEqual(replies[1], b'PONG')
+
+    def test_large_multibulk(self):
+        values = [('value:%d' % n).encode('utf-8') for n in range(1000)]
+        data = b'*1000\r\n' + b''.join(b'$' + str(len(v)).encode('utf-8') +
+                                       b'\r\n' + v + b'\r\n'
+                                       for v in values)
+        reader = self._new_reader()
+        for n in range(0, len(data), 100):
+            reader.feed(data[n:n + 100])
+            if n + 100 < len(data):
+                self.assertEqual(reader.gets(), False)
+        self.assertEqual(reader.gets(), values)
+
+    def test_large_bulk(self):
+        value = b'\r\n' * (LARGE_BULK_SIZE // 2) + b'\xd0\xb1'
+        data = (b'*2\r\n$' + str(len(value)).encode('utf-8') + b'\r\n' +
+                value + b'\r\n:1\r\n$' + str(len(value)).encode('utf-8') +
+                b'\r\n' + value + b'\r\n+OK\r\n')
+        for encoding in (None, 'utf-8'):
+            reader = self._new_reader(encoding=encoding)
+            replies = []
+            for n in range(0, len(data), 10000):
+                reader.feed(data[n:n + 10000])
+                reply = reader.gets()
+                while reply is not False:
+                    replies.append(reply)
+                    reply = reader.gets()
+            if encoding:
+                expected = value.decode(encoding)
+                self.assertEqual(replies, [[expected, 1], expected, u'OK'])
+            else:
+                self.assertEqual(replies, [[value, 1], value, b'OK'])
+
+    def test_large_bulk_buffer(self):
+        if self.reader_class is not PythonReader:
+            return
+        value = b'x' * (LARGE_BULK_SIZE + 1)
+        bulk = b'$' + str(len(value)).encode('utf-8') + b'\r\n' + value
+        data = b'*1\r\n' + bulk + b'\r\n' + bulk + b'\r\n'
+        for hashable_members in (False, True):
+            reader = self._new_reader(hashable_members=hashable_members)
+            replies = []
+            for n in range(0, len(data), 10000):
+                reader.feed(data[n:n + 10000])
+                reply = reader.gets()
+                while reply is not False:
+                    replies.append(reply)
+                    reply = reader.gets()
+            self.assertEqual(replies, [[value], value])
+            # The buffer the reply has been received into is returned
+            self.assertIsInstance(replies[1], bytearray)
+            if hashable_members:
+                self.assertIsInstance(replies[0][0], bytes)
+                self.assertEqual(set(replies[0]), set([value]))
+            else:
+                self.assertIsInstance(replies[0][0], bytearray)
+
+    def test_protocol_error(self):
+        reader = self._new_reader()
+        reader.feed(b'?foo\r\n')
+        self.assertRaises(InvalidResponse, reader.gets)
+
+
+if hiredis:
+    class HiredisReaderTestCase(PythonReaderTestCase):
+        reader_class = hiredis.Reader
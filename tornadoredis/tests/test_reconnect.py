@@ -2,12 +2,15 @@ import time
 import socket
 
 from tornado import gen
+from tornado.concurrent import Future
 from tornado.escape import to_basestring
+from tornado.netutil import Resolver, ThreadedResolver
 from tornado.tcpserver import TCPServer
 
 from tornado.testing import AsyncTestCase
 
 import tornadoredis
+from tornadoredis.connection import futures
 from tornadoredis.exceptions import ConnectionError
 from tornadoredis.tests.redistest import async_test
 
@@ -157,3 +160,186 @@ class DisconnectTestCase(AsyncTestCase):
         self.assertFalse(self.client.subscribed)
 
         self.stop()
+
+
+class PendingResolver(Resolver):
+
+    def resolve(self, host, port, family=0, callback=None):
+        return Future()
+
+
+class ConnectTestCase(AsyncTestCase):
+    test_port = 6381
+
+    def _new_client(self, **kwargs):
+        return tornadoredis.Client(io_loop=self.io_loop, **kwargs)
+
+    @async_test
+    @gen.engine
+    def test_connection_refused(self):
+        c = self._new_client(port=self.test_port)
+        started = time.time()
+        try:
+            yield gen.Task(c.connect)
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertFalse(c.connection.connected())
+        self.assertTrue(time.time() - started < 1)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_connect_timeout(self):
+        # The host name is never resolved
+        c = self._new_client(connect_timeout=0.2,
+                             resolver=PendingResolver())
+        ticks = []
+        self.io_loop.add_callback(ticks.append, True)
+        started = time.time()
+        try:
+            yield gen.Task(c.connect)
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertTrue(time.time() - started < 1)
+        # The IOLoop is not blocked while connecting
+        self.assertEqual(ticks, [True])
+        self.assertFalse(c.connection.connected())
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_commands_while_connecting(self):
+        c = self._new_client(selected_db=9)
+        yield gen.Task(c.delete, 'foo')
+        yield gen.Task(c.disconnect)
+        c.incr('foo')
+        self.assertTrue(c.connection.connected())
+        self.assertFalse(c.connection.ready())
+        res = yield [gen.Task(c.incr, 'foo'), gen.Task(c.get, 'foo')]
+        self.assertEqual(res, [2, '2'])
+        yield gen.Task(c.delete, 'foo')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_resolver(self):
+        c = self._new_client(host='127.0.0.1')
+        yield gen.Task(c.connect)
+        # IP addresses are not resolved
+        self.assertEqual(c.connection.resolver, None)
+        yield gen.Task(c.disconnect)
+        c = self._new_client(host='localhost')
+        yield gen.Task(c.connect)
+        self.assertTrue(c.connection.connected())
+        if futures is not None:
+            # Tornado 4 resolves host names on the IOLoop thread by default
+            self.assertIsInstance(c.connection.resolver, ThreadedResolver)
+        yield gen.Task(c.disconnect)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_backoff(self):
+        policy = tornadoredis.ReconnectPolicy(base_delay=0.1, max_delay=0.4,
+                                              failure_threshold=10)
+        self.assertEqual(policy.connect_delay(), 0)
+        delays = []
+        for __ in range(5):
+            policy.connect_failed()
+            delays.append(max(policy.connect_delay() for __ in range(100)))
+        self.assertTrue(0 < delays[0] <= 0.1)
+        self.assertTrue(0.1 < delays[1] <= 0.2)
+        self.assertTrue(0.2 < delays[2] <= 0.4)
+        self.assertTrue(all(0.2 < d <= 0.4 for d in delays[3:]))
+        policy.connect_succeeded()
+        self.assertEqual(policy.connect_delay(), 0)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_circuit_breaker(self):
+        policy = tornadoredis.ReconnectPolicy(base_delay=0.01,
+                                              failure_threshold=2,
+                                              recovery_timeout=0.3)
+        c = self._new_client(port=self.test_port, reconnect_policy=policy)
+        for __ in range(2):
+            try:
+                yield gen.Task(c.connect)
+            except ConnectionError:
+                pass
+        self.assertEqual(policy.state, policy.OPEN)
+        # Connection attempts fail without connecting
+        connect = c.connection._start_connect
+        c.connection._start_connect = lambda: self.fail('Connecting')
+        try:
+            yield gen.Task(c.connect)
+        except ConnectionError as e:
+            self.assertEqual(str(e), 'Circuit breaker is open')
+        else:
+            self.fail('ConnectionError is not raised')
+        c.connection._start_connect = connect
+        self.assertEqual(policy.failures, 2)
+        yield gen.Task(self.io_loop.add_timeout, time.time() + 0.3)
+        # A single probe is let through and fails
+        try:
+            yield gen.Task(c.connect)
+        except ConnectionError:
+            pass
+        self.assertEqual(policy.state, policy.OPEN)
+        yield gen.Task(self.io_loop.add_timeout, time.time() + 0.3)
+        # The probe succeeds once the server is up
+        c = self._new_client(reconnect_policy=policy)
+        other = self._new_client(reconnect_policy=policy)
+        c.connection.connect()
+        self.assertEqual(policy.state, policy.HALF_OPEN)
+        # Every other attempt is rejected while the probe is pending
+        for __ in range(3):
+            try:
+                yield gen.Task(other.connect)
+            except ConnectionError as e:
+                self.assertEqual(str(e), 'Circuit breaker is open')
+            else:
+                self.fail('ConnectionError is not raised')
+            self.assertEqual(policy.state, policy.HALF_OPEN)
+        res = yield gen.Task(c.ping)
+        self.assertEqual(res, True)
+        self.assertEqual(policy.state, policy.CLOSED)
+        self.assertEqual(policy.failures, 0)
+        yield gen.Task(other.connect)
+        yield gen.Task(c.disconnect)
+        yield gen.Task(other.disconnect)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pool_policy(self):
+        policy = tornadoredis.ReconnectPolicy(failure_threshold=1,
+                                              recovery_timeout=10)
+        pool = tornadoredis.ConnectionPool(max_connections=2,
+                                           port=self.test_port,
+                                           reconnect_policy=policy,
+                                           io_loop=self.io_loop)
+        c = self._new_client(connection_pool=pool)
+        try:
+            yield gen.Task(c.ping)
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertEqual(policy.state, policy.OPEN)
+        # Connections of the pool share the circuit breaker
+        c = self._new_client(connection_pool=pool)
+        started = time.time()
+        try:
+            yield gen.Task(c.ping)
+        except ConnectionError as e:
+            self.assertEqual(str(e), 'Circuit breaker is open')
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertTrue(time.time() - started < 0.1)
+        pool.close()
+        self.stop()
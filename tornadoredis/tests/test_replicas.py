@@ -0,0 +1,159 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+import tornadoredis
+from tornadoredis.replicas import (ReplicaClient, HedgePolicy,
+                                   LEAST_OUTSTANDING)
+
+from .redistest import RedisTestCase, FakeRedisServer, bulk
+
+
+class FakeReplica(FakeRedisServer):
+    """
+    Replies to GET with the 'replica-<port>' value,
+    after the delay if set.
+    """
+    def __init__(self, port, **kwargs):
+        super(FakeReplica, self).__init__(**kwargs)
+        self.port = port
+        self.commands = 0
+        self.delay = 0
+
+    def reply(self, stream, args):
+        command = args[0].upper()
+        if command == 'SELECT':
+            return b'+OK\r\n'
+        self.commands += 1
+        if command == 'GET':
+            if self.delay:
+                return self._delayed(bulk('replica-%d' % self.port))
+            return bulk('replica-%d' % self.port)
+        return b'-ERR unknown command\r\n'
+
+    @gen.coroutine
+    def _delayed(self, reply):
+        yield gen.sleep(self.delay)
+        raise gen.Return(reply)
+
+
+class ReplicaClientTestCase(RedisTestCase):
+    ports = (27021, 27022)
+
+    def setUp(self):
+        super(ReplicaClientTestCase, self).setUp()
+        self.replicas = []
+        for port in self.ports:
+            replica = FakeReplica(port, io_loop=self.io_loop)
+            replica.listen(port)
+            self.replicas.append(replica)
+
+    def tearDown(self):
+        for replica in self.replicas:
+            replica.stop()
+        super(ReplicaClientTestCase, self).tearDown()
+
+    def _replica_client(self, ports=None, **kwargs):
+        pools = [tornadoredis.ConnectionPool(host='127.0.0.1', port=port,
+                                             io_loop=self.io_loop)
+                 for port in ports or self.ports]
+        primary = tornadoredis.ConnectionPool(port=self.test_port,
+                                              io_loop=self.io_loop)
+        return ReplicaClient(primary, pools, selected_db=self.test_db,
+                             io_loop=self.io_loop, **kwargs)
+
+    @gen_test
+    def test_routing(self):
+        c = self._replica_client()
+        res = yield c.set('foo', 'primary')
+        self.assertEqual(res, True)
+        res = yield [c.get('foo'), c.get('foo'), c.get('foo')]
+        self.assertEqual(res, ['replica-%d' % self.ports[0],
+                               'replica-%d' % self.ports[1],
+                               'replica-%d' % self.ports[0]])
+        # Read-your-writes
+        res = yield c.execute_command('GET', 'foo', replica=False)
+        self.assertEqual(res, 'primary')
+        res = yield c.ping()
+        self.assertEqual(res, True)
+        self.assertEqual(c.stats(), {'primary': 3, 'replicas': [2, 1],
+                                     'outstanding': [0, 0], 'fallbacks': 0})
+
+    @gen_test
+    def test_watch(self):
+        c = self._replica_client()
+        yield c.set('foo', 'primary')
+        yield c.watch('foo')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'primary')
+        pipe = c.pipeline(transactional=True)
+        pipe.set('foo', 'bar')
+        res = yield pipe.execute()
+        self.assertEqual(res, [True])
+        res = yield c.get('foo')
+        self.assertEqual(res, 'replica-%d' % self.ports[0])
+        yield c.watch('foo')
+        yield c.unwatch()
+        res = yield c.get('foo')
+        self.assertEqual(res, 'replica-%d' % self.ports[1])
+        # Commands are queued in the transaction on the primary
+        yield c.execute_command('MULTI')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'QUEUED')
+        res = yield c.execute_command('EXEC')
+        self.assertEqual(res, ['bar'])
+        res = yield c.get('foo')
+        self.assertEqual(res, 'replica-%d' % self.ports[0])
+        self.assertEqual(sum(replica.commands for replica in self.replicas),
+                         3)
+
+    def test_least_outstanding(self):
+        c = self._replica_client(selection=LEAST_OUTSTANDING)
+        c._outstanding = [2, 0]
+        self.assertEqual([c.select_replica() for __ in range(3)], [1, 1, 1])
+        c._outstanding = [1, 1]
+        self.assertEqual([c.select_replica() for __ in range(2)], [1, 0])
+        self.assertRaises(ValueError, self._replica_client,
+                          selection='random')
+
+    @gen_test
+    def test_fallback(self):
+        c = self._replica_client(ports=[27029])
+        yield c.set('foo', 'primary')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'primary')
+        self.assertEqual(c.stats()['fallbacks'], 1)
+
+    @gen_test
+    def test_hedge(self):
+        policy = HedgePolicy(initial_delay=0.02)
+        c = self._replica_client(hedge_policy=policy)
+        self.replicas[0].delay = 0.3
+        start = self.io_loop.time()
+        res = yield c.get('foo')
+        self.assertEqual(res, 'replica-%d' % self.ports[1])
+        self.assertLess(self.io_loop.time() - start, 0.2)
+        self.assertEqual(c.stats()['outstanding'], [1, 0])
+        self.assertEqual(policy.stats(),
+                         {'hedged': 1, 'wins': 1, 'delay': 0.02})
+        # Replies received in time are not hedged
+        self.replicas[0].delay = 0
+        res = yield c.get('foo')
+        self.assertEqual(res, 'replica-%d' % self.ports[0])
+        self.assertEqual(policy.stats()['hedged'], 1)
+        # The dropped reply releases the connection
+        yield gen.sleep(0.3)
+        self.assertEqual(c.stats()['outstanding'], [0, 0])
+        self.assertEqual(c.stats()['replicas'], [2, 1])
+
+    def test_hedge_delay(self):
+        policy = HedgePolicy(percentile=90, initial_delay=0.5,
+                             min_samples=20, update_interval=10)
+        for n in range(1, 11):
+            policy.record(n / 100.0)
+        self.assertEqual(policy.delay(), 0.5)
+        for n in range(11, 101):
+            policy.record(n / 100.0)
+        self.assertEqual(policy.delay(), 0.9)
+        policy = HedgePolicy(min_delay=0.1, min_samples=1, update_interval=1)
+        policy.record(0.001)
+        self.assertEqual(policy.delay(), 0.1)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from tornado import gen
+
+import tornadoredis
+
+from .redistest import RedisTestCase, async_test
+
+
+BINARY_VALUE = b'\x80\x03\xff\x00binary'
+
+
+class RawRepliesTestCase(RedisTestCase):
+
+    @async_test
+    @gen.engine
+    def test_raw_replies(self):
+        c = self._new_client(decode_responses=False)
+        res = yield gen.Task(c.set, 'foo', BINARY_VALUE)
+        self.assertEqual(res, True)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, BINARY_VALUE)
+        yield gen.Task(c.hmset, 'bar', {'a': BINARY_VALUE})
+        res = yield gen.Task(c.hgetall, 'bar')
+        self.assertEqual(res, {b'a': BINARY_VALUE})
+        res = yield gen.Task(c.ping)
+        self.assertEqual(res, True)
+        res = yield gen.Task(c.info)
+        self.assertIn('redis_version', res)
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_per_command_override(self):
+        yield gen.Task(self.client.set, 'foo', BINARY_VALUE)
+        yield gen.Task(self.client.set, 'bar', 'бар')
+        res = yield gen.Task(self.client.execute_command, 'GET', 'foo',
+                             decode_responses=False)
+        self.assertEqual(res, BINARY_VALUE)
+        res = yield gen.Task(self.client.get, 'bar')
+        self.assertEqual(res, u'бар')
+
+        c = self._new_client(decode_responses=False)
+        res = yield gen.Task(c.execute_command, 'GET', 'bar',
+                             decode_responses=True)
+        self.assertEqual(res, u'бар')
+        res = yield gen.Task(c.get, 'bar')
+        self.assertEqual(res, u'бар'.encode('utf-8'))
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_multiplexed_override(self):
+        c = self._new_client(multiplexed=True)
+        yield gen.Task(c.set, 'foo', BINARY_VALUE)
+        yield gen.Task(c.set, 'bar', 'bar')
+        res = yield [gen.Task(c.get, 'bar'),
+                     gen.Task(c.execute_command, 'GET', 'foo',
+                              decode_responses=False),
+                     gen.Task(c.get, 'bar')]
+        self.assertEqual(res, ['bar', BINARY_VALUE, 'bar'])
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pipeline_override(self):
+        yield gen.Task(self.client.set, 'foo', BINARY_VALUE)
+        pipe = self.client.pipeline()
+        pipe.execute_command('GET', 'foo', decode_responses=False)
+        pipe.set('bar', 'bar')
+        pipe.get('bar')
+        res = yield gen.Task(pipe.execute)
+        self.assertEqual(res, [BINARY_VALUE, True, 'bar'])
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_encoding(self):
+        c = self._new_client(encoding='latin-1')
+        yield gen.Task(c.set, 'foo', u'ÿ')
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, u'ÿ')
+        # Arguments are encoded using the same encoding
+        res = yield gen.Task(c.execute_command, 'GET', 'foo',
+                             decode_responses=False)
+        self.assertEqual(res, u'ÿ'.encode('latin-1'))
+        pool = tornadoredis.ConnectionPool(encoding='latin-1',
+                                           io_loop=self.io_loop,
+                                           port=self.test_port)
+        c = self._new_client(pool=pool)
+        yield gen.Task(c.set, 'foo', u'é')
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, u'é')
+        self.stop()
+
+    @async_test
+    @gen.engine
+    def test_pool(self):
+        pool = tornadoredis.ConnectionPool(decode_responses=False,
+                                           io_loop=self.io_loop,
+                                           port=self.test_port)
+        c = self._new_client(pool=pool)
+        yield gen.Task(c.set, 'foo', BINARY_VALUE)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, BINARY_VALUE)
+        c = self._new_client(pool=pool, decode_responses=True)
+        res = yield gen.Task(c.set, 'foo', 'bar')
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.stop()
@@ -0,0 +1,120 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+import tornadoredis
+from tornadoredis.exceptions import ConnectionError
+
+from .redistest import RedisTestCase
+
+
+class RetryTestCase(RedisTestCase):
+
+    @gen.coroutine
+    def _pause(self):
+        # The server delays commands received in 0.1 seconds
+        c = self._new_client()
+        yield c.execute_command('CLIENT', 'PAUSE', 100)
+
+    def _lose_reply(self, c, future):
+        # The command is sent, the stream is closed before the reply
+        c.connection._stream.close()
+        return future
+
+    @gen_test
+    def test_read_only(self):
+        c = self._new_client()
+        yield c.set('foo', 'bar')
+        yield self._pause()
+        res = yield self._lose_reply(c, c.get('foo'))
+        self.assertEqual(res, 'bar')
+        self.assertEqual(c.retry_policy.stats()['retries'], 1)
+
+    @gen_test
+    def test_unsafe(self):
+        c = self._new_client()
+        yield c.set('foo', 1)
+        try:
+            yield self._pause()
+            yield self._lose_reply(c, c.incr('foo'))
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertEqual(c.retry_policy.stats(),
+                         {'retries': 0, 'unsafe': 1, 'exhausted': 0})
+        res = yield c.get('foo')
+        self.assertTrue(res in ('1', '2'))
+
+    @gen_test
+    def test_idempotent(self):
+        c = self._new_client()
+        yield c.set('foo', 1)
+        yield self._pause()
+        res = yield self._lose_reply(c, c.set('foo', 2))
+        self.assertEqual(res, True)
+        policy = tornadoredis.RetryPolicy(retry_idempotent=False)
+        c = self._new_client(retry_policy=policy)
+        yield c.set('foo', 1)
+        try:
+            yield self._pause()
+            yield self._lose_reply(c, c.set('foo', 2))
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertEqual(policy.stats()['unsafe'], 1)
+
+    @gen_test
+    def test_override(self):
+        c = self._new_client()
+        yield c.set('foo', 1)
+        yield self._pause()
+        res = yield self._lose_reply(c, c.execute_command('INCR', 'foo',
+                                                          retry=True))
+        self.assertTrue(res in (2, 3))
+        try:
+            yield self._pause()
+            yield self._lose_reply(c, c.execute_command('GET', 'foo',
+                                                        retry=False))
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+
+    @gen_test
+    def test_command_table(self):
+        policy = tornadoredis.RetryPolicy(
+            commands={'INCR': tornadoredis.client.IDEMPOTENT,
+                      'GET': tornadoredis.client.UNSAFE})
+        self.assertEqual(policy.classify('INCR'), 'idempotent')
+        self.assertEqual(policy.classify('MGET'), 'read-only')
+        self.assertEqual(policy.classify('LPUSH'), 'unsafe')
+        for cmd in ('LTRIM', 'ZADD', 'EXPIRE', 'PEXPIRE'):
+            self.assertEqual(policy.classify(cmd), 'unsafe')
+        self.assertEqual(policy.classify('EXPIREAT'), 'idempotent')
+        c = self._new_client(retry_policy=policy)
+        yield c.set('foo', 1)
+        yield self._pause()
+        res = yield self._lose_reply(c, c.incr('foo'))
+        self.assertTrue(res in (2, 3))
+        try:
+            yield self._pause()
+            yield self._lose_reply(c, c.get('foo'))
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+
+    @gen_test
+    def test_max_retries(self):
+        policy = tornadoredis.RetryPolicy(max_retries=0)
+        c = self._new_client(retry_policy=policy)
+        yield c.set('foo', 'bar')
+        try:
+            yield self._pause()
+            yield self._lose_reply(c, c.get('foo'))
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        self.assertEqual(policy.stats()['exhausted'], 1)
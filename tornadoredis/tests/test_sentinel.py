@@ -0,0 +1,201 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+import tornadoredis
+from tornadoredis.exceptions import (ConnectionError, TimeoutError,
+                                     MasterNotFoundError)
+
+from .redistest import (RedisTestCase, FakeRedisServer, array, bulk,
+                        multi_bulk)
+
+
+class FakeSentinel(FakeRedisServer):
+    """
+    Replies to the Sentinel commands used by the client.
+    """
+    service_name = 'mymaster'
+
+    def __init__(self, master, replicas=(), **kwargs):
+        super(FakeSentinel, self).__init__(**kwargs)
+        self.master = master
+        self.replicas = list(replicas)
+        self.queries = 0
+        self.subscribers = []
+
+    def on_close(self, stream):
+        if stream in self.subscribers:
+            self.subscribers.remove(stream)
+
+    def reply(self, stream, args):
+        command = [args[0].upper()] + args[1:]
+        if command[:2] == ['SENTINEL', 'get-master-addr-by-name']:
+            self.queries += 1
+            if command[2] != self.service_name or self.master is None:
+                return b'*-1\r\n'
+            return multi_bulk([self.master[0], str(self.master[1])])
+        if command[:2] == ['SENTINEL', 'slaves']:
+            return array([multi_bulk(['ip', host, 'port', str(port),
+                                       'flags', flags])
+                           for host, port, flags in self.replicas])
+        if command[0] == 'SUBSCRIBE':
+            self.subscribers.append(stream)
+            return array([bulk('subscribe'), bulk(command[1]), b':1\r\n'])
+        if command[0] == 'PING':
+            return b'+PONG\r\n'
+        return b'-ERR unknown command\r\n'
+
+    def switch_master(self, master):
+        old, self.master = self.master, master
+        body = '%s %s %s %s %s' % (self.service_name, old[0], old[1],
+                                   master[0], master[1])
+        for stream in self.subscribers:
+            stream.write(multi_bulk(['message', '+switch-master', body]))
+
+
+class SentinelTestCase(RedisTestCase):
+    sentinel_port = 26380
+    unused_port = 26381
+
+    def setUp(self):
+        super(SentinelTestCase, self).setUp()
+        self.fake = FakeSentinel(('127.0.0.1', self.test_port),
+                                 io_loop=self.io_loop)
+        self.fake.listen(self.sentinel_port)
+        self.sentinel = tornadoredis.Sentinel(
+            [('127.0.0.1', self.unused_port),
+             ('127.0.0.1', self.sentinel_port)],
+            io_loop=self.io_loop, retry_interval=0.1)
+
+    def tearDown(self):
+        self.sentinel.close()
+        self.fake.stop()
+        super(SentinelTestCase, self).tearDown()
+
+    def _pause(self, timeout=0.1):
+        return gen.Task(self.pause, timeout)
+
+    @gen_test
+    def test_discover_master(self):
+        master = yield self.sentinel.discover_master('mymaster')
+        self.assertEqual(master, ('127.0.0.1', self.test_port))
+        # The Sentinel that replied is asked first
+        self.assertEqual(self.sentinel.sentinels[0],
+                         ('127.0.0.1', self.sentinel_port))
+        try:
+            yield self.sentinel.discover_master('other')
+        except MasterNotFoundError:
+            pass
+        else:
+            self.fail('MasterNotFoundError is not raised')
+
+    @gen_test
+    def test_discover_replicas(self):
+        self.fake.replicas = [('127.0.0.1', 6380, 'slave'),
+                              ('127.0.0.1', 6390, 'slave,s_down')]
+        replicas = yield self.sentinel.discover_replicas('mymaster')
+        self.assertEqual(replicas, [('127.0.0.1', 6380)])
+
+    @gen_test
+    def test_pool(self):
+        pool = tornadoredis.SentinelConnectionPool('mymaster', self.sentinel,
+                                                   io_loop=self.io_loop)
+        c = self._new_client(pool=pool)
+        yield c.set('foo', 'bar')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        self.assertEqual(self.fake.queries, 1)
+        pool.close()
+
+    @gen_test
+    def test_replica_pool(self):
+        # Falls back to the master if there are no replicas
+        pool = tornadoredis.SentinelConnectionPool('mymaster', self.sentinel,
+                                                   role='replica',
+                                                   io_loop=self.io_loop)
+        c = self._new_client(pool=pool)
+        yield c.set('foo', 'bar')
+        self.assertEqual(self.fake.queries, 1)
+        self.fake.replicas = [('127.0.0.1', self.test_port, 'slave')]
+        yield gen.Task(c.disconnect)
+        c = self._new_client(pool=pool)
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        self.assertEqual(self.fake.queries, 1)
+        pool.close()
+
+    @gen_test
+    def test_switch_master(self):
+        # The master is down and never comes back
+        self.fake.master = ('127.0.0.1', self.unused_port)
+        pool = tornadoredis.SentinelConnectionPool('mymaster', self.sentinel,
+                                                   io_loop=self.io_loop)
+        c = self._new_client(pool=pool)
+        try:
+            yield c.get('foo')
+        except ConnectionError:
+            pass
+        else:
+            self.fail('ConnectionError is not raised')
+        yield self._pause()
+        self.fake.switch_master(('127.0.0.1', self.test_port))
+        yield self._pause()
+        self.assertEqual(pool.stats()['switches'], 1)
+        self.assertEqual(self.sentinel.masters['mymaster'],
+                         ('127.0.0.1', self.test_port))
+        yield c.set('foo', 'bar')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        pool.close()
+
+    @gen_test
+    def test_drain(self):
+        pool = tornadoredis.SentinelConnectionPool('mymaster', self.sentinel,
+                                                   io_loop=self.io_loop)
+        c = self._new_client(pool=pool)
+        idle = self._new_client(pool=pool)
+        yield [c.set('foo', 'bar'), idle.ping()]
+        yield gen.Task(idle.disconnect)
+        self.assertEqual(pool.stats()['available'], 1)
+        yield self._pause()
+        self.fake.switch_master(('127.0.0.1', self.test_port))
+        yield self._pause()
+        # Idle connections are closed, the ones in use are reconnected
+        self.assertEqual(pool.stats()['available'], 0)
+        self.assertFalse(c.connection.connected())
+        queries = self.fake.queries
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        self.assertEqual(self.fake.queries, queries + 1)
+        pool.close()
+
+    @gen_test
+    def test_resubscribe(self):
+        pool = tornadoredis.SentinelConnectionPool('mymaster', self.sentinel,
+                                                   io_loop=self.io_loop)
+        c = self._new_client(pool=pool)
+        yield c.set('foo', 'bar')
+        yield self._pause()
+        # The master is switched while the Sentinel is not reachable
+        for stream in list(self.fake.subscribers):
+            stream.close()
+        self.fake.master = ('localhost', self.test_port)
+        yield self._pause(0.3)
+        self.assertEqual(pool.stats()['switches'], 1)
+        self.assertEqual(self.sentinel.masters['mymaster'],
+                         ('localhost', self.test_port))
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+        pool.close()
+
+    @gen_test
+    def test_check_master_timeout(self):
+        master = yield self.sentinel.discover_master('mymaster')
+
+        @gen.coroutine
+        def discover_master(service_name):
+            raise TimeoutError('Timed out')
+
+        self.sentinel.discover_master = discover_master
+        # The failed check leaves the known master
+        yield self.sentinel._check_master('mymaster', ('localhost', 6379))
+        self.assertEqual(self.sentinel.masters['mymaster'], master)
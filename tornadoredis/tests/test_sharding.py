@@ -0,0 +1,188 @@
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornadoredis.connection import ConnectionPool
+from tornadoredis.exceptions import RequestError, ClusterError
+from tornadoredis.sharding import ShardedClient, HashRing
+
+from .redistest import FakeRedisServer, array, bulk
+
+
+class FakeShard(FakeRedisServer):
+    """
+    Serves GET, SET, MGET, MSET and DEL.
+    """
+    def __init__(self, **kwargs):
+        super(FakeShard, self).__init__(**kwargs)
+        self.data = {}
+        self.commands = 0
+
+    def reply(self, stream, args):
+        command = args[0].upper()
+        self.commands += 1
+        if command in ('SET', 'MSET'):
+            self.data.update(zip(args[1::2], args[2::2]))
+            return b'+OK\r\n'
+        if command == 'GET':
+            if args[1] not in self.data:
+                return b'$-1\r\n'
+            return bulk(self.data[args[1]])
+        if command == 'MGET':
+            return array([bulk(self.data[key]) if key in self.data
+                          else b'$-1\r\n' for key in args[1:]])
+        if command == 'DEL':
+            return b':%d\r\n' % len([key for key in args[1:]
+                                      if self.data.pop(key, None)
+                                      is not None])
+        return b'-ERR unknown command\r\n'
+
+
+class HashRingTestCase(AsyncTestCase):
+
+    def _keys(self):
+        return [('key:%d' % n).encode('utf-8') for n in range(10000)]
+
+    def test_distribution(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = {}
+        for key in self._keys():
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c', 'd'])
+        for count in counts.values():
+            self.assertTrue(1500 < count < 3500, counts)
+        self.assertEqual(HashRing().get_node(b'key'), None)
+
+    def test_remapping(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        before = dict((key, ring.get_node(key)) for key in self._keys())
+        ring.add_node('e')
+        moved = [key for key in before if ring.get_node(key) != before[key]]
+        # About 1/5 of the keys move, all of them to the new node
+        self.assertTrue(1000 < len(moved) < 3000, len(moved))
+        self.assertEqual(set(ring.get_node(key) for key in moved),
+                         set(['e']))
+        ring.remove_node('e')
+        self.assertEqual(dict((key, ring.get_node(key)) for key in before),
+                         before)
+
+    def test_weight(self):
+        ring = HashRing(['a'])
+        ring.add_node('b', weight=3)
+        count = len([key for key in self._keys() if ring.get_node(key) == 'b'])
+        self.assertTrue(6500 < count < 8500, count)
+
+
+class ShardedClientTestCase(AsyncTestCase):
+    ports = (27011, 27012, 27013)
+
+    def setUp(self):
+        super(ShardedClientTestCase, self).setUp()
+        self.shards = []
+        for port in self.ports:
+            shard = FakeShard(io_loop=self.io_loop)
+            shard.listen(port)
+            self.shards.append(shard)
+        self.client = ShardedClient(
+            [ConnectionPool(host='127.0.0.1', port=port, io_loop=self.io_loop)
+             for port in self.ports],
+            io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.client.close()
+        for shard in self.shards:
+            shard.stop()
+        super(ShardedClientTestCase, self).tearDown()
+
+    def _shard(self, key):
+        name = self.client.shard_for_key(key)
+        return self.shards[self.ports.index(int(name.split(':')[1]))]
+
+    @gen_test
+    def test_routing(self):
+        keys = ['key:%d' % n for n in range(30)]
+        for key in keys:
+            yield self.client.set(key, key.upper())
+        for key in keys:
+            self.assertEqual(self._shard(key).data[key], key.upper())
+        self.assertTrue(all(shard.data for shard in self.shards))
+        res = yield self.client.get(keys[0])
+        self.assertEqual(res, keys[0].upper())
+        self.assertEqual(sorted(self.client.pools),
+                         ['127.0.0.1:%d' % port for port in self.ports])
+
+    @gen_test
+    def test_multi_key(self):
+        keys = ['key:%d' % n for n in range(30)]
+        res = yield self.client.mset(dict((key, key.upper()) for key in keys))
+        self.assertEqual(res, True)
+        # A command per shard
+        self.assertEqual([shard.commands for shard in self.shards], [1, 1, 1])
+        res = yield self.client.mget(keys + ['missing'])
+        self.assertEqual(res, [key.upper() for key in keys] + [None])
+        res = yield self.client.delete(*keys[:10])
+        self.assertEqual(res, True)
+        res = yield self.client.mget(keys[:12])
+        self.assertEqual(res, [None] * 10 + [key.upper() for key in keys[10:12]])
+
+    @gen_test
+    def test_shard_failure(self):
+        keys = ['key:%d' % n for n in range(30)]
+        yield self.client.mset(dict((key, key) for key in keys))
+        self.shards[0].stop()
+        failed = '127.0.0.1:%d' % self.ports[0]
+        self.client.pools[failed].close()
+        try:
+            yield self.client.mget(keys)
+        except ClusterError as e:
+            self.assertEqual(list(e.errors), [failed])
+            self.assertIn('MGET failed on 1 of 3 shards', str(e))
+            self.assertEqual(e.result,
+                             [None if self.client.shard_for_key(key) == failed
+                              else key for key in keys])
+        else:
+            self.fail('ClusterError not raised')
+
+    @gen_test
+    def test_keyless(self):
+        try:
+            yield self.client.ping()
+        except RequestError:
+            pass
+        else:
+            self.fail('RequestError not raised')
+        name = self.client.shard_for_key('key')
+        client = self.client.shard_client(name)
+        res = yield client.get('key')
+        self.client.release_client(client)
+        self.assertEqual(res, None)
+        self.assertRaises(RequestError, self.client.pipeline)
+
+    @gen_test
+    def test_connection_state_commands(self):
+        client = self.client
+        self.assertRaises(RequestError, client.subscribe, 'foo')
+        self.assertRaises(RequestError, client.psubscribe, 'foo*')
+        self.assertRaises(RequestError, client.punsubscribe, 'foo*')
+        self.assertRaises(RequestError, client.listen, lambda msg: None)
+        self.assertRaises(RequestError, client.select, 1)
+        self.assertRaises(RequestError, client.auth, 'secret')
+        self.assertRaises(RequestError, client.execute_command,
+                          'PSUBSCRIBE', 'foo*')
+        self.assertRaises(RequestError, client.execute_command, 'AUTH',
+                          'secret')
+        self.assertEqual(client.subscribed, set())
+        res = yield client.get('key')
+        self.assertEqual(res, None)
+
+    @gen_test
+    def test_add_shard(self):
+        self.client.remove_shard('127.0.0.1:%d' % self.ports[2])
+        keys = ['key:%d' % n for n in range(300)]
+        before = dict((key, self.client.shard_for_key(key)) for key in keys)
+        self.assertEqual(len(set(before.values())), 2)
+        self.client.add_shard(ConnectionPool(host='127.0.0.1',
+                                             port=self.ports[2],
+                                             io_loop=self.io_loop))
+        moved = [key for key in keys
+                 if self.client.shard_for_key(key) != before[key]]
+        self.assertTrue(50 < len(moved) < 150, len(moved))
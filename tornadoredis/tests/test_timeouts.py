@@ -0,0 +1,89 @@
+import time
+
+from tornado import gen
+from tornado.testing import gen_test
+
+from tornadoredis.exceptions import TimeoutError
+
+from .redistest import RedisTestCase, async_test
+
+
+class TimeoutTestCase(RedisTestCase):
+
+    @async_test
+    @gen.engine
+    def test_command_timeout(self):
+        c = self._new_client()
+        started = time.time()
+        try:
+            # BLPOP waits for the list item forever
+            yield gen.Task(c.execute_command, 'BLPOP', 'foo', 0, timeout=0.1)
+        except TimeoutError:
+            pass
+        else:
+            self.fail('TimeoutError is not raised')
+        self.assertTrue(time.time() - started < 1)
+        # The late reply is dropped with the connection
+        res = yield gen.Task(c.set, 'foo', 'bar')
+        self.assertEqual(res, True)
+        res = yield gen.Task(c.get, 'foo')
+        self.assertEqual(res, 'bar')
+        self.stop()
+
+    @gen_test
+    def test_client_timeout(self):
+        c = self._new_client(command_timeout=0.1)
+        yield c.set('foo', 'bar')
+        # The server holds the replies to all clients for 300 ms
+        pauser = self._new_client()
+        yield pauser.execute_command('CLIENT', 'PAUSE', 300)
+        started = time.time()
+        try:
+            yield c.get('foo')
+        except TimeoutError:
+            pass
+        else:
+            self.fail('TimeoutError is not raised')
+        self.assertTrue(time.time() - started < 0.3)
+        yield gen.Task(self.io_loop.add_timeout, time.time() + 0.3)
+        # The connection is reset and used for the next command
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')
+
+    @gen_test
+    def test_blocking_command(self):
+        # The blocking command timeout is added to the client timeout
+        c = self._new_client(command_timeout=0.1)
+        res = yield c.blpop('foo', timeout=1)
+        self.assertEqual(res, {})
+
+    @gen_test
+    def test_multiplexed(self):
+        c = self._new_client(multiplexed=True)
+        yield c.set('foo', 'bar')
+        blpop = c.execute_command('BLPOP', 'bar', 0, timeout=0.1)
+        get = c.get('foo')
+        try:
+            yield blpop
+        except TimeoutError:
+            pass
+        else:
+            self.fail('TimeoutError is not raised')
+        # Commands sent after the timed out one are sent again
+        res = yield get
+        self.assertEqual(res, 'bar')
+
+    @gen_test
+    def test_pipeline(self):
+        c = self._new_client(command_timeout=0.1)
+        pipe = c.pipeline()
+        pipe.set('foo', 'bar')
+        pipe.execute_command('BLPOP', 'bar', 0, timeout=0.1)
+        try:
+            yield pipe.execute()
+        except TimeoutError:
+            pass
+        else:
+            self.fail('TimeoutError is not raised')
+        res = yield c.get('foo')
+        self.assertEqual(res, 'bar')